@@ -11,21 +11,26 @@ from genome import *
 
 #Very experimental, eventually should be developed into a full set operation function (e.g. unions, differences, etc.)
 def annotation_overlap(annotation_set_features1, annotation_set_features2):
-    annotation_coords_dict = {}
-    contained_list = []
-    for annotation in annotation_set_features1:
-        annotation_obj = annotation_set_features1[annotation]
-        seqid = annotation_obj.seqid
-        if seqid in annotation_coords_dict:
-            annotation_coords_dict[seqid].append(annotation_obj.get_coords())
-        else:
-            annotation_coords_dict[seqid] = [annotation_obj.get_coords()]
+    """returns list of IDs of features in annotation_set_features2 that overlap features in annotation_set_features1,
+    with each ID listed once for every feature it overlaps"""
+    interval_index = IntervalIndex(annotation_set_features1)
+    seqid_features = {}
     for annotation in annotation_set_features2:
         annotation_obj = annotation_set_features2[annotation]
-        seqid = annotation_obj.seqid
-        coords2 = annotation_obj.get_coords()
-        if seqid in annotation_coords_dict:
-            for coords1 in annotation_coords_dict[seqid]:
-                if coords1[0] <= coords2[0] <= coords1[1] or coords1[0] <= coords2[1] <= coords1[1]:
-                    contained_list.append(annotation_obj.ID)
-    return contained_list
\ No newline at end of file
+        coords = annotation_obj.get_coords()
+        if coords != None:
+            if annotation_obj.seqid in seqid_features:
+                seqid_features[annotation_obj.seqid].append((annotation, coords))
+            else:
+                seqid_features[annotation_obj.seqid] = [(annotation, coords)]
+    overlap_counts = {}
+    for seqid in seqid_features:
+        counts = interval_index.count_overlapping(seqid, [feature[1][0] for feature in seqid_features[seqid]],
+                                                  [feature[1][1] for feature in seqid_features[seqid]])
+        for feature_index in numpy.nonzero(counts)[0]:
+            overlap_counts[seqid_features[seqid][feature_index][0]] = counts[feature_index]
+    contained_list = []
+    for annotation in annotation_set_features2:
+        if annotation in overlap_counts:
+            contained_list.extend([annotation_set_features2[annotation].ID] * overlap_counts[annotation])
+    return contained_list
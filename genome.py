@@ -9,12 +9,20 @@
 #overlap with CDS feature regions will result in the UTRs being lost (because exon features are usually summarily ignored).
 #Additionally, even if you manage to import UTRs, most output will likely ignore them. Bug us about it on a github ticket
 #and we may well fix it.
-#
-#Importing GFFs still quite slow, likely having to do with ID assignment. Will try to fix soon.
 
 
+import ast
+import bisect
 import copy
+import gc
+import hashlib
+import heapq
+import mmap
+import multiprocessing
 import StringIO
+import sys
+import tempfile
+import weakref
 from magot_smallfuncs import *
 
 import numpy
@@ -59,7 +67,7 @@ def vulgar2gff(vulgarlist, feature_types=['match','match_part'],source='exonerat
                 if not addfeat:
                     addfeat = True
                     line_to_add = [tname,source,feature_types[1]]
-                    coords = [str(tposition)]
+                    coords = [tposition]
                 else:
                     pass
             elif addfeat:
@@ -76,131 +84,240 @@ def vulgar2gff(vulgarlist, feature_types=['match','match_part'],source='exonerat
                 tposition = tposition - int(field)
             if addfeat == True:
                 if tstrand == '+':
-                    coords.append(str(tposition-1))
+                    coords.append(tposition-1)
                 elif tstrand == '-':
-                    coords.append(str(tposition+1))
+                    coords.append(tposition+1)
     if addfeat:
         gfflines.append('\t'.join(line_to_add+[str(min(coords)),str(max(coords)),'.',tstrand,'.',
                                                        'ID='+qname+'_'+feature_types[1]+str(IDnum)+';Parent='+qname]))
     return '\n'.join(gfflines)
 
 
-def read_exonerate(exonerate_output,annotation_set_to_modify = None):
-    if annotation_set_to_modify == None:
-        annotation_set = AnnotationSet()
+def get_vulgar_match_parts(vulgarlist):
+    """takes vulgar alignment list (e.g. vulgarstring.split() ) and returns list of (start, end) target coords of its
+    aligned blocks (runs of M, S, G and F operations), in the order vulgar2gff gives them"""
+    tstrand = vulgarlist[7]
+    if tstrand == "+":
+        tposition = int(vulgarlist[5]) + 1
+        step = 1
     else:
-        annotation_set = annotation_set_to_modify
-    exonerate_lines = ensure_file(exonerate_output)
-    gfflines = []
-    IDdic = {}
+        tposition = int(vulgarlist[5])
+        step = -1
+    match_parts = []
+    block_start = None
+    vulgartrips = vulgarlist[9:]
+    for i in range(0, len(vulgartrips) - 2, 3):
+        if vulgartrips[i] in 'MSGF':
+            if block_start == None:
+                block_start = tposition
+        elif block_start != None:
+            match_parts.append((min(block_start, block_end), max(block_start, block_end)))
+            block_start = None
+        tposition = tposition + step * int(vulgartrips[i + 2])
+        block_end = tposition - step
+    if block_start != None:
+        match_parts.append((min(block_start, block_end), max(block_start, block_end)))
+    return match_parts
+
+
+def iter_exonerate_records(exonerate_file):
+    """yields (query name, target name, target strand, raw score, match_parts) for each vulgar line of exonerate output,
+    where match_parts is as given by get_vulgar_match_parts. Names are taken from the Query and Target lines of the
+    alignment, as they can contain spaces that the names in the vulgar line can't"""
     qname = ""
     tname = ""
-    for original_line in exonerate_lines:
-        line = original_line.replace('\r','').replace('\n','')
+    for line in exonerate_file:
         if line[:16] == "         Query: ":
-            qname = line[16:]
+            qname = line[16:].rstrip('\r\n')
         elif line[:16] == "        Target: ":
-            tname = line[16:].replace(':[revcomp]','').replace('[revcomp]','')
+            tname = line[16:].rstrip('\r\n').replace(':[revcomp]','').replace('[revcomp]','')
             if tname[-1] == " ":
                 tname = tname[:-1]
         elif line[:8] == "vulgar: ":
             vulgar_line_list = line[8:].split()
-            #trying to makesure IDs are unique
-            vulgar_line_list[0] = qname
-            vulgar_line_list[4] = tname
-            ID = vulgar_line_list[0] + '-against-' + vulgar_line_list[4]
-            if ID in IDdic:
-                vulgar_line_list[0] = vulgar_line_list[0] + str(IDdic[ID])
-                IDdic[ID] = IDdic[ID] + 1
-            else:
-                IDdic[ID] = 1
-            gfflines.append(vulgar2gff(vulgar_line_list))
-    read_gff("\n".join(gfflines), annotation_set_to_modify = annotation_set)
+            yield qname, tname, vulgar_line_list[7], vulgar_line_list[8], get_vulgar_match_parts(vulgar_line_list)
+
+
+def parse_exonerate_file(exonerate_location):
+    """returns list of the records (see iter_exonerate_records) of the exonerate output at exonerate_location. Used by
+    read_exonerate in worker processes"""
+    gc.disable()
+    return list(iter_exonerate_records(open(exonerate_location)))
+
+
+def get_exonerate_inputs(exonerate_output):
+    """returns list of exonerate outputs to read from exonerate_output, which can be a file location, opened file,
+    string, directory (whose files are read in order of name) or list of any of these"""
+    if type(exonerate_output) in [list, tuple]:
+        return [exonerate_input for each_output in exonerate_output for exonerate_input in get_exonerate_inputs(each_output)]
+    elif type(exonerate_output) == str and os.path.isdir(exonerate_output):
+        return [os.path.join(exonerate_output, file_name) for file_name in sorted(os.listdir(exonerate_output))
+                if os.path.isfile(os.path.join(exonerate_output, file_name))]
+    else:
+        return [exonerate_output]
+
+
+def read_exonerate(exonerate_output,annotation_set_to_modify = None, workers = 1, source = 'exonerate'):
+    """Reads exonerate output with vulgar lines into match and match_part features of an AnnotationSet, giving the same
+    features as reading the gff of vulgar2gff. exonerate_output can be a file location, opened file, string, directory
+    or list of these (see get_exonerate_inputs), which are read as if they were one file joined together in order.
+    Records are read one at a time, so outputs of any size can be read. If workers is more than 1 and there is more than
+    one file, files are parsed by that many worker processes; features are still made in this process in input order,
+    so their IDs are the same as with one worker."""
+    if annotation_set_to_modify == None:
+        annotation_set = AnnotationSet()
+    else:
+        annotation_set = annotation_set_to_modify
+    exonerate_inputs = get_exonerate_inputs(exonerate_output)
+    pool = None
+    if workers > 1 and len(exonerate_inputs) > 1 and all([type(each_input) == str and os.path.isfile(each_input)
+                                                          for each_input in exonerate_inputs]):
+        pool = multiprocessing.Pool(min(workers, len(exonerate_inputs)))
+        record_lists = pool.imap(parse_exonerate_file, exonerate_inputs)
+    else:
+        record_lists = (iter_exonerate_records(ensure_file(each_input)) for each_input in exonerate_inputs)
+    ID_index = annotation_set.ID_index
+    for feature_type in ['match', 'match_part']:
+        if not feature_type in annotation_set.__dict__:
+            setattr(annotation_set, feature_type, {})
+    matches = annotation_set.match
+    match_parts = annotation_set.match_part
+    IDdic = {}
+    generate_new_ID_dict = {}
+    #(match, coords) of each match, whose coords are cached once the matches are all read
+    match_coords = []
+    garbage_collection = gc.isenabled()
+    gc.disable()
+    try:
+        for records in record_lists:
+            for qname, tname, tstrand, score, match_part_coords in records:
+                #trying to makesure IDs are unique
+                ID = qname + '-against-' + tname
+                if ID in IDdic:
+                    qname = qname + str(IDdic[ID])
+                    IDdic[ID] = IDdic[ID] + 1
+                else:
+                    IDdic[ID] = 1
+                match_ID = get_unused_ID(qname + '-against-' + tname, ID_index, generate_new_ID_dict)
+                other_attributes = {'source': source}
+                try:
+                    other_attributes['score'] = float(score)
+                except ValueError:
+                    pass
+                match_part_IDs = [get_unused_ID(qname + '-against-' + tname + '_match_part' + str(match_part_number + 1),
+                                                ID_index, generate_new_ID_dict)
+                                  for match_part_number in range(len(match_part_coords))]
+                match = ParentAnnotation(match_ID, tname, 'match', match_part_IDs, None, tstrand, annotation_set, other_attributes)
+                matches[match_ID] = match
+                for match_part_ID, coords in zip(match_part_IDs, match_part_coords):
+                    match_parts[match_part_ID] = BaseAnnotation(match_part_ID, tname, coords, 'match_part', match_ID, tstrand,
+                                                                {'source': source}, annotation_set)
+                if match_part_coords != []:
+                    match_coords.append((match, (min([coords[0] for coords in match_part_coords]),
+                                                 max([coords[1] for coords in match_part_coords]))))
+    finally:
+        if pool != None:
+            pool.terminate()
+        if garbage_collection:
+            gc.enable()
+    if annotation_set_to_modify == None:
+        annotation_set.compact()
+    #the coords of the matches are cached here, as finalize would, once compact can no longer change attribute order
+    for match, coords in match_coords:
+        match.cached_coords = coords
     if annotation_set_to_modify == None:
         return annotation_set
+
+
+def get_unused_ID(ID, ID_index, generate_new_ID_dict):
+    """returns ID, or if it is already in ID_index, ID renamed as read_gff renames duplicate IDs (ID2, ID-3, ID-4...)"""
+    if ID in ID_index:
+        if ID in generate_new_ID_dict:
+            generate_new_ID_dict[ID] = generate_new_ID_dict[ID] + 1
+            ID = ID + "-" + str(generate_new_ID_dict[ID])
+        else:
+            generate_new_ID_dict[ID] = 2
+            ID = ID + '2'
+    return ID
     
     
-def write_longform_gff(annotation_set,keep_UTR_features = False):
-    """returns gff string formated for compatability with Apollo genome annotation """
-    gfflines = []
-    fields = ['seqid','source','feature_type','get_coords()[0]','get_coords()[1]','score','strand','phase']
+def get_gff_fields(feature, missing_field_errors = AttributeError):
+    """returns list of the first 8 gff columns (seqid, source, type, start, end, score, strand, phase) of feature as
+    strings. Columns that raise missing_field_errors (for example attributes the feature doesn't have) are '.'"""
+    fields_list = []
+    for field in ['seqid', 'source', 'feature_type']:
+        try:
+            fields_list.append(str(getattr(feature, field)))
+        except missing_field_errors:
+            fields_list.append('.')
+    for coord_index in [0, 1]:
+        try:
+            fields_list.append(str(feature.get_coords()[coord_index]))
+        except missing_field_errors:
+            fields_list.append('.')
+    for field in ['score', 'strand', 'phase']:
+        try:
+            fields_list.append(str(getattr(feature, field)))
+        except missing_field_errors:
+            fields_list.append('.')
+    return fields_list
+
+
+def iter_longform_gff(annotation_set, keep_UTR_features = False):
+    """yields the lines of write_longform_gff one at a time"""
+    fields = ['seqid','source','feature_type','score','strand','phase']
     #adds matches to gff
     if 'match' in annotation_set.__dict__:
         for match in annotation_set.match:
             match_obj = annotation_set.match[match]
-            newline_list = []
-            for field in fields:
-                try:
-                    newline_list.append(str(eval('match_obj.' + field)))
-                except:
-                    newline_list.append('.')
+            newline_list = get_gff_fields(match_obj, Exception)
             attribute_list = ['ID=' + match_obj.ID]
             for attribute in match_obj.__dict__:
-                if not attribute in fields+['annotation_set','parent','child_list','ID']:
-                    attribute_list.append(attribute + '=' + eval('match_obj.' + attribute))
+                if not attribute in fields+['annotation_set','parent','child_list','cached_coords','ID']:
+                    attribute_list.append(attribute + '=' + match_obj.__dict__[attribute])
             newline_list.append(';'.join(attribute_list))
-            gfflines.append('\t'.join(newline_list))
+            yield '\t'.join(newline_list)
             for match_part in match_obj.child_list:
                 match_part_obj = annotation_set[match_part]
-                newline_list = []
-                for field in fields:
-                    try:
-                        newline_list.append(str(eval('match_part_obj.' + field)))
-                    except:
-                        newline_list.append('.')
+                newline_list = get_gff_fields(match_part_obj, Exception)
                 attribute_list = ['ID=' + match_part_obj.ID,'Parent=' + match_part_obj.parent]
                 for attribute in match_part_obj.__dict__:
                     if not attribute in fields+['annotation_set','parent','child_list','ID','coords']:
-                        attribute_list.append(attribute + '=' + eval('match_part_obj.' + attribute))
+                        attribute_list.append(attribute + '=' + match_part_obj.__dict__[attribute])
                 newline_list.append(';'.join(attribute_list))
-                gfflines.append('\t'.join(newline_list))
+                yield '\t'.join(newline_list)
         #adds genes to gff
     if 'gene' in annotation_set.__dict__:
         for gene in annotation_set.gene:
             gene_obj = annotation_set.gene[gene]
-            newline_list = []
-            for field in fields:
-                try:
-                    newline_list.append(str(eval('gene_obj.' + field)))
-                except:
-                    newline_list.append('.')
+            newline_list = get_gff_fields(gene_obj, Exception)
             attribute_list = ['ID='+gene_obj.ID]
             for attribute in gene_obj.__dict__:
-                if not attribute in fields+['annotation_set','parent','child_list','ID']:
-                    attribute_list.append(attribute + '=' + eval('gene_obj.' + attribute))
+                if not attribute in fields+['annotation_set','parent','child_list','cached_coords','ID']:
+                    attribute_list.append(attribute + '=' + gene_obj.__dict__[attribute])
             newline_list.append(';'.join(attribute_list))
-            gfflines.append('\t'.join(newline_list))
+            yield '\t'.join(newline_list)
             for gene_child in gene_obj.child_list:
                 gene_child_obj = annotation_set[gene_child]
                 if gene_child_obj.feature_type == 'transcript':
                     transcript_obj = gene_child_obj
-                    newline_list = []
-                    for field in fields:
-                        try:
-                            newline_list.append(str(eval('transcript_obj.'+field)).replace('transcript','mRNA'))
-                        except:
-                            newline_list.append('.')
+                    newline_list = [field.replace('transcript','mRNA') for field in get_gff_fields(transcript_obj, Exception)]
                     attribute_list = ['ID='+transcript_obj.ID,'Parent='+transcript_obj.parent]
-                    for attribute in gene_obj.__dict__:
-                        if not attribute in fields+['annotation_set','parent','child_list','ID']:
-                            attribute_list.append(attribute + '=' + eval('transcript_obj.' + attribute))
+                    for attribute in transcript_obj.__dict__:
+                        if not attribute in fields+['annotation_set','parent','child_list','cached_coords','ID']:
+                            attribute_list.append(attribute + '=' + transcript_obj.__dict__[attribute])
                     newline_list.append(';'.join(attribute_list))
-                    gfflines.append('\t'.join(newline_list))
+                    yield '\t'.join(newline_list)
                     exondict = {}
                     CDS_UTR_dict = {}
                     for transcript_child in transcript_obj.child_list:
                         transcript_child_obj = annotation_set[transcript_child]
-                        line_base_list = []
-                        for field in fields:
-                            try:
-                                line_base_list.append(str(eval('transcript_child_obj.'+ field)))
-                            except:
-                                line_base_list.append('.')
+                        line_base_list = get_gff_fields(transcript_child_obj, Exception)
                         exon_attributes = 'ID=' + transcript_child_obj.ID + '-exon;Parent=' + transcript_child_obj.parent
                         transcript_child_attribute_list = ['ID=' + transcript_child_obj.ID, 'Parent=' + transcript_child_obj.parent]
                         for attribute in transcript_child_obj.__dict__:
                             if not attribute in fields+['annotation_set','parent','child_list','ID','coords']:
-                                transcript_child_attribute_list.append(attribute + '=' + eval('transcript_child_obj.' + attribute))
+                                transcript_child_attribute_list.append(attribute + '=' + transcript_child_obj.__dict__[attribute])
                         transcript_child_attributes = ';'.join(transcript_child_attribute_list)
                         exondict[transcript_child_obj.coords] = '\t'.join(line_base_list).replace('CDS','exon').replace('UTR','exon') + '\t' + exon_attributes
                         CDS_UTR_dict[transcript_child_obj.coords] = '\t'.join(line_base_list) +'\t' + transcript_child_attributes
@@ -215,29 +332,279 @@ def write_longform_gff(annotation_set,keep_UTR_features = False):
                             new_exon_list = exondict[exondict_list[i+1]].split('\t')
                             exondict[exondict_list[i+1]] = '\t'.join(new_exon_list[:3]+[str(exondict_list[i][0]),str(exondict_list[i+1][1])]+new_exon_list[5:])
                         else:
-                            gfflines.append(exondict[exondict_list[i]])
-                    gfflines.append(exondict[exondict_list[-1]])
+                            yield exondict[exondict_list[i]]
+                    yield exondict[exondict_list[-1]]
                     for i in CDS_UTR_dict_list:
                         if CDS_UTR_dict[i].split('\t')[2] == 'CDS' or keep_UTR_features:
-                            gfflines.append(CDS_UTR_dict[i])
+                            yield CDS_UTR_dict[i]
                 else:
                     print 'ERROR: currently only accepts AnnotationSets with gene format CDS/UTR -> transcript -> gene'
                     break
-    return '\n'.join(gfflines)
 
-def write_gff(annotation_set, gff_format = "simple gff3"):
-    gff_lines = []
+
+def write_longform_gff(annotation_set,keep_UTR_features = False, out_file = None):
+    """returns gff string formated for compatability with Apollo genome annotation. If out_file (an open file) is given,
+    lines are instead written to it one at a time, each ending in a newline"""
+    if out_file == None:
+        return '\n'.join(iter_longform_gff(annotation_set, keep_UTR_features))
+    else:
+        for line in iter_longform_gff(annotation_set, keep_UTR_features):
+            out_file.write(line + '\n')
+
+
+def iter_gff(annotation_set, gff_format = "simple gff3"):
+    """yields the lines of write_gff one at a time, so that only one top-level feature's lines are held at once"""
     for attribute in annotation_set.__dict__:
-        if type(annotation_set.__dict__[attribute]) == dict:
-            if len(annotation_set.__dict__[attribute]) > 0:
-                if annotation_set.__dict__[attribute][list(annotation_set.__dict__[attribute])[0]].__class__.__name__ == "ParentAnnotation" or annotation_set.__dict__[attribute][list(annotation_set.__dict__[attribute])[0]].__class__.__name__ == "BaseAnnotation":
-                    if annotation_set.__dict__[attribute][list(annotation_set.__dict__[attribute])[0]].parent == None:
-                        for annotationID in annotation_set.__dict__[attribute]:
-                            annotation = annotation_set.__dict__[attribute][annotationID]
-                            gff_lines.append(annotation.get_gff(gff_format))
-    return '\n'.join(gff_lines)
-                        
+        features = annotation_set.__dict__[attribute]
+        if isinstance(features, FeatureDict) and len(features) > 0:
+            first_feature = features[iter(features).next()]
+            if first_feature.__class__.__name__ in ["ParentAnnotation", "BaseAnnotation"] and first_feature.parent == None:
+                for annotationID in features:
+                    for line in features[annotationID].iter_gff_lines(gff_format):
+                        yield line
+
+
+def get_gff_sort_key(line):
+    """returns (seqid, start, -end) of a gff line, with 0 for a start or end that isn't a number"""
+    fields = line.split('\t', 5)
+    try:
+        start = int(fields[3])
+    except (IndexError, ValueError):
+        start = 0
+    try:
+        end = int(fields[4])
+    except (IndexError, ValueError):
+        end = 0
+    return fields[0], start, -end
+
+
+def read_gff_sort_run(run_file):
+    """yields (seqid, start, -end, line number, line) from a temporary file of a sorted run written by sort_gff_lines"""
+    run_file.seek(0)
+    for run_line in run_file:
+        line_number, line = run_line[:-1].split('\t', 1)
+        yield get_gff_sort_key(line) + (int(line_number), line)
+
+
+def sort_gff_lines(gff_lines, memory_budget = 2**30):
+    """yields gff lines (skipping empty lines) sorted by seqid, then start, then end with the longest first so that
+    parents come before children that start where they do, with lines that tie kept in the order given. Lines are
+    sorted in memory until they take about memory_budget bytes; past that, sorted runs of lines are written to
+    temporary files and merged as they are yielded"""
+    run_files = []
+    run = []
+    run_size = 0
+    line_number = 0
+    for line in gff_lines:
+        if line == "":
+            continue
+        run.append(get_gff_sort_key(line) + (line_number, line))
+        line_number = line_number + 1
+        #rough size of the line plus its key and tuple
+        run_size = run_size + len(line) + 200
+        if run_size > memory_budget:
+            run.sort()
+            run_file = tempfile.TemporaryFile()
+            for entry in run:
+                run_file.write(str(entry[3]) + '\t' + entry[4] + '\n')
+            run_files.append(run_file)
+            run = []
+            run_size = 0
+    run.sort()
+    if run_files == []:
+        for entry in run:
+            yield entry[4]
+    else:
+        for entry in heapq.merge(iter(run), *[read_gff_sort_run(run_file) for run_file in run_files]):
+            yield entry[4]
+        for run_file in run_files:
+            run_file.close()
+
+
+def write_gff(annotation_set, gff_format = "simple gff3", out_file = None, sort_output = False, memory_budget = 2**30):
+    """returns gff string of the features of annotation_set (see ParentAnnotation.get_gff for gff_format). If out_file
+    (an open file) is given, lines are instead written to it one at a time, each ending in a newline.
+    
+    If sort_output is True, lines are sorted by seqid and start (see sort_gff_lines), spilling to temporary files
+    once they take more than about memory_budget bytes"""
+    gff_lines = iter_gff(annotation_set, gff_format)
+    if sort_output:
+        gff_lines = sort_gff_lines(gff_lines, memory_budget)
+    if out_file == None:
+        return '\n'.join(gff_lines)
+    else:
+        for line in gff_lines:
+            out_file.write(line + '\n')
+
+
+gff_presets = {}
+gff_presets["augustus"] = {'features_to_ignore': ['gene','transcript','stop_codon','terminal','internal','initial','intron',
+                                                 'start_codon','single'],
+                           'parent_field': None, 'parents_hierarchy': ['transcript_id','gene_id'], 'IDfield': None}
+gff_presets["RepeatMasker"] = {'parent_field': None, 'IDfield': 'Target'}
+gff_presets["CEGMA"] = {'parent_field': '', 'IDfield': None, 'parents_hierarchy': ['gene_id'],
+                        'features_to_replace': [['First','CDS'],['Internal','CDS'],['Terminal','CDS'],['Single','CDS']],
+                        'gff_version': 3}
+
+
+class GffTokenizer():
+    """Splits the lines of a gff3 or gtf file into the fields read_gff builds features from. Options are those of read_gff
+    (see read_gff). If gff_version is "auto", the version is found from the attributes of the first feature line, and for
+    gtf files without IDfield attributes IDfield and parent_field are dropped in favor of a parents_hierarchy of
+    transcript_id and gene_id"""
+    def __init__(self, features_to_ignore = ['exon'], gff_version = "auto", parents_hierarchy = [], features_to_replace = [],
+                 IDfield = "ID", parent_field = "Parent"):
+        if type(features_to_ignore) == str:
+            features_to_ignore = [features_to_ignore]
+        self.features_to_ignore = set(features_to_ignore)
+        self.version = gff_version
+        self.parents_hierarchy = parents_hierarchy
+        self.replacement_types = dict([(feature[0], feature[1]) for feature in features_to_replace])
+        self.IDfield = IDfield
+        self.parent_field = parent_field
+        self.bad_attribute = None
+    
+    def find_version(self, attribute_field):
+        if "=" in attribute_field:
+            self.version = 3
+        else:
+            self.version = 2
+            if not self.IDfield == None:
+                if not " " + self.IDfield + " " in " " + attribute_field.replace(';',' ') and self.parents_hierarchy == []:
+                    self.IDfield = None
+                    self.parent_field = None
+                    if "gene_id" in attribute_field and "transcript_id" in attribute_field:
+                        self.parents_hierarchy = ['transcript_id','gene_id']
+                    elif "gene_id" in attribute_field:
+                        self.parents_hierarchy = ['gene_id']
+    
+    def parse_gff3_attributes(self, attribute_field):
+        defline_dict = {}
+        for defline_field in attribute_field.split(';'):
+            if defline_field != "":
+                key_value = defline_field.split('=', 2)
+                defline_dict[key_value[0]] = key_value[1]
+        return defline_dict
+    
+    def parse_gtf_attributes(self, attribute_field):
+        defline_dict = {}
+        for defline_field in attribute_field.split(';'):
+            if defline_field != "":
+                if '"' in defline_field:
+                    defline_dict[defline_field.split(None, 1)[0]] = defline_field.split('"', 2)[1]
+                else:
+                    key_value = defline_field.split()
+                    if len(key_value) < 2:
+                        self.bad_attribute = defline_field
+                        return None
+                    defline_dict[key_value[0]] = key_value[1]
+        return defline_dict
     
+    def parse_whole_attributes(self, attribute_field):
+        defline_dict = {}
+        for defline_field in attribute_field.split(';'):
+            if defline_field != "":
+                defline_dict[""] = defline_field
+        return defline_dict
+    
+    def get_attribute_parser(self):
+        """returns the function that parses the 9th column of a line into a dictionary of attributes (None, with the
+        offending attribute in bad_attribute, if a gtf attribute has no value)"""
+        if self.parent_field == "":
+            return self.parse_whole_attributes
+        elif self.version == 3:
+            return self.parse_gff3_attributes
+        elif self.version == 2:
+            return self.parse_gtf_attributes
+        else:
+            return lambda attribute_field: {}
+    
+    def tokenize(self, gff_file):
+        """yields (seqid, feature_type, coords, strand, other_attributes, defline_dict, parent, ID) for each feature line
+        of gff_file not in features_to_ignore, where ID is the ID before any renaming of duplicates. Lines with the same
+        attributes as the line before share its defline_dict, so it should not be modified. Yields None and stops if a
+        line can't be read"""
+        parse_attributes = None
+        features_to_ignore = self.features_to_ignore
+        replacement_types = self.replacement_types
+        phases = {'0': 0, '1': 1, '2': 2}
+        last_attribute_field = None
+        for line in gff_file:
+            if line[:1] == "#":
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) != 9:
+                continue
+            if parse_attributes == None:
+                if self.version == "auto":
+                    self.find_version(fields[8])
+                parse_attributes = self.get_attribute_parser()
+                IDfield = self.IDfield
+                parent_field = self.parent_field
+                parents_hierarchy = self.parents_hierarchy
+            seqid, source, feature_type, start, end, score, strand, phase, attribute_field = fields
+            if feature_type in replacement_types:
+                feature_type = replacement_types[feature_type]
+            if feature_type in features_to_ignore:
+                continue
+            start = int(start)
+            end = int(end)
+            if start <= end:
+                coords = (start, end)
+            else:
+                coords = (end, start)
+            other_attributes = {'source': source}
+            if score != '.':
+                try:
+                    other_attributes['score'] = float(score)
+                except ValueError:
+                    pass
+            if phase in phases:
+                other_attributes['phase'] = phases[phase]
+            #lines of the same transcript often have the same attributes, in which case they are only parsed once
+            if attribute_field != last_attribute_field:
+                defline_dict = parse_attributes(attribute_field)
+                if defline_dict == None:
+                    yield None
+                    return
+                last_attribute_field = attribute_field
+                #Tries to figure out parent
+                parent = None
+                if parent_field != None:
+                    if parent_field in defline_dict:
+                        parent = defline_dict[parent_field]
+                elif parents_hierarchy != []:
+                    for parent_type in parents_hierarchy:
+                        if parent_type in defline_dict:
+                            parent = defline_dict[parent_type]
+                            break
+            #Assigns ID
+            if IDfield != None and IDfield in defline_dict:
+                ID = defline_dict[IDfield]
+            elif parent != None:
+                ID = parent + '-' + feature_type
+            elif IDfield != None:
+                ID = None
+            else:
+                ID = seqid + '-' + feature_type + fields[3]
+            yield seqid, feature_type, coords, strand, other_attributes, defline_dict, parent, ID
+
+
+#Genome whose Apollo gffs are being written by Genome.write_apollo_gffs, which worker processes inherit when forked
+apollo_export_genome = None
+
+
+def write_apollo_gff_file(arguments):
+    """takes (seqid, out_location, header_lines, suppress_fasta) and writes header_lines then the Apollo gff of seqid from
+    apollo_export_genome to out_location. Used by Genome.write_apollo_gffs, including in worker processes"""
+    seqid, out_location, header_lines, suppress_fasta = arguments
+    out = open(out_location, 'w')
+    if header_lines != []:
+        out.write('\n'.join(header_lines) + '\n')
+    apollo_export_genome.write_apollo_gff(seqid, suppress_fasta = suppress_fasta, out_file = out)
+    out.close()
+    return seqid
+
 
 def read_gff(gff,annotation_set_to_modify = None, base_features = ['CDS','match_part','similarity','region'],features_to_ignore = ['exon'],
     gff_version = "auto", parents_hierarchy = [], features_to_replace = [], IDfield = "ID", parent_field = "Parent", presets = None):
@@ -256,115 +623,42 @@ def read_gff(gff,annotation_set_to_modify = None, base_features = ['CDS','match_
     this defline, the word before the underscore is used as the parent feature type. The "Parent"
     defline attribute is reserved for the imediate parent of the feature- if not given, this will be assumed to
     be the lowest-level parent specified in defline.
+    
+    presets may be the name of a configuration in gff_presets ("augustus", "RepeatMasker" or "CEGMA"), whose options
+    replace those given. Lines are split into fields by a GffTokenizer.
     """
-    replace_dict = {"\n":"","\r":""}
-    presets_dict = {}
-    presets_dict["augustus"] = "features_to_ignore = ['gene','transcript','stop_codon','terminal','internal','initial','intron',\
-        'start_codon','single']\nparent_field = None\nparents_hierarchy = ['transcript_id','gene_id']\nIDfield = None"
-    presets_dict["RepeatMasker"] = "parent_field = None\nIDfield = 'Target'"
-    presets_dict["CEGMA"] = "parent_field = ''\nIDfield = None\nparents_hierarchy = ['gene_id']\nfeatures_to_replace = \
-        [['First','CDS']['Internal','CDS']['Terminal','CDS']['Single','CDS']]\ngff_version = 3"
-    if presets in presets_dict:
-        exec(presets_dict[presets])
-    version = gff_version
+    options = {'features_to_ignore': features_to_ignore, 'gff_version': gff_version, 'parents_hierarchy': parents_hierarchy,
+               'features_to_replace': features_to_replace, 'IDfield': IDfield, 'parent_field': parent_field}
+    if presets in gff_presets:
+        options.update(gff_presets[presets])
+    tokenizer = GffTokenizer(**options)
     gff_file = ensure_file(gff)
-    for feature in features_to_replace:
-        replace_dict["\t" + feature[0] + "\t"] = "\t" + feature[1] + "\t"
     if annotation_set_to_modify == None:
         annotation_set = AnnotationSet()
     else:
         annotation_set = annotation_set_to_modify
+    ID_index = annotation_set.ID_index
+    base_features = set(base_features)
     #this dictionary helps generate names if features passed with identical ID fields
     generate_new_ID_dict = {}
-    #figures out which feature types are base annotations
-    base_dict = {}
-    #here we go folks
-    for original_line in gff_file:
-        if original_line[0] != "#" and original_line.count('\t') == 8:
-            line = original_line
-            for string in replace_dict:
-                line = line.replace(string,replace_dict[string])
-            fields = line.split('\t')
-            if version == "auto":
-                if "=" in fields[8]:
-                    version = 3
-                else:
-                    version = 2
-                    if not IDfield == None:
-                        if not " " + IDfield + " " in " " + fields[8].replace(';',' ') and parents_hierarchy == []:
-                            IDfield = None
-                            parent_field = None
-                            if "gene_id" in fields[8] and "transcript_id" in fields[8]:
-                                parents_hierarchy = ['transcript_id','gene_id']
-                            elif "gene_id" in fields[8]:
-                                parents_hierarchy = ['gene_id']
-            ID = None
-            parent = None
-            other_attributes = {}
-            seqid = fields[0]
-            other_attributes['source'] = fields[1]
-            feature_type = fields[2]
-            if feature_type in features_to_ignore:
-                continue
-            coords = [int(fields[3]),int(fields[4])]
-            coords.sort()
-            coords = tuple(coords)
-            try:
-                other_attributes['score'] = float(fields[5])
-            except ValueError:
-                pass
-            strand = fields[6]
-            if fields[7] in ['0','1','2']:
-                other_attributes['phase'] = int(fields[7])
-            defline_dict = {}
-            for defline_field in fields[8].split(';'):
-                if defline_field != "":
-                    if parent_field == "":
-                        defline_dict[""] = defline_field
-                    elif version == 2:
-                        if '"' in defline_field:
-                            defline_dict[defline_field.split()[0]] = defline_field.split('"')[1]
-                        else:
-                            try: defline_dict[defline_field.split()[0]] = defline_field.split()[1]
-                            except:
-                                print defline_field
-                                return None
-                    elif version == 3:
-                        defline_dict[defline_field.split('=')[0]] = defline_field.split('=')[1]
-            #Tries to figure out parent
-            if parent_field != None:
-                if parent_field in defline_dict:
-                    parent = defline_dict[parent_field]
-            elif parents_hierarchy != []:
-                for parent_type in parents_hierarchy:
-                    if parent_type in defline_dict:
-                        parent = defline_dict[parent_type]
-                        break
-            #Assigns ID
-            if IDfield != None:
-                try:
-                    ID = defline_dict[IDfield]
-                except KeyError:
-                    if parent != None:
-                        ID = parent + '-' + feature_type
-            elif parent != None:
-                ID = parent + '-' + feature_type
-            else:
-                ID = seqid + '-' + feature_type + fields[3]
+    #IDs of the ParentAnnotations added, whose coords are cached once all features are read
+    new_parent_IDs = []
+    #creating many objects that are kept sets off the garbage collector over and over, so it is paused while reading
+    garbage_collection = gc.isenabled()
+    gc.disable()
+    try:
+        #here we go folks
+        for token in tokenizer.tokenize(gff_file):
+            if token == None:
+                print tokenizer.bad_attribute
+                return None
+            seqid, feature_type, coords, strand, other_attributes, defline_dict, parent, ID = token
             #checks if ID already in annotation_set and adjusts ID if necessary
-            try:
-                annotation_set[ID]
-                if ID in generate_new_ID_dict:
-                    generate_new_ID_dict[ID] = generate_new_ID_dict[ID] + 1
-                    ID = ID + "-" + str(generate_new_ID_dict[ID])
-                else:
-                    generate_new_ID_dict[ID] = 2
-                    ID = ID + '2'
-            except KeyError:
-                pass
+            ID = get_unused_ID(ID, ID_index, generate_new_ID_dict)
             #Creates parents if necessary, adds to parent if exists
             if parent != None:
                 child_to_assign = ID
+                parents_hierarchy = tokenizer.parents_hierarchy
                 for parent_feature_index in range(len(parents_hierarchy)):
                     parent_feature = parents_hierarchy[parent_feature_index]
                     if parent_feature in defline_dict:
@@ -374,9 +668,9 @@ def read_gff(gff,annotation_set_to_modify = None, base_features = ['CDS','match_
                         if parent_feature_index != len(parents_hierarchy) - 1:
                             for parents_parent_feature in parents_hierarchy[parent_feature_index + 1:]:
                                 if parents_parent_feature in defline_dict:
-                                    parents_parent = defline_dict[parents_parent_feature]                        
+                                    parents_parent = defline_dict[parents_parent_feature]
                         if not parent_feature_type in annotation_set.__dict__:
-                            annotation_set.__dict__[parent_feature_type] = {}
+                            setattr(annotation_set, parent_feature_type, {})
                         if parent_feature_ID in annotation_set.__dict__[parent_feature_type]:
                             if not child_to_assign in annotation_set.__dict__[parent_feature_type][parent_feature_ID].child_list:
                                 annotation_set.__dict__[parent_feature_type][parent_feature_ID].child_list.append(child_to_assign)
@@ -385,25 +679,26 @@ def read_gff(gff,annotation_set_to_modify = None, base_features = ['CDS','match_
                                                                                             parent_feature_type, child_list = [child_to_assign],
                                                                                             parent = parents_parent, strand = strand,
                                                                                             annotation_set = annotation_set)
+                            new_parent_IDs.append(parent_feature_ID)
                         child_to_assign = parent_feature_ID
                 #In case of no parent from parent hierarchy in defline_dict
-                try:
-                    if not ID in annotation_set[parent].child_list:
-                        annotation_set[parent].child_list.append(ID)
-                except KeyError:
+                if not parent in ID_index:
                     print """It seems that this line has a parent attribute but that that parent doesn't have a line itself nor
                     does this line have a defline attribute that specifies a parent type. I'm afraid this function can't currently
                     deal with that."""
                     print ID
                     print parent
                     return None
+                parent_child_list = ID_index[parent].child_list
+                if not ID in parent_child_list:
+                    parent_child_list.append(ID)
             #fills other_attributes from defline
             for defline_attribute in defline_dict:
-                if not defline_attribute in [IDfield,parent_field]:
+                if not defline_attribute in [tokenizer.IDfield, tokenizer.parent_field]:
                     other_attributes[defline_attribute] = defline_dict[defline_attribute]
             #And now to create the feature!
             if not feature_type in annotation_set.__dict__:
-                annotation_set.__dict__[feature_type] = {}
+                setattr(annotation_set, feature_type, {})
             if feature_type in base_features:
                 annotation_set.__dict__[feature_type][ID] = BaseAnnotation( ID, seqid, coords, feature_type, parent,
                                                                            strand , other_attributes, annotation_set)
@@ -411,8 +706,16 @@ def read_gff(gff,annotation_set_to_modify = None, base_features = ['CDS','match_
                 child_list = []
                 annotation_set.__dict__[feature_type][ID] = ParentAnnotation(ID, seqid, feature_type, child_list,
                                                                              parent, strand, annotation_set, other_attributes)
-    if annotation_set_to_modify == None:
-        return copy.deepcopy(annotation_set)
+                new_parent_IDs.append(ID)
+        #compacted before coords are cached, so that caching them doesn't change the order of attributes
+        if annotation_set_to_modify == None:
+            annotation_set.compact()
+        annotation_set.finalize(new_parent_IDs)
+        if annotation_set_to_modify == None:
+            return annotation_set
+    finally:
+        if garbage_collection:
+            gc.enable()
 
 
 def read_cegma_gff(cegma_gff,annotation_set_to_modify = None):
@@ -422,9 +725,159 @@ def read_cegma_gff(cegma_gff,annotation_set_to_modify = None):
         return annotation_set
 
 
-def read_blast_csv(blast_csv,annotation_set_to_modify = None,hierarchy = ['match','match_part'], source = 'blast', find_truncated_locname = False):
-    """Reads csv output from blast (-outfmt 10) into an AnnotationSet object. Currently does not string hits together because I'm
-    biased towards working on genes in tandem arrays where stringing hits together is annoying. May add option in future."""
+def iter_blast_table_chunks(blast_file, chunk_size = 2**24):
+    """reads blast tabular output (-outfmt 10 csv or -outfmt 6 or 7 tsv, told apart by the first line not starting with
+    "#") from blast_file in chunks of about chunk_size bytes, yielding (queries, subjects, query_starts, query_ends,
+    subject_starts, subject_ends, evalues, scores) columns for the hits of each chunk. Starts and ends are numpy arrays
+    and the other columns are lists of strings. Lines with fewer than 12 fields (such as the comment lines of -outfmt 7)
+    are skipped"""
+    delimiter = None
+    while True:
+        text = blast_file.read(chunk_size)
+        if text == "":
+            break
+        text = (text + blast_file.readline()).replace('\r','')
+        lines = text.split('\n')
+        if lines[-1] == "":
+            lines.pop()
+        if delimiter == None:
+            #the comment lines -outfmt 7 starts with are skipped, as they may hold commas
+            data_lines = [line for line in lines if line[:1] != '#']
+            if data_lines == []:
+                continue
+            if data_lines[0].count('\t') >= 11:
+                delimiter = '\t'
+            else:
+                delimiter = ','
+        delimiter_counts = [line.count(delimiter) for line in lines]
+        delimiter_count = delimiter_counts[0]
+        if delimiter_count >= 11 and delimiter_counts.count(delimiter_count) == len(lines):
+            #all lines have the same number of fields, so the chunk is split into fields all at once, and each column is
+            #every field_count-th field
+            fields = delimiter.join(lines).split(delimiter)
+            field_count = delimiter_count + 1
+            columns = [fields[column::field_count] for column in [0, 1, 6, 7, 8, 9, 10, 11]]
+        else:
+            hits = [line.split(delimiter) for line, line_delimiter_count in zip(lines, delimiter_counts)
+                    if line_delimiter_count >= 11]
+            columns = [[hit[column] for hit in hits] for column in [0, 1, 6, 7, 8, 9, 10, 11]]
+        if len(columns[0]) > 0:
+            yield tuple(columns[:2] + [numpy.array(column).astype(int) for column in columns[2:6]] + columns[6:])
+
+
+def get_seqid_lookup(seqids):
+    """returns dictionary of each seqid and each first word of a seqid to the seqid (the first seqid with that first word,
+    if there are several), for finding full seqids from names truncated at the first space"""
+    seqid_lookup = {}
+    for seqid in seqids:
+        first_word = seqid.split()
+        if first_word != []:
+            seqid_lookup.setdefault(first_word[0], seqid)
+    for seqid in seqids:
+        seqid_lookup[seqid] = seqid
+    return seqid_lookup
+
+
+def get_hit_chains(subject_starts, subject_ends, query_starts, query_ends, scores, max_intron = 20000, tandem_array_safe = False):
+    """takes lists of the subject and query coords (start <= end) and scores of hits of one query on one strand of one
+    subject and returns list of chains of collinear hits, each a list of hit indexes in subject order. Every hit is in
+    one chain. A hit can follow another in a chain if it starts after the other ends on the subject, at most max_intron
+    bases later, and starts after the other starts on the query (before, for reverse strand hits, whose query coords
+    should be given negated). The best scoring chains are found by dynamic programming over the hits in subject order,
+    looking up the best chain to extend in a segment tree of query starts, and hits are taken for the highest scoring
+    chain first. If tandem_array_safe, hits are split at each point where the query restarts (a hit starts before the
+    hit before it on the query), and chains never cross these splits, so copies of a gene in a tandem array aren't
+    joined together."""
+    if len(subject_starts) == 1:
+        return [[0]]
+    order = sorted(range(len(subject_starts)), key = lambda hit: (subject_starts[hit], subject_ends[hit], hit))
+    segments = [[]]
+    for hit in order:
+        if tandem_array_safe and segments[-1] != [] and query_starts[hit] < query_starts[segments[-1][-1]]:
+            segments.append([])
+        segments[-1].append(hit)
+    chain_scores = {}
+    previous_hits = {}
+    for segment in segments:
+        #leaves of the segment tree are the hits of the segment in order of query start, holding (chain score, hit) for
+        #hits whose chains can be extended by the current hit
+        by_query_start = sorted(segment, key = lambda hit: (query_starts[hit], hit))
+        sorted_query_starts = [query_starts[hit] for hit in by_query_start]
+        leaf_indexes = dict([(by_query_start[leaf], leaf) for leaf in range(len(by_query_start))])
+        tree_size = 1
+        while tree_size < len(segment):
+            tree_size = tree_size * 2
+        tree = [None] * (2 * tree_size)
+        by_subject_end = sorted(segment, key = lambda hit: (subject_ends[hit], hit))
+        added = 0
+        removed = 0
+        for hit in segment:
+            #adds hits that end before this one starts and removes those more than max_intron before it
+            while added < len(by_subject_end) and subject_ends[by_subject_end[added]] < subject_starts[hit]:
+                position = tree_size + leaf_indexes[by_subject_end[added]]
+                tree[position] = (chain_scores[by_subject_end[added]], by_subject_end[added])
+                while position > 1:
+                    position = position / 2
+                    tree[position] = max(tree[2 * position], tree[2 * position + 1])
+                added = added + 1
+            while removed < added and subject_starts[hit] - subject_ends[by_subject_end[removed]] > max_intron:
+                position = tree_size + leaf_indexes[by_subject_end[removed]]
+                tree[position] = None
+                while position > 1:
+                    position = position / 2
+                    tree[position] = max(tree[2 * position], tree[2 * position + 1])
+                removed = removed + 1
+            #finds the best chain among hits with query starts before this hit's
+            best = None
+            low = tree_size
+            high = tree_size + bisect.bisect_left(sorted_query_starts, query_starts[hit])
+            while low < high:
+                if low % 2 == 1:
+                    best = max(best, tree[low])
+                    low = low + 1
+                if high % 2 == 1:
+                    high = high - 1
+                    best = max(best, tree[high])
+                low = low / 2
+                high = high / 2
+            if best != None and best[0] > 0:
+                chain_scores[hit] = scores[hit] + best[0]
+                previous_hits[hit] = best[1]
+            else:
+                chain_scores[hit] = scores[hit]
+                previous_hits[hit] = None
+    chains = []
+    chained = set()
+    for hit in sorted(order, key = lambda hit: (-chain_scores[hit], hit)):
+        chain = []
+        while hit != None and not hit in chained:
+            chain.append(hit)
+            chained.add(hit)
+            hit = previous_hits[hit]
+        if chain != []:
+            chain.reverse()
+            chains.append(chain)
+    return chains
+
+
+def read_blast_csv(blast_csv,annotation_set_to_modify = None,hierarchy = ['match','match_part'], source = 'blast', find_truncated_locname = False,
+                   chunk_size = 2**24, chain_hits = False, max_intron = 20000, tandem_array_safe = False):
+    """Reads csv output from blast (-outfmt 10, or tab separated -outfmt 6) into an AnnotationSet object. By default does not
+    string hits together because I'm biased towards working on genes in tandem arrays where stringing hits together is
+    annoying, so each hit is a match_part with its own match.
+    
+    If chain_hits, hits of the same query on the same strand of the same subject are strung together into chains of
+    collinear hits at most max_intron bases apart (see get_hit_chains), each of which is one match with a match_part for
+    each hit. If tandem_array_safe, chains are also split wherever the query coords restart. Chained hits are named after
+    the ID of their chain, the feature type and their number along the subject (e.g. "query_match_part1").
+    
+    The file is read in chunks of about chunk_size bytes, whose columns are parsed all at once (see
+    iter_blast_table_chunks). If find_truncated_locname, subject names that aren't genome seqids are looked up by the first
+    word of the genome seqids. chain_hits needs a hierarchy of at least two feature types, one for chains and one for
+    hits."""
+    if chain_hits and len(hierarchy) < 2:
+        raise ValueError("chain_hits needs a hierarchy with a feature type for chains above the hits' feature type (e.g. "
+                         "['match', 'match_part']), not " + repr(hierarchy))
     #reads blast_csv from file location, file, or string
     blast_file = ensure_file(blast_csv)
     #checks if annotation_set is given and creates annotation_set if not
@@ -436,69 +889,342 @@ def read_blast_csv(blast_csv,annotation_set_to_modify = None,hierarchy = ['match
     feature_type = hierarchy[-1]
     create_parents_chain = hierarchy[:-1]
     create_parents_chain.reverse()
-    if not feature_type in annotation_set.__dict__:
-        setattr(annotation_set, feature_type, {})
+    for parent_feature in [feature_type] + create_parents_chain:
+        if not parent_feature in annotation_set.__dict__:
+            setattr(annotation_set, parent_feature, {})
+    features = annotation_set.__dict__[feature_type]
+    parent_dicts = [annotation_set.__dict__[parent_feature] for parent_feature in create_parents_chain]
+    #each parent is named ID + '-' + its feature type and its parent ID + '-' + the next feature type up
+    parent_suffixes = ['-' + parent_feature for parent_feature in create_parents_chain]
+    parents_parent_suffixes = parent_suffixes[1:] + [None]
+    #IDs are made unique among the features named after the query: the hits themselves, or the first parents of chains
+    if chain_hits:
+        ID_features = parent_dicts[0]
+        ID_suffix = parent_suffixes[0]
+    else:
+        ID_features = features
+        ID_suffix = ""
     if find_truncated_locname:
         if annotation_set.genome == None:
             print '"warning: find_truncated_locname" was set to true, but annotation set has no associated genome object so this cannot be done'
             find_truncated_locname = False
         else:
-            genome_seqids = annotation_set.genome.get_seqids()
-    for whole_line in blast_file:
-        line = whole_line.replace('\r','').replace('\n','')
-        fields = line.split(',')
-        if len(fields) > 8:
-            seqid = fields[1]
+            seqid_lookup = get_seqid_lookup(annotation_set.genome.get_seqids())
+    garbage_collection = gc.isenabled()
+    gc.disable()
+    try:
+        hit_groups = {}
+        hit_group_list = []
+        hit_count = 0
+        for chunk in iter_blast_table_chunks(blast_file, chunk_size):
+            queries, subjects, query_starts, query_ends, subject_starts, subject_ends, evalues, scores = chunk
+            plus_strand = subject_starts < subject_ends
+            starts = numpy.where(plus_strand, subject_starts, subject_ends).tolist()
+            ends = numpy.where(plus_strand, subject_ends, subject_starts).tolist()
+            strands = numpy.where(plus_strand, '+', '-').tolist()
             if find_truncated_locname:
-                if not seqid in genome_seqids:
-                    for genome_seqid in genome_seqids:
-                        if seqid == genome_seqid.split()[0]:
-                            seqid = genome_seqid
-                            break
-            tstart = int(fields[8])
-            tend = int(fields[9])
-            if tstart < tend:
-                coords = (tstart,tend)
-                strand = '+'
-            else:
-                coords = (tend,tstart)
-                strand = '-'
-            score = fields[11]
-            IDbase = fields[0]
-            if IDbase in eval('annotation_set.' + feature_type):
-                ID = IDbase + '-' + str(id_generator_dict[IDbase])
-                id_generator_dict[IDbase] = id_generator_dict[IDbase] + 1
-                while ID in eval('annotation_set.' + feature_type):
-                    ID = IDbase + '-' + str(id_generator_dict[IDbase])
-                    id_generator_dict[IDbase] = id_generator_dict[IDbase] + 1
+                subject_seqids = dict([(subject, seqid_lookup.get(subject, subject)) for subject in set(subjects)])
+                subjects = [subject_seqids[subject] for subject in subjects]
+            hits = zip(queries, subjects, starts, ends, strands, evalues, scores)
+            if chain_hits:
+                #hits are kept until the whole file is read, grouped by query, subject and strand. Query coords of hits on
+                #the reverse strand are negated, so that the query runs forwards along the subject as it does on the
+                #forward strand
+                query_lows = numpy.minimum(query_starts, query_ends)
+                query_highs = numpy.maximum(query_starts, query_ends)
+                query_lows, query_highs = (numpy.where(plus_strand, query_lows, -query_highs).tolist(),
+                                           numpy.where(plus_strand, query_highs, -query_lows).tolist())
+                for hit_index in range(len(hits)):
+                    hit = hits[hit_index]
+                    group_key = hit[:2] + hit[4:5]
+                    if not group_key in hit_groups:
+                        hit_groups[group_key] = []
+                        hit_group_list.append(hit_groups[group_key])
+                    hit_groups[group_key].append(hit + (query_lows[hit_index], query_highs[hit_index], hit_count + hit_index))
+                hit_count = hit_count + len(hits)
             else:
-                ID = IDbase
-                id_generator_dict[IDbase] = 1
-            other_attributes = {}
-            other_attributes['evalue'] = fields[10]
-            other_attributes['score'] = score
-            parent = ID + '-' + create_parents_chain[0]
-            child_to_set = ID
-            for parent_index in range(len(create_parents_chain)):
-                parent_feature = create_parents_chain[parent_index]
-                if not parent_feature in annotation_set.__dict__:
-                    setattr(annotation_set, parent_feature, {})
-                if parent_index != len(create_parents_chain) - 1:
-                    parent_to_set = ID + '-' + create_parents_chain[parent_index + 1]
-                else:
-                    parent_to_set = None
-                annotation_set.__dict__[parent_feature][ID + '-' + parent_feature] = ParentAnnotation(ID + '-' + parent_feature, seqid, parent_feature,
-                                                                                                    [child_to_set], parent_to_set, strand,
-                                                                                                    annotation_set, other_attributes = {})
-                child_to_set = ID + '-' + parent_feature
-            eval('annotation_set.' + feature_type)[ID] = BaseAnnotation(ID, seqid, coords, feature_type, parent, strand,
-                                                                        other_attributes, annotation_set)
-
-            
+                for hit in hits:
+                    add_blast_hit_features([hit], annotation_set, feature_type, features, parent_dicts, create_parents_chain,
+                                           parent_suffixes, parents_parent_suffixes, ID_features, ID_suffix, id_generator_dict)
+        if chain_hits:
+            chains = []
+            for group in hit_group_list:
+                for chain in get_hit_chains([hit[2] for hit in group], [hit[3] for hit in group], [hit[7] for hit in group],
+                                            [hit[8] for hit in group], [float(hit[6]) for hit in group], max_intron,
+                                            tandem_array_safe):
+                    chains.append((min([group[hit_index][9] for hit_index in chain]), [group[hit_index] for hit_index in chain]))
+            #chains are added in the order of their first hit in the file
+            chains.sort()
+            for first_line, chain in chains:
+                add_blast_hit_features(chain, annotation_set, feature_type, features, parent_dicts, create_parents_chain,
+                                       parent_suffixes, parents_parent_suffixes, ID_features, ID_suffix, id_generator_dict)
+    finally:
+        if garbage_collection:
+            gc.enable()
     if annotation_set_to_modify == None:
         return annotation_set
 
 
+def add_blast_hit_features(hits, annotation_set, feature_type, features, parent_dicts, create_parents_chain, parent_suffixes,
+                           parents_parent_suffixes, ID_features, ID_suffix, id_generator_dict):
+    """adds the features of one hit, or one chain of hits, of read_blast_csv to annotation_set. hits are (query, seqid, start,
+    end, strand, evalue, score, ...) tuples"""
+    IDbase, seqid = hits[0][:2]
+    strand = hits[0][4]
+    if IDbase + ID_suffix in ID_features:
+        ID_number = id_generator_dict.get(IDbase, 1)
+        ID = IDbase + '-' + str(ID_number)
+        while ID + ID_suffix in ID_features:
+            ID_number = ID_number + 1
+            ID = IDbase + '-' + str(ID_number)
+        id_generator_dict[IDbase] = ID_number + 1
+    else:
+        ID = IDbase
+        id_generator_dict[IDbase] = 1
+    if len(hits) == 1 and ID_suffix == "":
+        child_IDs = [ID]
+    else:
+        child_IDs = [ID + '_' + feature_type + str(part_number + 1) for part_number in range(len(hits))]
+    children_to_set = child_IDs
+    for parent_index in range(len(parent_dicts)):
+        parent_ID = ID + parent_suffixes[parent_index]
+        if parents_parent_suffixes[parent_index] != None:
+            parent_to_set = ID + parents_parent_suffixes[parent_index]
+        else:
+            parent_to_set = None
+        parent_dicts[parent_index][parent_ID] = ParentAnnotation(parent_ID, seqid, create_parents_chain[parent_index],
+                                                                 children_to_set, parent_to_set, strand,
+                                                                 annotation_set, other_attributes = {})
+        children_to_set = [parent_ID]
+    if parent_suffixes != []:
+        parent = ID + parent_suffixes[0]
+    else:
+        parent = None
+    for hit, child_ID in zip(hits, child_IDs):
+        other_attributes = {}
+        other_attributes['evalue'] = hit[5]
+        other_attributes['score'] = hit[6]
+        features[child_ID] = BaseAnnotation(child_ID, seqid, (hit[2], hit[3]), feature_type, parent, strand,
+                                            other_attributes, annotation_set)
+
+
+def get_runs(mask):
+    """takes boolean numpy array and returns (starts, ends) numpy arrays of the 0-based, end-exclusive coordinates
+    of each run of True values"""
+    mask = numpy.asarray(mask, dtype = bool)
+    if len(mask) == 0:
+        return numpy.zeros(0, dtype = int), numpy.zeros(0, dtype = int)
+    changes = numpy.flatnonzero(mask[1:] != mask[:-1]) + 1
+    starts = changes[mask[changes]]
+    ends = changes[~mask[changes]]
+    if mask[0]:
+        starts = numpy.concatenate(([0], starts))
+    if mask[-1]:
+        ends = numpy.concatenate((ends, [len(mask)]))
+    return starts, ends
+
+
+def pack_strings(strings):
+    """packs list of strings into a numpy array of bytes (strings seperated by null characters) for saving"""
+    return numpy.frombuffer('\x00'.join(strings), dtype = numpy.uint8)
+
+
+def unpack_strings(string_array, count):
+    """unpacks list of count strings from a numpy array made by pack_strings"""
+    if count == 0:
+        return []
+    return string_array.tobytes().split('\x00')
+
+
+def encode_strings(strings):
+    """encodes list of (usually highly repetitive) strings, e.g. seqids, as a numpy array of integer codes and a list
+    of the unique strings that the codes refer to"""
+    vocabulary = sorted(set(strings))
+    code_dict = dict([(string, code) for code, string in enumerate(vocabulary)])
+    return numpy.array([code_dict[string] for string in strings], dtype = numpy.int32), vocabulary
+
+
+def get_saved_order(features):
+    """returns the IDs of feature dictionary features in an order that fills a new dictionary in the same order as
+    features: the keys compact last refilled it with (see AnnotationSet.compact) if it hasn't changed since, and
+    otherwise its own order"""
+    IDs = features.keys()
+    refill_order = features.__dict__.get('refill_order')
+    #dict.fromkeys fills a new dictionary one key at a time, as compact does
+    if refill_order != None and len(refill_order) == len(IDs) and dict.fromkeys(refill_order).keys() == IDs:
+        return refill_order
+    return IDs
+
+def get_annotation_table(annotation_set):
+    """returns a columnar table of all features in annotation_set as a dictionary of numpy arrays (with lists of strings
+    packed by pack_strings), which can be turned back into an AnnotationSet with annotation_set_from_table. Features are
+    stored in the order that refills each feature dictionary in its current order (see get_saved_order). Attribute
+    values other than strings, floats and ints are stored as python literals; raises ValueError for any that can't be"""
+    feature_dict_names = annotation_set.get_feature_types()
+    IDs, dict_names, seqids, feature_types, strands, parents, children = [], [], [], [], [], [], []
+    is_base, has_parent, coords, child_counts = [], [], [], []
+    attribute_rows, attribute_names, attribute_values, attribute_types = [], [], [], []
+    for dict_name in feature_dict_names:
+        features = annotation_set.__dict__[dict_name]
+        for ID in get_saved_order(features):
+            feature = features[ID]
+            row = len(IDs)
+            IDs.append(ID)
+            dict_names.append(dict_name)
+            seqids.append(feature.seqid)
+            feature_types.append(feature.feature_type)
+            strands.append(feature.strand)
+            has_parent.append(feature.parent != None)
+            parents.append(feature.parent if feature.parent != None else "")
+            if isinstance(feature, BaseAnnotation):
+                is_base.append(True)
+                coords.append(feature.coords)
+                child_counts.append(0)
+            else:
+                is_base.append(False)
+                coords.append((0, 0))
+                child_counts.append(len(feature.child_list))
+                children.extend(feature.child_list)
+            for attribute, value in feature.__dict__.items():
+                if not attribute in ['ID','seqid','coords','feature_type','annotation_set','parent','strand','child_list','cached_coords']:
+                    attribute_rows.append(row)
+                    attribute_names.append(attribute)
+                    if type(value) == str:
+                        attribute_types.append(0)
+                        attribute_values.append(value)
+                    elif type(value) == float:
+                        attribute_types.append(1)
+                        attribute_values.append(repr(value))
+                    elif type(value) == int:
+                        attribute_types.append(2)
+                        attribute_values.append(repr(value))
+                    else:
+                        #other values (e.g. lists, bools or None) are stored as python literals, as long as they read
+                        #back as the same value
+                        try:
+                            round_trips = ast.literal_eval(repr(value)) == value
+                        except (ValueError, SyntaxError):
+                            round_trips = False
+                        if not round_trips:
+                            raise ValueError("attribute " + attribute + " of " + ID + " can't be stored in a table: " + repr(value))
+                        attribute_types.append(3)
+                        attribute_values.append(repr(value))
+    table = {}
+    table['counts'] = numpy.array([len(feature_dict_names), len(IDs), len(children), len(attribute_rows)])
+    table['feature_dict_names'] = pack_strings(feature_dict_names)
+    table['IDs'] = pack_strings(IDs)
+    table['parents'] = pack_strings(parents)
+    table['children'] = pack_strings(children)
+    table['attribute_values'] = pack_strings(attribute_values)
+    for column_name, column in [('dict_names', dict_names), ('seqids', seqids), ('feature_types', feature_types),
+                                ('strands', strands), ('attribute_names', attribute_names)]:
+        codes, vocabulary = encode_strings(column)
+        table[column_name] = codes
+        table[column_name + '_vocabulary'] = pack_strings(vocabulary)
+        table[column_name + '_vocabulary_count'] = numpy.array([len(vocabulary)])
+    table['is_base'] = numpy.array(is_base, dtype = bool)
+    table['has_parent'] = numpy.array(has_parent, dtype = bool)
+    table['coords'] = numpy.array(coords, dtype = numpy.int64).reshape(-1, 2)
+    table['child_counts'] = numpy.array(child_counts, dtype = numpy.int64)
+    table['attribute_rows'] = numpy.array(attribute_rows, dtype = numpy.int64)
+    table['attribute_types'] = numpy.array(attribute_types, dtype = numpy.int8)
+    return table
+
+
+def annotation_set_from_table(table, genome = None):
+    """builds AnnotationSet from a table made by get_annotation_table. Features are added in the order they were saved
+    in, so the feature dictionaries iterate in the order of the saved set's"""
+    dict_count, feature_count, child_count, attribute_count = table['counts'].tolist()
+    columns = {}
+    for column_name in ['dict_names', 'seqids', 'feature_types', 'strands', 'attribute_names']:
+        vocabulary = unpack_strings(table[column_name + '_vocabulary'], int(table[column_name + '_vocabulary_count'][0]))
+        columns[column_name] = [vocabulary[code] for code in table[column_name].tolist()]
+    other_attributes = [{} for row in range(feature_count)]
+    attribute_values = unpack_strings(table['attribute_values'], attribute_count)
+    value_types = [str, float, int, ast.literal_eval]
+    for row, name, value, value_type in zip(table['attribute_rows'].tolist(), columns['attribute_names'], attribute_values,
+                                            table['attribute_types'].tolist()):
+        other_attributes[row][name] = value_types[value_type](value)
+    annotation_set = AnnotationSet(genome)
+    for dict_name in unpack_strings(table['feature_dict_names'], dict_count):
+        setattr(annotation_set, dict_name, {})
+    IDs = unpack_strings(table['IDs'], feature_count)
+    parents = unpack_strings(table['parents'], feature_count)
+    children = unpack_strings(table['children'], child_count)
+    coords = table['coords'].tolist()
+    child_counts = table['child_counts'].tolist()
+    has_parent = table['has_parent'].tolist()
+    child_start = 0
+    #the IDs of each dictionary in the order they were added, which refill it in the order it has (see get_saved_order)
+    saved_orders = {}
+    for row, is_base in enumerate(table['is_base'].tolist()):
+        if has_parent[row]:
+            parent = parents[row]
+        else:
+            parent = None
+        if is_base:
+            feature = BaseAnnotation(IDs[row], columns['seqids'][row], tuple(coords[row]), columns['feature_types'][row], parent,
+                                     columns['strands'][row], other_attributes[row], annotation_set)
+        else:
+            feature = ParentAnnotation(IDs[row], columns['seqids'][row], columns['feature_types'][row],
+                                       children[child_start:child_start + child_counts[row]], parent, columns['strands'][row],
+                                       annotation_set, other_attributes[row])
+            child_start = child_start + child_counts[row]
+        annotation_set.__dict__[columns['dict_names'][row]][IDs[row]] = feature
+        saved_orders.setdefault(columns['dict_names'][row], []).append(IDs[row])
+    for dict_name in saved_orders:
+        annotation_set.__dict__[dict_name].refill_order = saved_orders[dict_name]
+    return annotation_set
+
+
+#raised whenever caches saved before would read back differently, so that they are read afresh and saved again
+cache_format = 2
+
+def get_cache_key(source_files, options = None):
+    """returns string identifying the current version (location, size, and modification time) of each source file,
+    along with any options used to read them and the cache_format, for checking whether a cache made from them is
+    still up to date"""
+    source_stats = []
+    for source_file in source_files:
+        source_stats.append((os.path.abspath(source_file), os.path.getsize(source_file), os.path.getmtime(source_file)))
+    return repr([source_stats, options, cache_format])
+
+
+def read_genome_cache(cache_location, cache_key = None):
+    """reads Genome from a cache file written by Genome.save_cache. If cache_key is given and doesn't match the key the
+    cache was saved with (i.e. the cache is out of date), or if there is no readable cache, returns None"""
+    try:
+        cache = numpy.load(cache_location)
+        if cache_key != None and cache['cache_key'].tobytes() != cache_key:
+            return None
+        genome = Genome()
+        sequence_count = int(cache['sequence_count'][0])
+        if sequence_count > 0:
+            genome.genome_sequence = GenomeSequence()
+            seqids = unpack_strings(cache['sequence_names'], sequence_count)
+            fields = unpack_strings(cache['sequence_fields'], int(cache['sequence_field_count'][0]))
+            field_arrays = dict([(field, cache['sequence_' + field]) for field in fields])
+            field_offsets = dict([(field, cache['sequence_' + field + '_offsets'].tolist()) for field in fields])
+            for seq_index, is_packed in enumerate(cache['sequence_is_packed'].tolist()):
+                seq_fields = {}
+                for field in fields:
+                    seq_fields[field] = field_arrays[field][field_offsets[field][seq_index]:field_offsets[field][seq_index + 1]]
+                if not is_packed:
+                    genome.genome_sequence[seqids[seq_index]] = seq_fields['bases'].tobytes()
+                else:
+                    seq_fields.pop('bases', None)
+                    packed_seq = PackedSequence.__new__(PackedSequence)
+                    packed_seq.__dict__.update(seq_fields)
+                    packed_seq.length = int(packed_seq.length[0])
+                    genome.genome_sequence[seqids[seq_index]] = packed_seq
+            genome.genome_sequence.seqid_order = seqids
+        if 'counts' in cache.files:
+            genome.annotations = annotation_set_from_table(cache, genome)
+        return genome
+    except (IOError, KeyError, ValueError):
+        return None
+
+
 class Genotype():
     """individual genotype to populate a GenotypeDict"""
     def name(self, ):
@@ -521,56 +1247,365 @@ class VariantSet(dict):
         self.vcf_headers = vcf_headers
     
 
+class FeatureDict(dict):
+    """Dictionary holding all features of one type in an AnnotationSet, with feature IDs as keys. Any feature added to
+    or removed from a FeatureDict is also added to or removed from the ID_index and seqid_index of its AnnotationSet,
+    and the AnnotationSet's interval indexes are cleared so that they are rebuilt with the change."""
+    def __init__(self, annotation_set = None, features = {}, feature_type = None):
+        self.annotation_set = annotation_set
+        self.feature_type = feature_type
+        self.update(features)
+    
+    def __setitem__(self, ID, annotation):
+        replacing = ID in self
+        if replacing and self.__dict__.get('annotation_set') != None:
+            self.annotation_set.remove_from_seqid_index(ID, dict.__getitem__(self, ID), self.feature_type)
+        replaced = dict.get(self, ID)
+        dict.__setitem__(self, ID, annotation)
+        ID_index = getattr(self.__dict__.get('annotation_set'), 'ID_index', None)
+        if ID_index != None:
+            indexed = ID_index.get(ID)
+            if indexed is None or indexed is replaced:
+                ID_index[ID] = annotation
+            else:
+                #another feature type dictionary has a feature with this ID
+                self.annotation_set.reindex_ID(ID)
+            self.annotation_set.add_to_seqid_index(ID, annotation, self.feature_type)
+            if self.annotation_set.interval_indexes:
+                self.annotation_set.interval_indexes.clear()
+            #a replaced feature may have different coords than the one its parent's cached coords came from
+            if replacing and hasattr(annotation, 'clear_parent_coords'):
+                annotation.clear_parent_coords()
+    
+    def __delitem__(self, ID):
+        annotation = self[ID]
+        dict.__delitem__(self, ID)
+        ID_index = getattr(self.__dict__.get('annotation_set'), 'ID_index', None)
+        if ID_index != None:
+            self.annotation_set.remove_from_seqid_index(ID, annotation, self.feature_type)
+            if ID_index.get(ID) is annotation:
+                self.annotation_set.reindex_ID(ID)
+            self.annotation_set.interval_indexes.clear()
+    
+    def update(self, *args, **kwargs):
+        for ID, annotation in dict(*args, **kwargs).items():
+            self[ID] = annotation
+    
+    def setdefault(self, ID, annotation = None):
+        if not ID in self:
+            self[ID] = annotation
+        return self[ID]
+    
+    def pop(self, ID, *default):
+        if ID in self:
+            annotation = self[ID]
+            del self[ID]
+            return annotation
+        return dict.pop(self, ID, *default)
+    
+    def popitem(self):
+        ID, annotation = dict.popitem(self)
+        dict.__setitem__(self, ID, annotation)
+        del self[ID]
+        return ID, annotation
+    
+    def clear(self):
+        for ID in list(self):
+            del self[ID]
+
+
+class IntervalIndex():
+    """Index of the coords of features for fast overlap queries. features may be a dict of ID to annotation (e.g. a
+    feature type dictionary of an AnnotationSet) or a list of (seqid, start, end, ID) tuples. The intervals on each seqid
+    are stored as a nested containment list: intervals that no other interval contains form the top list, and the
+    intervals contained in each interval form its sublist, nested the same way. No interval in a list contains another,
+    so the starts and ends of each list are both sorted and the intervals of a list overlapping a query are found with
+    two binary searches. Only the sublists of those intervals are searched in turn, so a query takes about log(N) time
+    per list searched plus the number of IDs found, even when long features (e.g. regions) span many others. Coords are
+    inclusive, as in gff files, and features without coords (e.g. genes without children, or whose children are missing
+    or have no coords, see AnnotationSet.finalize) are left out."""
+    def __init__(self, features):
+        if isinstance(features, dict):
+            intervals = []
+            for ID in features:
+                try:
+                    coords = features[ID].get_coords()
+                except (KeyError, TypeError):
+                    coords = None
+                if coords != None:
+                    intervals.append((features[ID].seqid, coords[0], coords[1], ID))
+        else:
+            intervals = features
+        seqid_intervals = {}
+        for seqid, start, end, ID in intervals:
+            if seqid in seqid_intervals:
+                seqid_intervals[seqid].append((start, end, ID))
+            else:
+                seqid_intervals[seqid] = [(start, end, ID)]
+        self.seqids = {}
+        for seqid in seqid_intervals:
+            starts = numpy.array([interval[0] for interval in seqid_intervals[seqid]], dtype = numpy.int64)
+            ends = numpy.array([interval[1] for interval in seqid_intervals[seqid]], dtype = numpy.int64)
+            IDs = numpy.empty(len(starts), dtype = object)
+            IDs[:] = [interval[2] for interval in seqid_intervals[seqid]]
+            #sorted by start and then longest first, so each interval comes after every interval that contains it
+            order = numpy.lexsort((-ends, starts))
+            starts, ends, IDs = starts[order], ends[order], IDs[order]
+            #the innermost interval containing each interval (-1 for none) is the nearest earlier one on a stack of the
+            #intervals that end at or after it
+            containers = numpy.empty(len(starts), dtype = numpy.int64)
+            stack = []
+            sorted_ends = ends.tolist()
+            for index in xrange(len(sorted_ends)):
+                while stack != [] and sorted_ends[stack[-1]] < sorted_ends[index]:
+                    stack.pop()
+                containers[index] = stack[-1] if stack != [] else -1
+                stack.append(index)
+            #each list is laid out in start order in a block of its own, with the top list first
+            layout = numpy.argsort(containers, kind = 'mergesort')
+            laid_out_containers = containers[layout]
+            sublist_firsts = numpy.searchsorted(laid_out_containers, numpy.arange(len(starts)), 'left')
+            sublist_lasts = numpy.searchsorted(laid_out_containers, numpy.arange(len(starts)), 'right')
+            self.seqids[seqid] = {'starts': starts[layout], 'ends': ends[layout], 'IDs': IDs[layout],
+                                  'sublist_firsts': sublist_firsts[layout], 'sublist_lasts': sublist_lasts[layout],
+                                  'top_count': int(numpy.searchsorted(laid_out_containers, -1, 'right')),
+                                  'sorted_starts': starts, 'sorted_ends': numpy.sort(ends)}
+    
+    def find(self, seqid, start, end, spanning = False):
+        """returns array of the positions (in the arrays of seqid) of intervals on seqid overlapping start to end or, if
+        spanning, of intervals that span all of start to end"""
+        if not seqid in self.seqids:
+            return numpy.zeros(0, dtype = numpy.int64)
+        intervals = self.seqids[seqid]
+        starts, ends = intervals['starts'], intervals['ends']
+        found = []
+        lists = [(0, intervals['top_count'])]
+        while lists != []:
+            first, last = lists.pop()
+            if spanning:
+                low = first + numpy.searchsorted(ends[first:last], end, 'left')
+                high = first + numpy.searchsorted(starts[first:last], start, 'right')
+            else:
+                low = first + numpy.searchsorted(ends[first:last], start, 'left')
+                high = first + numpy.searchsorted(starts[first:last], end, 'right')
+            if low < high:
+                found.append(numpy.arange(low, high))
+                #the intervals contained in one that doesn't overlap (or span) the query can't either, so only the
+                #sublists of the intervals found are searched
+                sublist_firsts = intervals['sublist_firsts'][low:high]
+                sublist_lasts = intervals['sublist_lasts'][low:high]
+                has_sublist = sublist_firsts < sublist_lasts
+                lists.extend(zip(sublist_firsts[has_sublist].tolist(), sublist_lasts[has_sublist].tolist()))
+        if found == []:
+            return numpy.zeros(0, dtype = numpy.int64)
+        return numpy.concatenate(found)
+    
+    def overlapping(self, seqid, start, end):
+        """returns list of IDs of intervals on seqid overlapping start to end"""
+        positions = self.find(seqid, start, end)
+        return list(self.seqids[seqid]['IDs'][positions]) if len(positions) > 0 else []
+    
+    def contained_in(self, seqid, start, end):
+        """returns list of IDs of intervals on seqid that lie within start to end"""
+        positions = self.find(seqid, start, end)
+        if len(positions) == 0:
+            return []
+        intervals = self.seqids[seqid]
+        positions = positions[(intervals['starts'][positions] >= start) & (intervals['ends'][positions] <= end)]
+        return list(intervals['IDs'][positions])
+    
+    def contains(self, seqid, start, end):
+        """returns list of IDs of intervals on seqid that span all of start to end"""
+        positions = self.find(seqid, start, end, spanning = True)
+        return list(self.seqids[seqid]['IDs'][positions]) if len(positions) > 0 else []
+    
+    def count_overlapping(self, seqid, starts, ends):
+        """returns array of the number of intervals on seqid overlapping each of the intervals given by the arrays starts
+        and ends, counting the intervals that start before each end less those that end before each start"""
+        if not seqid in self.seqids:
+            return numpy.zeros(len(starts), dtype = numpy.int64)
+        intervals = self.seqids[seqid]
+        return (numpy.searchsorted(intervals['sorted_starts'], ends, 'right') -
+                numpy.searchsorted(intervals['sorted_ends'], starts, 'left'))
+
+
 class AnnotationSet():
     """A set of annotations of a single genome. Each feature type (e.g. gene, transcript, exon, etc.)
     is stored in it's own dictionary as Annotations with their ID as their key (see "Annotation" class).
     The AnnotationSet itself also functions losely as a dictionary, in that any feature can be returned
-    by indexing the AnnotationSet with the ID as a key (e.g. my_annotation_set["my_feature_ID"])"""
+    by indexing the AnnotationSet with the ID as a key (e.g. my_annotation_set["my_feature_ID"]). These lookups
+    go through ID_index, a single dictionary of every feature in the set which is kept up to date whenever
+    features are added to the feature type dictionaries, so they take constant time regardless of set size. If
+    features of several types have the same ID, the one whose type comes last in sorted order is returned.
+    Overlap queries (overlapping, contained_in and contains) use an IntervalIndex of each feature type, which is built
+    on the first query and kept until features are added or removed. seqid_index holds the features on each seqid (as
+    a set of (feature type dictionary name, ID) pairs, as the same ID may be used in more than one feature type), so
+    that get_seqid takes time in proportion to the number of features on the seqid."""
     def __init__(self, genome = None):
+        self.ID_index = {}
+        self.interval_indexes = {}
+        self.seqid_index = {}
         self.gene = {}
         self.transcript = {}
         self.CDS = {}
         self.UTR = {}
         self.genome = genome
     
+    def __setattr__(self, name, value):
+        #any dictionary assigned to the AnnotationSet is a feature type dictionary and is wrapped so that its
+        #   features are registered in ID_index
+        if isinstance(value, dict) and not name in ['ID_index','interval_indexes','seqid_index','genome']:
+            if name in self.__dict__:
+                self.__delattr__(name)
+            value = FeatureDict(self, value, name)
+        self.__dict__[name] = value
+    
+    def __delattr__(self, name):
+        if isinstance(self.__dict__[name], FeatureDict):
+            feature_dict = self.__dict__.pop(name)
+            for ID in feature_dict:
+                self.remove_from_seqid_index(ID, feature_dict[ID], name)
+                if self.ID_index.get(ID) is feature_dict[ID]:
+                    self.reindex_ID(ID)
+            self.interval_indexes.clear()
+            return
+        del self.__dict__[name]
+    
     def __getitem__(self,item):
-        all_dicts = {}
-        for attribute in dir(self):
-            if type(eval("self." + attribute)) == dict:
+        return self.ID_index[item]
+    
+    def reindex_ID(self, ID):
+        """points ID_index at the feature with ID in the feature type dictionary that comes last in sorted order, the one
+        lookups have always returned when several feature types have a feature with the same ID, or removes ID from
+        ID_index if no feature type dictionary has it"""
+        for feature_type in sorted(self.get_feature_types(), reverse = True):
+            if dict.__contains__(self.__dict__[feature_type], ID):
+                self.ID_index[ID] = dict.__getitem__(self.__dict__[feature_type], ID)
+                return
+        self.ID_index.pop(ID, None)
+    
+    def get_feature_types(self):
+        """returns list of the feature types (e.g. "gene", "CDS", "match") which have a dictionary in this AnnotationSet"""
+        return [attribute for attribute in self.__dict__ if isinstance(self.__dict__[attribute], FeatureDict)]
+    
+    def finalize(self, IDs = None, verbose = False):
+        """finds the coords of the ParentAnnotations with IDs (every ParentAnnotation if IDs is None) from their children,
+        so that they are cached for later calls to get_coords. Each feature's coords are found once, as a parent's coords
+        are built from its children's cached coords. Features whose coords can't be found (because of children missing
+        from the AnnotationSet, or without coords) are skipped, and reported on stderr if verbose"""
+        if IDs == None:
+            features = self.ID_index.values()
+        else:
+            features = [self.ID_index[ID] for ID in IDs if ID in self.ID_index]
+        skipped_IDs = []
+        for feature in features:
+            if feature.__class__.__name__ == 'ParentAnnotation':
                 try:
-                    all_dicts[item] = eval("self." + attribute)[item]
-                except:
-                    pass
-        return all_dicts[item]
+                    feature.get_coords()
+                except KeyError as missing_child:
+                    skipped_IDs.append(feature.ID + ' (missing child ' + str(missing_child) + ')')
+                except TypeError:
+                    #min and max of None, for children that have no coords
+                    skipped_IDs.append(feature.ID + ' (child without coords)')
+        if verbose and skipped_IDs != []:
+            skipped_count = len(skipped_IDs)
+            if skipped_count > 10:
+                skipped_IDs = skipped_IDs[:10] + ['...']
+            sys.stderr.write("couldn't find coords of " + str(skipped_count) + " features: " + ", ".join(skipped_IDs) + "\n")
+
+    def compact(self):
+        """rebuilds the feature dictionaries, ID_index and attribute dictionaries of the features in place, freeing the
+        space left over from growing them.
+        
+        Writers such as write_gff and get_fasta output features and attributes in dictionary order, and the files
+        read_gff, read_exonerate and sliding_window_calculate output from have always been in the order of dictionaries
+        filled afresh from the ones they built (they used to return deep copies). Each dictionary is therefore emptied
+        and refilled with its items in its own iteration order, which gives that order whatever order the items were
+        first added in. Callers that need output in this order call compact on the sets they return. Refilling a
+        dictionary in its new order doesn't always give that order again, so each feature dictionary keeps the keys it
+        was refilled with as its refill_order, in which get_annotation_table saves its features."""
+        def refill(dictionary):
+            #keys and values rather than items, as allocating a tuple per item sets off the garbage collector
+            keys = dict.keys(dictionary)
+            values = dict.values(dictionary)
+            dict.clear(dictionary)
+            for index in xrange(len(keys)):
+                dict.__setitem__(dictionary, keys[index], values[index])
+            return keys
+        def rebuild_instance_dict(instance):
+            instance_dict = {}
+            for key, value in instance.__dict__.items():
+                instance_dict[key] = value
+            instance.__dict__ = {}
+            instance.__dict__.update(instance_dict)
+        for feature in self.ID_index.itervalues():
+            rebuild_instance_dict(feature)
+        for attribute in self.__dict__.values():
+            if isinstance(attribute, dict):
+                keys = refill(attribute)
+                if isinstance(attribute, FeatureDict):
+                    attribute.refill_order = keys
+        rebuild_instance_dict(self)
+
+    def get_interval_index(self, feature_type = None):
+        """returns IntervalIndex of the features of feature_type, or of all features if feature_type is None"""
+        if not feature_type in self.interval_indexes:
+            if feature_type == None:
+                features = self.ID_index
+            else:
+                features = self.__dict__[feature_type]
+            self.interval_indexes[feature_type] = IntervalIndex(features)
+        return self.interval_indexes[feature_type]
+    
+    def overlapping(self, seqid, start, end, feature_type = None):
+        """returns list of IDs of features (of feature_type, if given) on seqid overlapping coords start to end"""
+        return self.get_interval_index(feature_type).overlapping(seqid, start, end)
+    
+    def contained_in(self, seqid, start, end, feature_type = None):
+        """returns list of IDs of features (of feature_type, if given) on seqid that lie within coords start to end"""
+        return self.get_interval_index(feature_type).contained_in(seqid, start, end)
+    
+    def contains(self, seqid, start, end, feature_type = None):
+        """returns list of IDs of features (of feature_type, if given) on seqid that span all of coords start to end"""
+        return self.get_interval_index(feature_type).contains(seqid, start, end)
     
     def read_gff(self, gff, *args, **kwargs):
         kwargs["annotation_set_to_modify"] = self
         read_gff(gff, *args, **kwargs)
     
+    def add_to_seqid_index(self, ID, annotation, feature_type):
+        seqid = getattr(annotation, 'seqid', None)
+        if not seqid in self.seqid_index:
+            self.seqid_index[seqid] = set()
+        self.seqid_index[seqid].add((feature_type, ID))
+    
+    def remove_from_seqid_index(self, ID, annotation, feature_type):
+        seqid_features = self.seqid_index.get(getattr(annotation, 'seqid', None))
+        if seqid_features != None:
+            seqid_features.discard((feature_type, ID))
+    
+    def get_seqid_features(self, seqid):
+        """returns list of (ID, feature type dictionary name) of the features on seqid"""
+        return [(ID, feature_type) for feature_type, ID in self.seqid_index.get(seqid, ())]
+    
     def get_seqid(self, seqid):
-        seqid_annotation_set = AnnotationSet()        
-        for attribute in dir(self):
-            if type(eval("self." + attribute)) == dict:
-                setattr(seqid_annotation_set,attribute,{})
-                for feature in eval('self.'+ attribute):
-                    feature_obj = eval('self.' + attribute)[feature]
-                    if feature_obj.seqid == seqid:
-                        eval('seqid_annotation_set.' + feature_obj.feature_type)[feature] = feature_obj
+        """returns AnnotationSet of the features on seqid (the same feature objects, which still belong to this set)"""
+        seqid_annotation_set = AnnotationSet()
+        for attribute in self.get_feature_types():
+            setattr(seqid_annotation_set,attribute,{})
+        for ID, feature_type in self.get_seqid_features(seqid):
+            seqid_annotation_set.__dict__[feature_type][ID] = self.__dict__[feature_type][ID]
         return seqid_annotation_set
     
     def get_all_seqids(self):
-        seqid_list = []
-        for attribute in dir(self):
-            if type(eval("self." + attribute)) == dict:
-                for feature in eval('self.'+ attribute):
-                    seqid_list.append(eval('self.' + attribute)[feature].seqid)
-        return list(set(seqid_list))
+        return [seqid for seqid in self.seqid_index if len(self.seqid_index[seqid]) > 0]
     
-    def read_exonerate(self, exonerate_output):
-        read_exonerate(exonerate_output,annotation_set_to_modify = self)
+    def read_exonerate(self, exonerate_output, workers = 1):
+        read_exonerate(exonerate_output,annotation_set_to_modify = self, workers = workers)
     
-    def read_blast_csv(self, blast_csv, hierarchy = ['match','match_part'], source = 'blast', find_truncated_locname = False):
-        read_blast_csv(blast_csv, annotation_set_to_modify = self, hierarchy = hierarchy, source = source, find_truncated_locname = find_truncated_locname)
+    def read_blast_csv(self, blast_csv, hierarchy = ['match','match_part'], source = 'blast', find_truncated_locname = False, **chain_options):
+        read_blast_csv(blast_csv, annotation_set_to_modify = self, hierarchy = hierarchy, source = source, find_truncated_locname = find_truncated_locname,
+                       **chain_options)
     
     def read_cegma_gff(self, cegma_gff):
         read_cegma_gff(cegma_gff, annotation_set_to_modify = self)
@@ -583,20 +1618,49 @@ class AnnotationSet():
         
     
 
-class BaseAnnotation():
+class AnnotationFeature():
+    """methods shared by BaseAnnotation and ParentAnnotation"""
+    def clear_parent_coords(self):
+        """clears the cached coords of this feature's parent and its ancestors"""
+        if self.__dict__.get('parent') != None and self.__dict__.get('annotation_set') != None:
+            parent = self.annotation_set.ID_index.get(self.parent)
+            if parent != None:
+                parent.clear_coords()
+    
+    def move_seqid(self, seqid):
+        """moves this feature to seqid in the seqid_index of its AnnotationSet"""
+        annotation_set = self.__dict__.get('annotation_set')
+        if annotation_set != None and 'seqid_index' in annotation_set.__dict__:
+            seqid_features = annotation_set.seqid_index.get(self.__dict__.get('seqid'), ())
+            for feature_type in annotation_set.get_feature_types():
+                if (feature_type, self.ID) in seqid_features and dict.get(annotation_set.__dict__[feature_type], self.ID) is self:
+                    annotation_set.remove_from_seqid_index(self.ID, self, feature_type)
+                    annotation_set.seqid_index.setdefault(seqid, set()).add((feature_type, self.ID))
+
+
+class BaseAnnotation(AnnotationFeature):
     """Bottom-most level annotation on a genome, for example CDS, UTR, Match_part, etc. Anything that should have no children"""
     def __init__(self, ID, seqid, coords, feature_type, parent = None, strand = ".", other_attributes = {}, annotation_set = None):
-        #Sets up most attributes
-        self.ID = ID
-        self.seqid = seqid
-        self.coords = coords
-        self.feature_type = feature_type
-        self.annotation_set = annotation_set
+        #Sets up most attributes. They are put straight into __dict__ as a new feature has no parent coords to clear
+        attributes = self.__dict__
+        attributes['ID'] = ID
+        attributes['seqid'] = seqid
+        attributes['coords'] = coords
+        attributes['feature_type'] = feature_type
+        attributes['annotation_set'] = annotation_set
         for attribute in other_attributes:
-            setattr(self, attribute, other_attributes[attribute])
-        self.parent = parent
-        self.strand = strand
+            attributes[attribute] = other_attributes[attribute]
+        attributes['parent'] = parent
+        attributes['strand'] = strand
+
+    def __setattr__(self, name, value):
+        if name == 'seqid':
+            self.move_seqid(value)
+        self.__dict__[name] = value
+        if name == 'coords':
+            self.clear_parent_coords()
 
+    
     def get_coords(self):
         return self.coords
     
@@ -615,13 +1679,12 @@ class BaseAnnotation():
     
     def get_gff(self, gff_format = "simple gff3"):
         if self.annotation_set != None:
-            fields = ['seqid','source','feature_type','get_coords()[0]','get_coords()[1]','score','strand','phase']
-            fields_list = []
-            for field in fields:
-                try:
-                    fields_list.append(str(eval('self.' + field)))
-                except AttributeError:
-                    fields_list.append('.')
+            return '\n'.join(self.iter_gff_lines(gff_format))
+    
+    def iter_gff_lines(self, gff_format = "simple gff3"):
+        """yields the lines of get_gff one at a time"""
+        if self.annotation_set != None:
+            fields_list = get_gff_fields(self)
             if gff_format in ["simple gff3","extended gff3","exon added gff3"]:
                 defline = 'ID=' + self.ID
                 if self.parent != None:
@@ -640,39 +1703,134 @@ class BaseAnnotation():
                 defline = 'transcript_id ' + self.parent + ';gene_id ' + self.annotation_set[self.parent].parent
             fields_list.append(defline)
             if gff_format == "exon added gff3" and fields_list[2] == "CDS":
-                return '\t'.join(fields_list).replace('\tCDS\t','\texon\t').replace('ID=','ID=ExonOf') + "\n" + '\t'.join(fields_list)
-            else:
-                return '\t'.join(fields_list)
+                yield '\t'.join(fields_list).replace('\tCDS\t','\texon\t').replace('ID=','ID=ExonOf')
+            yield '\t'.join(fields_list)
+
+
+class ChildList(list):
+    """child_list of a ParentAnnotation. Any change to the list clears the cached coords of the ParentAnnotation, which
+    is held by a weak reference, so that features aren't left in reference cycles (read_gff pauses the garbage
+    collector)."""
+    __slots__ = ['parent_reference']
+    
+    def __init__(self, parent_annotation, children = []):
+        list.__init__(self, children)
+        self.parent_reference = None
+        if parent_annotation != None:
+            self.parent_reference = weakref.ref(parent_annotation)
+    
+    def changed(self):
+        if getattr(self, 'parent_reference', None) != None:
+            parent_annotation = self.parent_reference()
+            if parent_annotation != None:
+                parent_annotation.clear_coords()
+    
+    def __deepcopy__(self, memo):
+        #the copy belongs to the copy of the ParentAnnotation rather than to the original
+        parent_annotation = None
+        if getattr(self, 'parent_reference', None) != None and self.parent_reference() != None:
+            parent_annotation = copy.deepcopy(self.parent_reference(), memo)
+        return ChildList(parent_annotation, copy.deepcopy(list(self), memo))
+    
+    def append(self, child):
+        list.append(self, child)
+        self.changed()
+    
+    def extend(self, children):
+        list.extend(self, children)
+        self.changed()
+    
+    def insert(self, index, child):
+        list.insert(self, index, child)
+        self.changed()
+    
+    def remove(self, child):
+        list.remove(self, child)
+        self.changed()
+    
+    def pop(self, *index):
+        child = list.pop(self, *index)
+        self.changed()
+        return child
+    
+    def __setitem__(self, index, child):
+        list.__setitem__(self, index, child)
+        self.changed()
+    
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self.changed()
     
+    def __setslice__(self, start, stop, children):
+        list.__setslice__(self, start, stop, children)
+        self.changed()
+    
+    def __delslice__(self, start, stop):
+        list.__delslice__(self, start, stop)
+        self.changed()
+    
+    def __iadd__(self, children):
+        self.extend(children)
+        return self
 
 
-class ParentAnnotation():
+class ParentAnnotation(AnnotationFeature):
     """Parent of any BaseAnnotation. Examples include genes and transcripts. Suggested hierarchy for genes is
-    CDS (as BaseAnnotation) -> transcript -> gene."""
+    CDS (as BaseAnnotation) -> transcript -> gene. Coords are found from the children the first time get_coords is
+    called and cached in cached_coords, which is cleared (along with the cached coords of ancestors) whenever
+    child_list changes or a descendant is given new coords."""
+    #a class attribute until coords are cached, so that a new feature's attribute dictionary holds the same keys,
+    #added in the same order, as it always has (which decides the order writers output attributes in)
+    cached_coords = None
+    
     def __init__(self, ID, seqid, feature_type, child_list = [], parent = None, strand = ".", annotation_set = None, other_attributes = {}):
-        self.ID = ID
-        self.seqid = seqid
-        self.feature_type = feature_type
-        self.child_list = copy.copy(child_list)
-        self.parent = parent
-        self.annotation_set = annotation_set
-        self.strand = strand
+        #Sets up most attributes. They are put straight into __dict__ as a new feature has no cached coords to clear
+        attributes = self.__dict__
+        attributes['ID'] = ID
+        attributes['seqid'] = seqid
+        attributes['feature_type'] = feature_type
+        attributes['child_list'] = ChildList(self, child_list)
+        attributes['parent'] = parent
+        attributes['annotation_set'] = annotation_set
+        attributes['strand'] = strand
         for attribute in other_attributes:
             setattr(self, attribute, other_attributes[attribute])
     
+    def __setattr__(self, name, value):
+        #child_list is wrapped so that changes to it clear cached coords
+        if name == 'child_list':
+            value = ChildList(self, value)
+        elif name == 'seqid':
+            self.move_seqid(value)
+        self.__dict__[name] = value
+        if name == 'child_list':
+            self.clear_coords()
+
+    
+    def clear_coords(self):
+        """clears the cached coords of this feature and its ancestors"""
+        if self.__dict__.get('cached_coords') != None:
+            self.cached_coords = None
+            self.clear_parent_coords()
+    
     def get_coords(self):
-        if len(self.child_list) > 0 and self.annotation_set != None:
-            coords_list = []
+        if self.cached_coords == None and len(self.child_list) > 0 and self.annotation_set != None:
+            starts = []
+            ends = []
             for child in self.child_list:
                 child_object = self.annotation_set[child]
                 if child_object.__class__.__name__ == 'ParentAnnotation':
-                    coords_list = coords_list + list(child_object.get_coords())
+                    child_coords = child_object.get_coords()
                 elif child_object.__class__.__name__ == 'BaseAnnotation':
-                    coords_list = coords_list + list(child_object.coords)
+                    child_coords = child_object.coords
                 else:
                     print "for some reason you have children in ParentAnnotation " + self.ID + " which are neither \
                     ParentAnnotation objects nor BaseAnnotation object. Get your act together"
-            return (min(coords_list),max(coords_list))
+                    continue
+                starts.append(min(child_coords))
+                ends.append(max(child_coords))
+            self.cached_coords = (min(starts), max(ends))
+        return self.cached_coords
     
     def get_fasta(self, seq_type = "nucleotide", longest=False, genomic = False, name_from = 'ID'):
         """Returns fasta of this annotation's sequence. If this feature has multiple subfeatures (e.g. this is a gene
@@ -733,14 +1891,13 @@ class ParentAnnotation():
     def get_gff(self, gff_format = "simple gff3"):
         """presets currently include: "simple gff3", "extended gff3", "gtf", "exon added gff3", and "augustus hint". Will eventually include more by request"""
         if self.annotation_set != None:
-            fields = ['seqid','source','feature_type','get_coords()[0]','get_coords()[1]','score','strand','phase']
-            fields_list = []
+            return '\n'.join(self.iter_gff_lines(gff_format))
+    
+    def iter_gff_lines(self, gff_format = "simple gff3"):
+        """yields the lines of get_gff one at a time (or '' if there are none, as get_gff would return)"""
+        if self.annotation_set != None:
+            fields_list = get_gff_fields(self)
             parent_line = True
-            for field in fields:
-                try:
-                    fields_list.append(str(eval('self.' + field)))
-                except AttributeError:
-                    fields_list.append('.')
             if gff_format in ["simple gff3","extended gff3","exon added gff3"]:
                 defline = 'ID=' + self.ID
                 if self.parent != None:
@@ -753,29 +1910,258 @@ class ParentAnnotation():
                 parent_line = False
             elif gff_format == 'gtf':
                 parent_line = False
+            line_count = 0
             if parent_line:
                 fields_list.append(defline)
-                lines_list = ['\t'.join(fields_list)]
-            else:
-                lines_list = []
+                line_count = line_count + 1
+                yield '\t'.join(fields_list)
             child_dict = {}
             for child in self.child_list:
                 child_object = self.annotation_set[child]
                 if child_object.get_coords() not in child_dict:
-                    child_dict[child_object.get_coords()] = child_object.get_gff(gff_format)
+                    child_dict[child_object.get_coords()] = child_object
                 else:
-                    child_dict[(child_object.get_coords()[0],child_object.get_coords()[1] + len(child_dict))] = child_object.get_gff(gff_format)
+                    child_dict[(child_object.get_coords()[0],child_object.get_coords()[1] + len(child_dict))] = child_object
             child_coords = list(child_dict)
             child_coords.sort()
+            #in exon added gff3, CDS lines go after all other lines
+            CDS_lines = []
             for child_index in child_coords:
-                lines_list.append(child_dict[child_index])
-            if gff_format == "exon added gff3":
-                lines_list = '\n'.join(lines_list).split('\n')
-                for line in lines_list[:]:
-                    if line.split('\t')[2] == "CDS":
-                        lines_list.remove(line)
-                        lines_list.append(line)
-            return '\n'.join(lines_list)
+                for line in child_dict[child_index].iter_gff_lines(gff_format):
+                    if gff_format == "exon added gff3" and line.split('\t')[2] == "CDS":
+                        CDS_lines.append(line)
+                    else:
+                        line_count = line_count + 1
+                        yield line
+            for line in CDS_lines:
+                line_count = line_count + 1
+                yield line
+            if line_count == 0:
+                yield ""
+
+
+compliment_dict = {'a':'t','t':'a','g':'c','c':'g','A':'T','T':'A','G':'C','C':'G','n':'n','N':'N','-':'-'}
+#256-character table for str.translate: compliments the characters in compliment_dict and turns everything else into 'n'
+compliment_table = "".join([compliment_dict.get(chr(character), 'n') for character in range(256)])
+
+
+#amino acids of codons in NCBI translation tables, with codons in TCAG order (TTT, TTC, TTA, TTG, TCT ... GGG)
+genetic_codes = {1: 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 2: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG',
+                 3: 'FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 4: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 5: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG',
+                 6: 'FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 9: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG',
+                 10: 'FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 11: 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 12: 'FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 13: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG',
+                 14: 'FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG',
+                 16: 'FFLLSSSSYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 21: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNNKSSSSVVVVAAAADDEEGGGG',
+                 22: 'FFLLSS*SYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 23: 'FF*LSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 24: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG',
+                 25: 'FFLLSSSSYY**CCGWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+                 26: 'FFLLSSSSYY**CC*WLLLAPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'}
+#base codes used to find codon indices: A, C, G and T (either case) are 0-3, anything else is 4. The codon index of a
+#triplet is 25 * first + 5 * second + third base code
+base_code_table = numpy.zeros(256, dtype = numpy.uint8) + 4
+for base_code, base in enumerate('ACGT'):
+    base_code_table[ord(base)] = base_code
+    base_code_table[ord(base.lower())] = base_code
+codon_list = [first + second + third for first in 'ACGTX' for second in 'ACGTX' for third in 'ACGTX']
+ambiguous_codons = numpy.array(['X' in codon for codon in codon_list])
+codon_lookups = {}
+
+
+def get_genetic_code(genetic_code = 1):
+    """returns dict of codon to amino acid for NCBI translation table number genetic_code"""
+    codons = [first + second + third for first in 'TCAG' for second in 'TCAG' for third in 'TCAG']
+    return dict(zip(codons, genetic_codes[genetic_code]))
+
+
+def get_codon_lookup(library = None, genetic_code = 1):
+    """returns array of the translation of each codon index (see base_code_table) using library, or NCBI translation table
+    number genetic_code if library is None, and whether library has codons containing characters other than A, C, G and
+    T. Codons missing from library translate to 'X'"""
+    if library == None:
+        if genetic_code not in codon_lookups:
+            codon_lookups[genetic_code] = get_codon_lookup(get_genetic_code(genetic_code))
+        return codon_lookups[genetic_code]
+    translations = [library.get(codon, 'X') for codon in codon_list]
+    if set([len(translation) for translation in translations]) == set([1]):
+        lookup = numpy.array(translations, dtype = 'S1')
+    else:
+        lookup = numpy.array(translations, dtype = object)
+    has_ambiguous_codons = len([codon for codon in library if len(codon) != 3 or codon.strip('ACGT') != ""]) > 0
+    return lookup, has_ambiguous_codons
+
+
+def get_codon_indices(seq):
+    """returns array of the codon index (see base_code_table) of the triplet starting at each position of seq"""
+    base_codes = base_code_table[numpy.frombuffer(seq, dtype = numpy.uint8)]
+    codon_indices = base_codes[:-2] * 25
+    codon_indices += base_codes[1:-1] * 5
+    codon_indices += base_codes[2:]
+    return codon_indices
+
+
+def translate_codons(seq, codon_indices, library = None, genetic_code = 1, frame = 0, trimX = True):
+    """returns translation of seq in frame, given codon_indices from get_codon_indices(seq). Frames 1 and 2 begin with the
+    translation of the partial codon before the first codon starting at a position where (position + frame) % 3 == 0,
+    and trimX removes a leading 'X'"""
+    lookup, has_ambiguous_codons = get_codon_lookup(library, genetic_code)
+    if library == None:
+        library = get_genetic_code(genetic_code)
+    first_codon_end = frame + (2 - 2 * frame) % 3 + 1
+    first_codon = library.get(seq[frame:first_codon_end].upper(), 'X')
+    codon_indices = codon_indices[first_codon_end::3]
+    translation = lookup[codon_indices]
+    if has_ambiguous_codons:
+        if translation.dtype != object:
+            translation = translation.astype(object)
+        for codon_number in numpy.nonzero(ambiguous_codons[codon_indices])[0]:
+            codon_start = first_codon_end + codon_number * 3
+            translation[codon_number] = library.get(seq[codon_start:codon_start + 3].upper(), 'X')
+    if translation.dtype == object:
+        newseq = first_codon + "".join(translation)
+    else:
+        newseq = first_codon + translation.tostring()
+    if trimX:
+        if newseq[0] == 'X':
+            newseq = newseq[1:]
+    return newseq
+
+
+def find_orfs(sequences, min_length = 1, longest = False, from_atg = False, strand = 'both', genetic_code = 1,
+              output = "records", annotation_set_to_modify = None):
+    """Finds open reading frames (ORFs) in all six frames of each sequence in sequences, a dict of seqid to sequence
+    (e.g. a GenomeSequence). ORFs start after a stop codon (or at the first codon of a frame), or at the first M after it
+    if from_atg, and run to the next stop codon, which is included in their coords, or to the last codon of the frame.
+    Codons of all sequences are translated together in one pass per strand and ORFs are found as runs of codons between
+    breaks (stop codons or sequence ends), so time depends on total sequence length rather than number of sequences.
+    ORFs with fewer than min_length amino acids are skipped, and longest keeps just the longest ORF of each sequence.
+    output may be "records", a list of (seqid, start, end, strand, frame, peptide) tuples with 1-based genomic coords
+    and frame counted from the start of the strand, sorted by sequence, strand and start, or "annotation_set", where
+    each ORF is a gene with one transcript and one CDS."""
+    lookup = get_codon_lookup(None, genetic_code)[0]
+    seqids = list(sequences)
+    seq_list = [str(sequences[seqid]) for seqid in seqids]
+    seq_lengths = numpy.array([len(seq) for seq in seq_list], dtype = numpy.int64)
+    #sequences are joined with two character spacers so that no codon is part of two sequences
+    seq_starts = numpy.concatenate(([0], numpy.cumsum(seq_lengths + 2)[:-1])).astype(numpy.int64)
+    seq_ends = seq_starts + seq_lengths
+    joined_seq = "NN".join(seq_list)
+    if strand == 'both':
+        strands = ['+', '-']
+    else:
+        strands = [strand]
+    orf_arrays = {'seq_index': [], 'strand': [], 'start': [], 'end': [], 'codon_count': []}
+    strand_codons = {}
+    for orf_strand in strands:
+        if orf_strand == '+':
+            strand_seq = joined_seq
+            strand_seq_starts = seq_starts
+        else:
+            strand_seq = str.translate(joined_seq[::-1], compliment_table)
+            strand_seq_starts = len(joined_seq) - seq_ends
+        if len(strand_seq) < 3:
+            continue
+        strand_seq_order = numpy.argsort(strand_seq_starts)
+        strand_codons[orf_strand] = lookup[get_codon_indices(strand_seq)]
+        del strand_seq
+        codons = strand_codons[orf_strand].view(numpy.uint8)
+        breaks = codons == ord('*')
+        #codons that run past the end of their sequence
+        for end_offset in [1, 2, 3, 4]:
+            end_codons = strand_seq_starts + seq_lengths + 2 - end_offset
+            breaks[end_codons[(end_codons < len(breaks)) & (end_codons >= strand_seq_starts)]] = True
+        #codons starting at the same position mod 3 are consecutive codons in one frame of one sequence, or are separated
+        #by breaks at sequence ends
+        for codon_phase in [0, 1, 2]:
+            phase_is_stop = numpy.concatenate((codons[codon_phase::3] == ord('*'), [False]))
+            phase_breaks = numpy.nonzero(breaks[codon_phase::3])[0]
+            run_starts = numpy.concatenate(([0], phase_breaks + 1))
+            run_ends = numpy.concatenate((phase_breaks, [len(phase_is_stop) - 1]))
+            if from_atg:
+                phase_starts = numpy.nonzero(codons[codon_phase::3] == ord('M'))[0]
+                phase_starts = numpy.concatenate((phase_starts, [len(breaks)]))
+                run_starts = phase_starts[numpy.searchsorted(phase_starts, run_starts)]
+            keep = run_ends - run_starts >= max(min_length, 1)
+            run_starts = run_starts[keep]
+            run_ends = run_ends[keep]
+            if len(run_starts) == 0:
+                continue
+            orf_starts = codon_phase + run_starts * 3
+            seq_indices = strand_seq_order[numpy.searchsorted(strand_seq_starts[strand_seq_order], orf_starts, 'right') - 1]
+            if longest:
+                #only ORFs as long as the longest of their sequence in this frame can be the longest of the sequence
+                seq_changes = numpy.concatenate(([0], numpy.nonzero(numpy.diff(seq_indices))[0] + 1))
+                seq_run_lengths = numpy.diff(numpy.concatenate((seq_changes, [len(seq_indices)])))
+                keep = run_ends - run_starts == numpy.repeat(numpy.maximum.reduceat(run_ends - run_starts, seq_changes),
+                                                             seq_run_lengths)
+                run_starts = run_starts[keep]
+                run_ends = run_ends[keep]
+                orf_starts = orf_starts[keep]
+                seq_indices = seq_indices[keep]
+            has_stop = phase_is_stop[run_ends]
+            orf_arrays['seq_index'].append(seq_indices)
+            orf_arrays['strand'].append(numpy.zeros(len(orf_starts), dtype = numpy.int64) + ['+', '-'].index(orf_strand))
+            orf_arrays['start'].append(orf_starts)
+            orf_arrays['end'].append(codon_phase + run_ends * 3 + has_stop * 3)
+            orf_arrays['codon_count'].append(run_ends - run_starts)
+        strand_codons[orf_strand] = strand_codons[orf_strand].tostring()
+        del codons, breaks
+    if len(orf_arrays['start']) > 0:
+        for array_name in orf_arrays:
+            orf_arrays[array_name] = numpy.concatenate(orf_arrays[array_name])
+    else:
+        for array_name in orf_arrays:
+            orf_arrays[array_name] = numpy.zeros(0, dtype = numpy.int64)
+    is_reverse = orf_arrays['strand'] == 1
+    local_starts = orf_arrays['start'] - numpy.where(is_reverse, len(joined_seq) - seq_ends[orf_arrays['seq_index']],
+                                                     seq_starts[orf_arrays['seq_index']])
+    local_ends = local_starts + orf_arrays['end'] - orf_arrays['start']
+    seq_orf_lengths = seq_lengths[orf_arrays['seq_index']]
+    genomic_starts = numpy.where(is_reverse, seq_orf_lengths - local_ends + 1, local_starts + 1)
+    genomic_ends = numpy.where(is_reverse, seq_orf_lengths - local_starts, local_ends)
+    #sorting on single integer keys is much faster than numpy.lexsort
+    orf_order = numpy.argsort((orf_arrays['seq_index'] * 2 + orf_arrays['strand']) * (len(joined_seq) + 1) + genomic_starts)
+    if longest and len(orf_order) > 0:
+        max_codon_count = orf_arrays['codon_count'].max()
+        orf_order = orf_order[numpy.argsort(orf_arrays['seq_index'][orf_order] * (max_codon_count + 1) + max_codon_count -
+                                            orf_arrays['codon_count'][orf_order], kind = 'mergesort')]
+        first_of_seq = numpy.concatenate(([True], numpy.diff(orf_arrays['seq_index'][orf_order]) != 0))
+        orf_order = orf_order[first_of_seq]
+    orfs = []
+    for seq_index, genomic_start, genomic_end, strand_index, frame, codon_start, codon_end in zip(
+            orf_arrays['seq_index'][orf_order].tolist(), genomic_starts[orf_order].tolist(), genomic_ends[orf_order].tolist(),
+            orf_arrays['strand'][orf_order].tolist(), (local_starts[orf_order] % 3).tolist(),
+            orf_arrays['start'][orf_order].tolist(), (orf_arrays['start'] + orf_arrays['codon_count'] * 3)[orf_order].tolist()):
+        orf_strand = ['+', '-'][strand_index]
+        orfs.append((seqids[seq_index], genomic_start, genomic_end, orf_strand, frame,
+                     strand_codons[orf_strand][codon_start:codon_end:3]))
+    if output == "records":
+        return orfs
+    elif output == "annotation_set":
+        if annotation_set_to_modify == None:
+            annotation_set = AnnotationSet()
+        else:
+            annotation_set = annotation_set_to_modify
+        orf_counts = {}
+        for seqid, start, end, orf_strand, frame, peptide in orfs:
+            orf_counts[seqid] = orf_counts.get(seqid, 0) + 1
+            ID = seqid + '-ORF' + str(orf_counts[seqid])
+            annotation_set.gene[ID] = ParentAnnotation(ID, seqid, 'gene', [ID + '-transcript'], None, orf_strand,
+                                                       annotation_set, other_attributes = {'frame': str(frame)})
+            annotation_set.transcript[ID + '-transcript'] = ParentAnnotation(ID + '-transcript', seqid, 'transcript',
+                                                                             [ID + '-CDS'], ID, orf_strand, annotation_set)
+            annotation_set.CDS[ID + '-CDS'] = BaseAnnotation(ID + '-CDS', seqid, (start, end), 'CDS', ID + '-transcript',
+                                                             orf_strand, annotation_set = annotation_set)
+        if annotation_set_to_modify == None:
+            return annotation_set
 
 
 class Sequence(str):
@@ -783,126 +2169,308 @@ class Sequence(str):
         translating, etc."""
     def reverse_compliment(self):
         """returns reverse compliment of self"""
-        new_sequence_list = []
-        compliment_dict = {'a':'t','t':'a','g':'c','c':'g','A':'T','T':'A','G':'C','C':'G','n':'n','N':'N','-':'-'}
-        for residue in self[::-1]:
-            try:
-                new_sequence_list.append(compliment_dict[residue])
-            except KeyError:
-                new_sequence_list.append('n')
-        return Sequence(''.join(new_sequence_list))
-    
-    def translate(self,library = {'TTT':'F','TTC':'F','TTA':'L','TTG':'L','CTT':'L','CTC':'L','CTA':'L','CTG':'L',
-                                  'ATT':'I','ATC':'I','ATA':'I','ATG':'M','GTT':'V','GTC':'V','GTA':'V','GTG':'V',
-                                  'TCT':'S','TCC':'S','TCA':'S','TCG':'S','CCT':'P','CCC':'P','CCA':'P','CCG':'P',
-                                  'ACT':'T','ACC':'T','ACA':'T','ACG':'T','GCT':'A','GCC':'A','GCA':'A','GCG':'A',
-                                  'TAT':'Y','TAC':'Y','TAA':'*','TAG':'*','CAT':'H','CAC':'H','CAA':'Q','CAG':'Q',
-                                  'AAT':'N','AAC':'N','AAA':'K','AAG':'K','GAT':'D','GAC':'D','GAA':'E','GAG':'E',
-                                  'TGT':'C','TGC':'C','TGA':'*','TGG':'W','CGT':'R','CGC':'R','CGA':'R','CGG':'R',
-                                  'AGT':'S','AGC':'S','AGA':'R','AGG':'R','GGT':'G','GGC':'G','GGA':'G','GGG':'G'},
-                  frame = 0, strand = '+',trimX = True):
-        triplet = ""
-        newseq = ""
+        return Sequence(str.translate(self[::-1], compliment_table))
+    
+    def translate(self, library = None, frame = 0, strand = '+', trimX = True, genetic_code = 1):
+        """returns translation of self in frame on strand. Codons are translated using library (a dict of codon to amino
+        acid) or, if library is None, NCBI translation table number genetic_code"""
         if strand == '+':
             seq = self
         elif strand == '-':
             seq = self.reverse_compliment()
         if len(seq) > (2 + frame):
-            for residue_position in range(frame, len(self)):
-                triplet = triplet + seq[residue_position].upper()
-                if (residue_position + frame) % 3 == 2:
-                    try:
-                        newseq = newseq + library[triplet]
-                    except KeyError:
-                        newseq = newseq + 'X'
-                    triplet = ""
-            if trimX:
-                if newseq[0] == 'X':
-                    newseq = newseq[1:]
-            return newseq
-    
-    def get_orfs(self, longest = False, strand = 'both', from_atg = False):
-        orflist = []
-        if longest:
-            candidate_list = []
-            longest_orf_len = 0
-        for frame in [0,1,2]:
-            for strand in ['-','+']:
-                translated_seq = self.translate(frame=frame,strand=strand)
-                if translated_seq:
-                    translated_seq_list = translated_seq.split('*')
-                    for orf in translated_seq_list:
-                        if from_atg:
-                            try:
-                                output_orf = 'M' + ''.join(orf.split('M')[1:])
-                            except IndexError:
-                                continue
-                        else:
-                            output_orf = orf
-                        if longest:
-                            if len(output_orf) > longest_orf_len:
-                                candidate_list.append(output_orf)
-                                longest_orf_len = len(output_orf)
-                        else:
-                            orflist.append(output_orf)
+            return translate_codons(seq, get_codon_indices(seq), library, genetic_code, frame, trimX)
+    
+    def translate_frames(self, library = None, trimX = True, genetic_code = 1):
+        """returns dict of (frame, strand) to translation of self for frames 0, 1 and 2 on both strands, finding the
+        codons of each strand once"""
+        translations = {}
+        for strand, seq in [('+', self), ('-', self.reverse_compliment())]:
+            if len(seq) > 2:
+                codon_indices = get_codon_indices(seq)
+            for frame in [0, 1, 2]:
+                if len(seq) > (2 + frame):
+                    translations[(frame, strand)] = translate_codons(seq, codon_indices, library, genetic_code, frame, trimX)
+                else:
+                    translations[(frame, strand)] = None
+        return translations
+    
+    def get_orfs(self, longest = False, strand = 'both', from_atg = False, min_length = 1, genetic_code = 1):
+        """returns list of the peptides of the open reading frames in self (see find_orfs), or the peptide of the longest
+        one if longest"""
+        orfs = find_orfs({'sequence': self}, min_length, longest, from_atg, strand, genetic_code)
         if longest:
-            return candidate_list[-1]
+            if len(orfs) > 0:
+                return orfs[0][5]
+            else:
+                return ""
+        else:
+            return [orf[5] for orf in orfs]
+
+
+class IndexedSequence(object):
+    """Sequence of a single fasta entry that stays on disk. Slicing (or indexing) reads just the lines covering the requested
+    positions from the memory-mapped fasta file and returns them as a string. Positions are found using the entry's
+    length, offset, and line lengths from a samtools-style (.fai) fasta index."""
+    def __init__(self, fasta_map, length, offset, line_bases, line_width):
+        self.fasta_map = fasta_map
+        self.length = length
+        self.offset = offset
+        self.line_bases = line_bases
+        self.line_width = line_width
+    
+    def __len__(self):
+        return self.length
+    
+    def file_position(self, position):
+        """returns position in fasta file of a (0-based) position in this sequence"""
+        return self.offset + (position / self.line_bases) * self.line_width + position % self.line_bases
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return str(self)[key]
+            elif start >= stop:
+                return ""
+            return self.fasta_map[self.file_position(start):self.file_position(stop - 1) + 1].replace('\n','').replace('\r','')
+        else:
+            if key < 0:
+                key = key + self.length
+            if not 0 <= key < self.length:
+                raise IndexError('sequence index out of range')
+            return self.fasta_map[self.file_position(key)]
+    
+    def __str__(self):
+        return self[0:self.length]
+    
+    def __add__(self, other):
+        return str(self) + other
+    
+    def __radd__(self, other):
+        return other + str(self)
+
+
+class PackedSequence(object):
+    """Sequence of a single fasta entry packed into 2 bits per base (A, C, G, or T) in a numpy array. Runs of N, soft-masked
+    (lowercase) intervals, and positions of any other characters are kept in side tables so that the original sequence can
+    be decoded exactly. Slicing (or indexing) decodes just the requested positions and returns them as a string."""
+    bases = numpy.frombuffer('ACGT', dtype = numpy.uint8)
+    base_codes = numpy.zeros(256, dtype = numpy.uint8)
+    base_codes[bases] = range(4)
+    packable = numpy.zeros(256, dtype = bool)
+    packable[numpy.frombuffer('ACGTN', dtype = numpy.uint8)] = True
+    
+    def __init__(self, seq):
+        self.length = len(seq)
+        seq_array = numpy.frombuffer(seq, dtype = numpy.uint8)
+        lowercase = (seq_array >= ord('a')) & (seq_array <= ord('z'))
+        self.softmask_starts, self.softmask_ends = get_runs(lowercase)
+        uppercase = seq_array & 0xDF
+        self.N_starts, self.N_ends = get_runs(uppercase == ord('N'))
+        self.other_positions = numpy.flatnonzero(~self.packable[uppercase])
+        self.other_characters = seq_array[self.other_positions]
+        codes = numpy.zeros(self.length + (-self.length % 4), dtype = numpy.uint8)
+        codes[:self.length] = self.base_codes[uppercase]
+        self.packed = (codes[0::4] << 6) | (codes[1::4] << 4) | (codes[2::4] << 2) | codes[3::4]
+    
+    def __len__(self):
+        return self.length
+    
+    def run_mask(self, run_starts, run_ends, start, stop):
+        """returns boolean numpy array of positions from start to stop that fall within the given runs"""
+        first_run = numpy.searchsorted(run_ends, start, side = 'right')
+        last_run = numpy.searchsorted(run_starts, stop)
+        #runs never touch each other, so no position is both the start of one run and the end of another
+        run_edges = numpy.zeros(stop - start + 1, dtype = numpy.int8)
+        run_edges[numpy.maximum(run_starts[first_run:last_run], start) - start] = 1
+        run_edges[numpy.minimum(run_ends[first_run:last_run], stop) - start] = -1
+        return numpy.cumsum(run_edges[:-1], dtype = numpy.int8).view(bool)
+    
+    def decode(self, start, stop):
+        """returns sequence from start to stop (0-based, end-exclusive) as a numpy array of characters"""
+        packed = self.packed[start / 4:(stop + 3) / 4]
+        codes = numpy.empty((len(packed), 4), dtype = numpy.uint8)
+        for shift_index in range(4):
+            codes[:, shift_index] = (packed >> (6 - 2 * shift_index)) & 3
+        seq_array = self.bases[codes.ravel()[start % 4:start % 4 + stop - start]]
+        seq_array[self.run_mask(self.N_starts, self.N_ends, start, stop)] = ord('N')
+        seq_array[self.run_mask(self.softmask_starts, self.softmask_ends, start, stop)] += 32
+        other_slice = slice(numpy.searchsorted(self.other_positions, start), numpy.searchsorted(self.other_positions, stop))
+        seq_array[self.other_positions[other_slice] - start] = self.other_characters[other_slice]
+        return seq_array
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return str(self)[key]
+            elif start >= stop:
+                return ""
+            return self.decode(start, stop).tobytes()
         else:
-            return orflist
+            if key < 0:
+                key = key + self.length
+            if not 0 <= key < self.length:
+                raise IndexError('sequence index out of range')
+            return self.decode(key, key + 1).tobytes()
+    
+    def __str__(self):
+        return self[0:self.length]
+    
+    def __add__(self, other):
+        return str(self) + other
+    
+    def __radd__(self, other):
+        return other + str(self)
+    
+    def reverse_compliment(self):
+        return Sequence(str(self)).reverse_compliment()
+    
+    def translate(self, *args, **kwargs):
+        return Sequence(str(self)).translate(*args, **kwargs)
 
 
 class GenomeSequence(dict):
-    """genome sequence class, currently takes input in multi-fasta format."""
-    def __init__(self,genome_sequence = None, truncate_names = False):
-        #reads input file location, file, or string
-        sequence_file = ensure_file(genome_sequence)
-        #breaks sequence into sequence blocks (contigs, scaffolds, or chromosomes), adds sequence 
-        #   from each block as dictionary entry into self with block name as key.
-        if sequence_file != None:
-            seq = ""
-            seqname = ""
-            for line in sequence_file:
-                if line[0] == ">":
-                    if truncate_names == True:
-                        seqid = line[1:].replace('\r','').replace('\n','').split()[0]
-                    else:
-                        seqid = line[1:].replace('\r','').replace('\n','')
-                    if seq != "":
-                        self[seqname] = seq
-                        seq = ""
-                    seqname = seqid
-                else:
-                    seq = seq + line.replace('\r','').replace('\n','')
-            if seq != "":
-                self[seqname] = seq
+    """genome sequence class, currently takes input in multi-fasta format. If indexed is True, genome_sequence must be
+    a fasta file location, and rather than being read into memory each sequence is an IndexedSequence read from the
+    file as needed, using a samtools-style .fai index (which is built if not already present next to the fasta). Sequences
+    given as strings or open files, or fastas that can't be indexed, are read into memory instead. If packed
+    is True (and indexed is not), each sequence is stored in memory as a 2-bit PackedSequence. seqid_order lists seqids
+    in the order they were read, so that a cache can add them back in that order (and so iterate over them as this does)."""
+    def __init__(self,genome_sequence = None, truncate_names = False, indexed = False, packed = False):
+        self.seqid_order = []
+        if indexed and type(genome_sequence) == str and os.path.isfile(genome_sequence):
+            fasta_index = load_fasta_index(genome_sequence)
+            if fasta_index == None:
+                sys.stderr.write("fasta " + genome_sequence + " has entries with lines of differing lengths, so it can't be indexed. Reading into memory instead.\n")
+            else:
+                if os.path.getsize(genome_sequence) > 0:
+                    fasta_file = open(genome_sequence, 'rb')
+                    self.fasta_map = mmap.mmap(fasta_file.fileno(), 0, access = mmap.ACCESS_READ)
+                    fasta_file.close()
+                for name, length, offset, line_bases, line_width in fasta_index:
+                    if length > 0:
+                        if truncate_names == True:
+                            seqid = name
+                        else:
+                            #the .fai only has the first word of the header, so the full header is read from the fasta
+                            header_start = self.fasta_map.rfind('\n>', 0, offset) + 1
+                            seqid = self.fasta_map[header_start + 1:self.fasta_map.find('\n', header_start)].replace('\r','')
+                        self[seqid] = IndexedSequence(self.fasta_map, length, offset, line_bases, line_width)
+                        self.seqid_order.append(seqid)
+                return
+        #reads input file location, file, or string, and adds sequence from each block (contigs, scaffolds, or
+        #   chromosomes) as dictionary entry into self with block name as key.
+        for seqid, seq in fasta_generator(genome_sequence, truncate_names = truncate_names == True):
+            if packed:
+                self[seqid] = PackedSequence(seq)
+            else:
+                self[seqid] = seq
+            self.seqid_order.append(seqid)
 
 
 class Genome():
     """genome class, which contains sequence and annotations. Annotations can be given as annotation_set object, gff3, cegma_gff,
-    blast_csv, or exonerate_output (just set annotation_format)."""
-    def __init__(self,genome_sequence = None, annotations = None, varients = None, annotation_format = 'annotation_set', truncate_names = False):
+    blast_csv, or exonerate_output (just set annotation_format). Extra keyword arguments for the annotation reader (e.g.
+    read_gff) can be given as the annotation_options dictionary.
+    
+    If cache is True (or a cache file location), the genome is loaded from a binary cache of the genome_sequence and annotations
+    files if the cache is up to date with them, and is otherwise read as usual and then saved to the cache (see save_cache). By
+    default the cache is saved next to the genome_sequence file (or the annotations file if there is no genome_sequence file).
+    Nothing is cached unless each of genome_sequence and annotations that is given is a file location."""
+    def __init__(self,genome_sequence = None, annotations = None, varients = None, annotation_format = 'annotation_set', truncate_names = False,
+                 indexed = False, packed = False, annotation_options = {}, cache = False):
+        if cache:
+            #the cache can only be checked against files, so nothing is cached if either source is given some other way
+            #(e.g. as an AnnotationSet or a string of fasta)
+            cache_sources = [source for source in [genome_sequence, annotations] if source != None]
+            if cache_sources == [] or [source for source in cache_sources if not (type(source) == str and os.path.isfile(source))] != []:
+                cache = False
+            else:
+                cache_options = [annotation_format, truncate_names, indexed, packed, annotation_options]
+                cache_key = get_cache_key(cache_sources, cache_options)
+                if cache == True:
+                    cache_name = hashlib.md5(repr([[os.path.abspath(source) for source in cache_sources], cache_options])).hexdigest()
+                    cache = cache_sources[0] + '.' + cache_name[:10] + '.magot_cache.npz'
+                cached_genome = read_genome_cache(cache, cache_key)
+                if cached_genome != None:
+                    self.__dict__.update(cached_genome.__dict__)
+                    if indexed:
+                        self.genome_sequence = GenomeSequence(genome_sequence, truncate_names = truncate_names, indexed = True)
+                    if self.annotations != None:
+                        self.annotations.genome = self
+                    return
         if genome_sequence.__class__.__name__ == 'GenomeSequence' or genome_sequence == None:
             self.genome_sequence = genome_sequence
         else:
-            self.genome_sequence = GenomeSequence(genome_sequence, truncate_names = truncate_names)
+            self.genome_sequence = GenomeSequence(genome_sequence, truncate_names = truncate_names, indexed = indexed, packed = packed)
         if annotations != None:
-            if annotations.__class__.__name__ == "AnotationSet" and annotation_format == 'annotation_set':
+            if annotations.__class__.__name__ == "AnnotationSet" and annotation_format == 'annotation_set':
                 self.annotations = annotations
                 self.annotations.genome = self
-            elif annotation_format == 'gff3':
-                self.annotations = read_gff(annotations)
-                self.annotations.genome = self
-            elif annotation_format == 'cegma_gff':
-                self.annotations = read_cegma_gff(annotations)
-                self.annotations.genome = self
-            elif annotation_format == 'blast_csv':
-                self.annotations = read_blast_csv(annotations)
-                self.annotations.genome = self
-            elif annotation_format == 'exonerate_output':
-                self.annotations = read_exonerate(annotations)
+            elif annotation_format in ['gff3', 'cegma_gff', 'blast_csv', 'exonerate_output']:
+                reader = {'gff3': read_gff, 'cegma_gff': read_cegma_gff, 'blast_csv': read_blast_csv,
+                          'exonerate_output': read_exonerate}[annotation_format]
+                self.annotations = reader(annotations, **annotation_options)
                 self.annotations.genome = self
         else:
             self.annotations = annotations
+        if cache:
+            try:
+                self.save_cache(cache, cache_key)
+            except (IOError, OSError, ValueError) as save_error:
+                #e.g. a read-only reference directory, or attributes that can't be stored; the genome is still usable,
+                #just not cached
+                sys.stderr.write("couldn't save genome cache " + cache + ": " + str(save_error) + "\n")
+    
+    def save_cache(self, cache_location, cache_key = ""):
+        """saves genome sequence and annotations to a binary (numpy .npz) cache file, which can be read by read_genome_cache
+        much faster than the original fasta and annotation files. Sequences are stored as arrays of bytes (or of 2-bit codes
+        for PackedSequences); sequences read from an indexed fasta are not stored. Annotations are stored as a columnar table
+        (see get_annotation_table), which keeps every attribute of a feature but not the order they are in, so writers such
+        as write_gff may output a feature's attributes in another order once it is read back. cache_key is stored to later
+        check that the cache is up to date (see get_cache_key)."""
+        cache = {'cache_key': numpy.frombuffer(cache_key, dtype = numpy.uint8)}
+        seqids = []
+        seq_fields_list = []
+        if self.genome_sequence != None and not 'fasta_map' in self.genome_sequence.__dict__:
+            #seqids are saved in the order they were read, followed by any added since
+            seqid_order = [seqid for seqid in self.genome_sequence.__dict__.get('seqid_order', []) if seqid in self.genome_sequence]
+            read_seqids = set(seqid_order)
+            seqid_order = seqid_order + [seqid for seqid in self.genome_sequence if not seqid in read_seqids]
+            for seqid in seqid_order:
+                seq = self.genome_sequence[seqid]
+                if isinstance(seq, PackedSequence):
+                    seq_fields_list.append(dict([(field, numpy.atleast_1d(value)) for field, value in seq.__dict__.items()]))
+                else:
+                    seq_fields_list.append({'bases': numpy.frombuffer(str(seq), dtype = numpy.uint8)})
+                seqids.append(seqid)
+        #each field (e.g. "bases" for plain sequences, "packed" for PackedSequences) is saved as all sequences' arrays
+        #   concatenated together along with the offset of each sequence's array
+        fields = sorted(set([field for seq_fields in seq_fields_list for field in seq_fields]))
+        cache['sequence_count'] = numpy.array([len(seqids)])
+        cache['sequence_names'] = pack_strings(seqids)
+        cache['sequence_is_packed'] = numpy.array(['packed' in seq_fields for seq_fields in seq_fields_list], dtype = bool)
+        cache['sequence_fields'] = pack_strings(fields)
+        cache['sequence_field_count'] = numpy.array([len(fields)])
+        for field in fields:
+            field_arrays = [seq_fields.get(field, numpy.zeros(0, dtype = numpy.uint8)) for seq_fields in seq_fields_list]
+            cache['sequence_' + field] = numpy.concatenate(field_arrays)
+            cache['sequence_' + field + '_offsets'] = numpy.cumsum([0] + [len(array) for array in field_arrays])
+        if self.annotations != None:
+            cache.update(get_annotation_table(self.annotations))
+        #writes to a temporary file first so that an interrupted save can't leave a broken cache behind
+        temp_location = cache_location + '.tmp' + str(os.getpid())
+        try:
+            temp_file = open(temp_location, 'wb')
+            numpy.savez(temp_file, **cache)
+            temp_file.close()
+            os.rename(temp_location, cache_location)
+        except (IOError, OSError):
+            if os.path.exists(temp_location):
+                os.remove(temp_location)
+            raise
     
     def get_scaffold_fasta(self, seqid):
         return '>' + seqid + '\n' + self.genome_sequence[seqid]
@@ -917,21 +2485,47 @@ class Genome():
             fasta_list.append('>' + fasta_header + '\n' + self.genome_sequence[seqid])
         return "\n".join(fasta_list)
     
-    def write_apollo_gff(self, seqid, suppress_fasta = False):
+    def write_apollo_gff(self, seqid, suppress_fasta = False, out_file = None):
+        """returns Apollo gff (see write_longform_gff) of the features on seqid followed by its fasta. If out_file (an open
+        file) is given, it is written there a line at a time instead of returned, with each gff line ending in a newline"""
         if self.genome_sequence != None and self.annotations != None:
-            try:
+            if out_file == None:
                 apollo_gff = write_longform_gff(self.annotations.get_seqid(seqid))
                 if not suppress_fasta:
                     apollo_gff = apollo_gff + '\n' + self.get_scaffold_fasta(seqid)
                 return apollo_gff
-            except:
+            else:
+                write_longform_gff(self.annotations.get_seqid(seqid), out_file = out_file)
                 if not suppress_fasta:
-                    return self.get_scaffold_fasta(seqid)
-                else:
-                    return ""
+                    out_file.write(self.get_scaffold_fasta(seqid))
         else:
             print "genome object is either missing genome_sequence or annotations"
     
+    def write_apollo_gffs(self, seqid_files, suppress_fasta = False, header_lines = {}, workers = 1):
+        """writes the Apollo gff (see write_apollo_gff) of each seqid in seqid_files, a list of (seqid, file location)
+        tuples, to its file, preceded by the lines in header_lines[seqid] if any. If workers > 1, the files are written
+        by a pool of worker processes. Each worker is sent only a seqid and file location, and reads the scaffold and its
+        features from the copy of this Genome it inherits when forked, so the Genome is never pickled and each file is
+        the same as if it had been written here. Where processes can't be forked, the files are written one at a time"""
+        global apollo_export_genome
+        apollo_export_genome = self
+        tasks = [(seqid, out_location, header_lines.get(seqid, []), suppress_fasta) for seqid, out_location in seqid_files]
+        try:
+            if workers > 1 and len(tasks) > 1 and hasattr(os, 'fork'):
+                pool = multiprocessing.Pool(min(workers, len(tasks)))
+                try:
+                    for seqid in pool.imap_unordered(write_apollo_gff_file, tasks):
+                        pass
+                    pool.close()
+                    pool.join()
+                finally:
+                    pool.terminate()
+            else:
+                for task in tasks:
+                    write_apollo_gff_file(task)
+        finally:
+            apollo_export_genome = None
+    
     def get_seqids(self, from_annotations = False):
         seqid_list = []
         warning = False
@@ -947,18 +2541,20 @@ class Genome():
             print "warning, some annotations possessed seqids not found in sequence dictionary"
         return seqid_list
     
-    def read_exonerate(self, exonerate_output):
+    def read_exonerate(self, exonerate_output, workers = 1):
         if self.annotations != None:
-            self.annotations.read_exonerate(exonerate_output)
+            self.annotations.read_exonerate(exonerate_output, workers = workers)
         else:
-            self.annotations = read_exonerate(exonerate_output)
+            self.annotations = read_exonerate(exonerate_output, workers = workers)
             self.annotations.genome = self
     
-    def read_blast_csv(self, blast_csv, hierarchy = ['match','match_part'], source = 'blast', find_truncated_locname = False):
+    def read_blast_csv(self, blast_csv, hierarchy = ['match','match_part'], source = 'blast', find_truncated_locname = False, **chain_options):
+        """see read_blast_csv (chain_options are chain_hits, max_intron and tandem_array_safe)"""
         if self.annotations == None:
             self.annotations = AnnotationSet()
             self.annotations.genome = self
-        self.annotations.read_blast_csv(blast_csv, hierarchy = hierarchy, source = source, find_truncated_locname = find_truncated_locname)
+        self.annotations.read_blast_csv(blast_csv, hierarchy = hierarchy, source = source, find_truncated_locname = find_truncated_locname,
+                                        **chain_options)
     
     def read_cegma_gff(self, cegma_gff):
         if self.annotations != None:
@@ -978,60 +2574,411 @@ class Genome():
         self.variants = read_vcf(vcf)
     
 
+def new_position_array(length, dtype, scratch_dir = None):
+    """returns numpy array of length zeros of dtype, or, if scratch_dir is given, a numpy.memmap of a temporary file in
+    scratch_dir (which is deleted once the array is no longer used), so that the array is kept on disk rather than in memory"""
+    if scratch_dir == None or length == 0:
+        return numpy.zeros(length, dtype = dtype)
+    return numpy.memmap(tempfile.TemporaryFile(dir = scratch_dir), dtype = dtype, mode = 'w+', shape = (length,))
+
+
+class PackedPositions(object):
+    """bool positions of a single seqid packed into 8 positions per byte (as numpy.packbits does) in a numpy array, or a
+    memory-mapped file in scratch_dir (see new_position_array). Slicing (or indexing) unpacks just the requested positions
+    into a bool numpy array, and assigning to a slice packs just the bytes it covers, so positions can be read and changed a
+    chunk at a time without unpacking the whole seqid."""
+    dtype = numpy.dtype(bool)
+    
+    def __init__(self, length, scratch_dir = None):
+        self.length = length
+        self.packed = new_position_array((length + 7) / 8, numpy.uint8, scratch_dir)
+    
+    def __len__(self):
+        return self.length
+    
+    def unpack(self, start, stop):
+        """returns positions from start to stop (0-based, end-exclusive) as a bool numpy array"""
+        if start >= stop:
+            return numpy.zeros(0, dtype = bool)
+        bits = numpy.unpackbits(self.packed[start / 8:(stop + 7) / 8])
+        return bits[start % 8:start % 8 + stop - start].view(bool)
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return self.unpack(0, self.length)[key]
+            return self.unpack(start, stop)
+        else:
+            if key < 0:
+                key = key + self.length
+            if not 0 <= key < self.length:
+                raise IndexError('position index out of range')
+            return self.unpack(key, key + 1)[0]
+    
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                start, stop = 0, self.length
+                positions = self.unpack(0, self.length)
+                positions[key] = value
+                value = positions
+            elif start >= stop:
+                return
+        else:
+            if key < 0:
+                key = key + self.length
+            if not 0 <= key < self.length:
+                raise IndexError('position index out of range')
+            start, stop = key, key + 1
+        #the whole bytes covering start to stop are unpacked, changed and packed again
+        first_byte = start / 8
+        last_byte = (stop + 7) / 8
+        positions = self.unpack(first_byte * 8, min(last_byte * 8, self.length))
+        positions[start - first_byte * 8:stop - first_byte * 8] = value
+        self.packed[first_byte:last_byte] = numpy.packbits(positions)
+    
+    def __array__(self, dtype = None):
+        if dtype == None:
+            return self.unpack(0, self.length)
+        return self.unpack(0, self.length).astype(dtype)
+
+
+def get_sum_dtype(dtype):
+    """returns the dtype that sums of an array of dtype are taken in. Floats are summed in float64 (or complex128), so that
+    long cumulative sums of float32 values keep their precision"""
+    if numpy.dtype(dtype).kind == 'f':
+        return numpy.dtype(numpy.float64)
+    elif numpy.dtype(dtype).kind == 'c':
+        return numpy.dtype(numpy.complex128)
+    return numpy.dtype(numpy.int64)
+
+def get_array_window_values(positions, window_size, window_jump = 1, operation = "sum", prefix_sums = None):
+    """returns the values of operation over windows of a numpy array of positions (see position_dic.get_window_values).
+    If prefix_sums of positions are given (see position_dic.get_prefix_sums) sums and averages are taken from them"""
+    window_count = max((len(positions) - window_size) / window_jump, 0)
+    windows = numpy.lib.stride_tricks.as_strided(positions, shape = (window_count, window_size),
+                                                 strides = (positions.strides[0] * window_jump, positions.strides[0]))
+    if operation in ["sum", "average"]:
+        if prefix_sums is None and window_jump >= window_size:
+            #windows that don't overlap cover each position at most once, so are quicker to sum directly
+            values = windows.sum(1, dtype = get_sum_dtype(positions.dtype))
+        else:
+            if prefix_sums is None:
+                prefix_sums = numpy.zeros(len(positions) + 1, dtype = get_sum_dtype(positions.dtype))
+                numpy.cumsum(positions, out = prefix_sums[1:])
+            values = prefix_sums[window_size::window_jump][:window_count] - prefix_sums[::window_jump][:window_count]
+        if operation == "average":
+            values = values * 1.0 / window_size
+        return values
+    elif operation in ["max", "min"]:
+        if window_count == 0:
+            return numpy.zeros(0, dtype = positions.dtype)
+        elif operation == "max":
+            return windows.max(1)
+        else:
+            return windows.min(1)
+    elif operation == "set":
+        seqid_values = numpy.unique(positions)
+        if len(seqid_values) > 62:
+            return [set(window) for window in windows]
+        #each window is given a code with a bit for each value in the seqid, set if the value is in the window, and
+        #windows with the same code are given copies of the same set
+        window_codes = numpy.zeros(window_count, dtype = numpy.int64)
+        for value_index in range(len(seqid_values)):
+            value_counts = numpy.zeros(len(positions) + 1, dtype = numpy.int64)
+            numpy.cumsum(positions == seqid_values[value_index], out = value_counts[1:])
+            value_present = (value_counts[window_size::window_jump][:window_count] - value_counts[::window_jump][:window_count]) > 0
+            window_codes = window_codes | (value_present.astype(numpy.int64) << value_index)
+        code_sets = {}
+        for code in numpy.unique(window_codes).tolist():
+            code_sets[code] = set([seqid_values[value_index] for value_index in range(len(seqid_values)) if code >> value_index & 1])
+        return [set(code_sets[code]) for code in window_codes.tolist()]
+
+
 class position_dic(dict):
-    def __init__(self, genome_sequence, dtype=bool):
+    """dictionary of seqid to a numpy array with a value for each position of the seqid (e.g. a mask of CDS positions).
+    Cumulative sums of the arrays, used to count or sum over ranges, are made as they are needed. They are only cached
+    (in prefix_sums) when asked for with get_prefix_sums(cache = True), and positions changed directly after that need
+    clear_prefix_sums (see get_prefix_sums).
+    
+    If scratch_dir is given, each array is a numpy.memmap of a temporary file in scratch_dir rather than being held in
+    memory, and if pack_bits is True bool positions are packed 8 to a byte (see PackedPositions). Either way, methods of
+    position_dic read and change positions chunk_size positions at a time, so that tracks of large genomes can be built and
+    counted without ever holding a whole seqid in memory."""
+    at_bases = numpy.zeros(256, dtype = bool)
+    at_bases[numpy.frombuffer('ATat', dtype = numpy.uint8)] = True
+    
+    def __init__(self, genome_sequence, dtype=bool, scratch_dir = None, pack_bits = False, chunk_size = 2**24):
+        self.prefix_sums = {}
+        self.scratch_dir = scratch_dir
+        self.chunked = scratch_dir != None or pack_bits
+        self.chunk_size = chunk_size
         for seqid in genome_sequence:
-            self[seqid] = numpy.zeros(len(genome_sequence[seqid]),dtype=dtype)
+            if pack_bits and numpy.dtype(dtype) == bool:
+                self[seqid] = PackedPositions(len(genome_sequence[seqid]), scratch_dir)
+            else:
+                self[seqid] = new_position_array(len(genome_sequence[seqid]), dtype, scratch_dir)
+    
+    def __setitem__(self, seqid, positions):
+        dict.__setitem__(self, seqid, positions)
+        self.clear_prefix_sums(seqid)
+    
+    def get_chunk_bounds(self, seqid):
+        """returns list of (start, stop) (0-based, end-exclusive) of the chunks of seqid that methods of position_dic work
+        through in turn. Unless positions are memory-mapped or packed, the whole seqid is one chunk"""
+        seqid_length = len(self[seqid])
+        if self.chunked:
+            chunk_size = self.chunk_size
+        else:
+            chunk_size = max(seqid_length, 1)
+        return [(start, min(start + chunk_size, seqid_length)) for start in range(0, seqid_length, chunk_size)]
+    
+    def get_chunk_values(self, seqid, start, stop, kind = "sum"):
+        """returns numpy array of the values of seqid from start to stop ("sum"), or of whether they are 0 ("zeros") or 1
+        ("ones")"""
+        positions = self[seqid][start:stop]
+        if kind == "sum":
+            return positions
+        elif kind == "zeros":
+            return positions == 0
+        elif kind == "ones":
+            return positions == 1
+    
+    def get_prefix_sum_dtype(self, seqid, kind = "sum"):
+        if kind == "sum":
+            return get_sum_dtype(self[seqid].dtype)
+        return numpy.dtype(numpy.int64)
+    
+    def clear_prefix_sums(self, seqid = None):
+        """clears the cached prefix sums of seqid, or of all seqids. Methods of position_dic that change positions call
+        this themselves, but once prefix sums have been cached it must be called after positions are changed directly"""
+        for key in self.prefix_sums.keys():
+            if seqid == None or key[0] == seqid:
+                del self.prefix_sums[key]
+    
+    def get_prefix_sums(self, seqid, kind = "sum", cache = False):
+        """returns array of the cumulative sums (starting with 0) of the values of seqid ("sum"), or of its positions
+        that are 0 ("zeros") or 1 ("ones"), so that the total over positions start to end (1-based and inclusive) is
+        prefix_sums[end] - prefix_sums[start - 1]. Sums of float values are float64 (see get_sum_dtype). A cached array
+        is returned if there is one, otherwise the array is made, and cached if cache is True. Cached arrays are used by
+        the counting and window methods until clear_prefix_sums is called. The array is kept in scratch_dir if there is
+        one"""
+        if kind == "ones" and self[seqid].dtype == bool:
+            kind = "sum"
+        key = (seqid, kind)
+        if not key in self.prefix_sums:
+            prefix_sums = new_position_array(len(self[seqid]) + 1, self.get_prefix_sum_dtype(seqid, kind), self.scratch_dir)
+            for start, stop in self.get_chunk_bounds(seqid):
+                chunk_sums = prefix_sums[start + 1:stop + 1]
+                numpy.cumsum(self.get_chunk_values(seqid, start, stop, kind), out = chunk_sums)
+                if start > 0:
+                    chunk_sums += prefix_sums[start]
+            if not cache:
+                return prefix_sums
+            self.prefix_sums[key] = prefix_sums
+        return self.prefix_sums[key]
+    
+    def get_prefix_sums_at(self, seqid, points, kind = "sum"):
+        """returns array of the prefix sums of seqid (see get_prefix_sums) at each of points. If positions are memory-mapped
+        or packed, and the prefix sums aren't already cached, they are found a chunk at a time for just the points in
+        each chunk, without making the whole array of prefix sums"""
+        if kind == "ones" and self[seqid].dtype == bool:
+            kind = "sum"
+        points = numpy.asarray(points, dtype = numpy.int64)
+        if not self.chunked or (seqid, kind) in self.prefix_sums:
+            return self.get_prefix_sums(seqid, kind)[points]
+        order = numpy.argsort(points, kind = 'mergesort')
+        sorted_points = points[order]
+        point_sums = numpy.zeros(len(points), dtype = self.get_prefix_sum_dtype(seqid, kind))
+        chunk_start_sum = 0
+        for start, stop in self.get_chunk_bounds(seqid):
+            chunk_sums = numpy.cumsum(self.get_chunk_values(seqid, start, stop, kind), dtype = point_sums.dtype)
+            first_point = numpy.searchsorted(sorted_points, start + 1)
+            last_point = numpy.searchsorted(sorted_points, stop, side = 'right')
+            point_sums[order[first_point:last_point]] = chunk_sums[sorted_points[first_point:last_point] - start - 1] + chunk_start_sum
+            chunk_start_sum = chunk_start_sum + chunk_sums[-1]
+        return point_sums
+    
+    def get_range_totals(self, seqids, starts, ends, kind = "sum"):
+        """takes lists of seqids, and starts and ends (1-based and inclusive), of ranges and returns array of the total of
+        kind (see get_prefix_sums) over each range, found in batch from the prefix sums of each seqid. Ranges are cut
+        off at the end of their seqid"""
+        seqids = numpy.asarray(seqids)
+        starts = numpy.asarray(starts, dtype = numpy.int64)
+        ends = numpy.asarray(ends, dtype = numpy.int64)
+        totals = None
+        #the rows of each seqid are grouped by one sort rather than a scan of every row per seqid
+        unique_seqids, seqid_codes = numpy.unique(seqids, return_inverse = True)
+        grouped_rows = numpy.argsort(seqid_codes, kind = 'mergesort')
+        bounds = numpy.searchsorted(seqid_codes[grouped_rows], numpy.arange(len(unique_seqids) + 1))
+        for seqid_code, seqid in enumerate(unique_seqids.tolist()):
+            rows = grouped_rows[bounds[seqid_code]:bounds[seqid_code + 1]]
+            seqid_ends = numpy.minimum(ends[rows], len(self[seqid]))
+            seqid_starts = numpy.minimum(numpy.maximum(starts[rows], 1), seqid_ends + 1)
+            point_sums = self.get_prefix_sums_at(seqid, numpy.concatenate([seqid_ends, seqid_starts - 1]), kind)
+            if totals is None:
+                totals = numpy.zeros(len(seqids), dtype = point_sums.dtype)
+            totals[rows] = point_sums[:len(rows)] - point_sums[len(rows):]
+        if totals is None:
+            totals = numpy.zeros(len(seqids), dtype = numpy.int64)
+        return totals
 
-    def fill_from_annotations(self, annotation_set, feature, fill_type = "coords",fill_with = "1"):
-        """accepts "start" and "coords" for fill_type"""
-        for annotation in eval("annotation_set." + feature):
-            annotation_obj = eval("annotation_set." + feature)[annotation]
+    def fill_from_annotations(self, annotation_set, feature, fill_type = "coords",fill_with = 1):
+        """accepts "start", "coords" and "count" for fill_type. "coords" sets every position of each feature of type feature
+        to fill_with and "start" sets only its first position. "count" adds the number of features covering each position
+        (their overlap depth), so is best used with an int dtype. fill_with is a value, or a string (as it was in earlier
+        versions) evaluated once for each feature, in which the names it could use before (self, annotation_set, feature,
+        fill_type, fill_with, annotation, annotation_obj, seqid, coords, parent and ID) may be used. Strings that use
+        position are evaluated for each position of each feature, as they always were."""
+        features = annotation_set.__dict__[feature]
+        self.clear_prefix_sums()
+        if fill_type == "count":
+            #features are counted by adding 1 where each starts and taking 1 away after each ends, so that the running sum
+            #of changes is the number of features at each position. The sum is carried on from one chunk to the next
+            seqid_coords = {}
+            for annotation in features:
+                annotation_obj = features[annotation]
+                seqid_coords.setdefault(annotation_obj.seqid, []).append(annotation_obj.get_coords())
+            for seqid in seqid_coords:
+                coords_array = numpy.array(seqid_coords[seqid]).reshape(-1, 2)
+                seqid_length = len(self[seqid])
+                change_positions = numpy.concatenate([numpy.minimum(coords_array[:,0] - 1, seqid_length),
+                                                      numpy.minimum(coords_array[:,1], seqid_length)])
+                changes = numpy.ones(len(change_positions), dtype = numpy.int32)
+                changes[len(coords_array):] = -1
+                order = numpy.argsort(change_positions, kind = 'mergesort')
+                change_positions = change_positions[order]
+                changes = changes[order]
+                chunk_start_depth = 0
+                for start, stop in self.get_chunk_bounds(seqid):
+                    first_change = numpy.searchsorted(change_positions, start)
+                    last_change = numpy.searchsorted(change_positions, stop)
+                    depth = numpy.zeros(stop - start, dtype = numpy.int32)
+                    numpy.add.at(depth, change_positions[first_change:last_change] - start, changes[first_change:last_change])
+                    depth[0] += chunk_start_depth
+                    depth = numpy.cumsum(depth, out = depth)
+                    chunk_start_depth = depth[-1]
+                    if self[seqid].dtype == bool:
+                        self[seqid][start:stop] |= depth > 0
+                    else:
+                        self[seqid][start:stop] += depth.astype(self[seqid].dtype, copy = False)
+            return
+        if type(fill_with) == str:
+            fill_code = compile(fill_with, '<fill_with>', 'eval')
+            uses_position = 'position' in fill_code.co_names
+        for annotation in features:
+            annotation_obj = features[annotation]
             seqid = annotation_obj.seqid
             coords = annotation_obj.get_coords()
-            try:
-                parent = annotation_obj.parent
-            except:
-                pass
-            ID = annotation_obj.ID
+            if type(fill_with) == str:
+                names = {'self': self, 'annotation_set': annotation_set, 'feature': feature, 'fill_type': fill_type,
+                         'fill_with': fill_with, 'annotation': annotation, 'annotation_obj': annotation_obj, 'seqid': seqid,
+                         'coords': coords, 'parent': getattr(annotation_obj, 'parent', None), 'ID': annotation_obj.ID}
+                if uses_position:
+                    if fill_type == "coords":
+                        positions = range(coords[0] - 1, coords[1])
+                    else:
+                        positions = [coords[0] - 1]
+                    for position in positions:
+                        names['position'] = position
+                        self[seqid][position] = eval(fill_code, globals(), names)
+                    continue
+                value = eval(fill_code, globals(), names)
+            else:
+                value = fill_with
             if fill_type == "coords":
-                for position in range(coords[0] - 1,coords[1]):
-                    self[seqid][position] = eval(fill_with)
+                self[seqid][coords[0] - 1:coords[1]] = value
             elif fill_type == "start":
-                self[seqid][coords[0] - 1] = eval(fill_with)
+                self[seqid][coords[0] - 1] = value
     
-    def count_from_annotations(self, annotation_set, feature):
-        count_list = []
-        for annotation in eval("annotation_set." + feature):
-            annotation_obj = eval("annotation_set." + feature)[annotation]
-            seqid = annotation_obj.seqid
+    def count_from_annotations(self, annotation_set, feature, output = "list"):
+        """counts the positions of each feature of type feature that are 0 and that are 1, using prefix sums (see
+        get_range_totals). output may be "list" (of [ID, count0, count1] lists), "array" (a numpy structured array with
+        fields ID, seqid, start, end, count0, count1, sum and mean, where sum and mean are of the feature's values) or an
+        open file, to which the array is written as tab separated lines after a header line"""
+        features = annotation_set.__dict__[feature]
+        IDs = []
+        seqids = []
+        starts = []
+        ends = []
+        for annotation in features:
+            annotation_obj = features[annotation]
             coords = annotation_obj.get_coords()
-            featureID = annotation_obj.ID
-            try:
-                parent = annotation_obj.parent
-            except:
-                pass
-            ID = annotation_obj.ID
-            count0 = 0
-            count1 = 0
-            for position in range(coords[0] - 1,coords[1]):
-                if self[seqid][position] == 0:
-                    count0 = count0 + 1
-                elif self[seqid][position] == 1:
-                    count1 = count1 + 1
-            count_list.append([featureID,count0,count1])
-        return count_list
+            IDs.append(annotation_obj.ID)
+            seqids.append(annotation_obj.seqid)
+            starts.append(coords[0])
+            ends.append(coords[1])
+        count1 = self.get_range_totals(seqids, starts, ends, "ones")
+        if len(self) > 0 and self.values()[0].dtype == bool:
+            lengths = numpy.minimum(ends, [len(self[seqid]) for seqid in seqids]) - numpy.array(starts) + 1
+            count0 = numpy.maximum(lengths, 0) - count1
+        else:
+            count0 = self.get_range_totals(seqids, starts, ends, "zeros")
+        if output == "list":
+            return [[IDs[index], int(count0[index]), int(count1[index])] for index in range(len(IDs))]
+        sums = self.get_range_totals(seqids, starts, ends, "sum")
+        count_array = numpy.zeros(len(IDs), dtype = [('ID', 'S' + str(max([1] + map(len, IDs)))),
+                                                     ('seqid', 'S' + str(max([1] + map(len, seqids)))),
+                                                     ('start', numpy.int64), ('end', numpy.int64), ('count0', numpy.int64),
+                                                     ('count1', numpy.int64), ('sum', sums.dtype), ('mean', numpy.float64)])
+        count_array['ID'] = IDs
+        count_array['seqid'] = seqids
+        count_array['start'] = starts
+        count_array['end'] = ends
+        count_array['count0'] = count0
+        count_array['count1'] = count1
+        count_array['sum'] = sums
+        count_array['mean'] = sums * 1.0 / numpy.maximum(count_array['end'] - count_array['start'] + 1, 1)
+        if output == "array":
+            return count_array
+        elif type(output) == file:
+            output.write('\t'.join(count_array.dtype.names) + '\n')
+            for row in count_array.tolist():
+                output.write('\t'.join(map(str, row)) + '\n')
     
 
     def at_content(self, genome_sequence):
+        """sets positions that are A or T in genome_sequence to 1"""
         for seqid in self:
-            for position in range(len(self[seqid])):
-                if genome_sequence[seqid][position] in "ATat":
-                    self[seqid][position] = 1
+            for start, stop in self.get_chunk_bounds(seqid):
+                at_positions = self.at_bases[numpy.frombuffer(genome_sequence[seqid][start:stop], dtype = numpy.uint8)]
+                positions = self[seqid][start:stop]
+                positions[at_positions] = 1
+                self[seqid][start:stop] = positions
+        self.clear_prefix_sums()
 
+    def get_window_values(self, seqid, window_size, window_jump = 1, operation = "sum"):
+        """returns the values of operation ("sum", "average", "max", "min" or "set") over windows of window_size positions
+        of seqid starting every window_jump positions (not including a window at the very end), as a numpy array, or a
+        list of sets for "set". Sums and averages are taken from the differences of cumulative sums, so take time in
+        proportion to the length of seqid whatever the window size (windows that don't overlap are summed directly,
+        unless the cumulative sums are already cached). Maxima and minima are taken from a strided view of the windows,
+        and sets from the cumulative counts of each value (or from each window of the strided view, for seqids with
+        more than 62 different values). If positions are memory-mapped or packed, windows are found for about
+        chunk_size positions at a time."""
+        positions = self[seqid]
+        if not self.chunked:
+            return get_array_window_values(positions, window_size, window_jump, operation, self.prefix_sums.get((seqid, "sum")))
+        window_count = max((len(positions) - window_size) / window_jump, 0)
+        block_window_count = max(self.chunk_size / window_jump, 1)
+        block_values = []
+        for first_window in range(0, window_count, block_window_count) or [0]:
+            last_window = min(first_window + block_window_count, window_count)
+            block_positions = numpy.asarray(positions[first_window * window_jump:last_window * window_jump + window_size])
+            block_values.append(get_array_window_values(block_positions, window_size, window_jump, operation))
+        if operation == "set":
+            return [window_set for values in block_values for window_set in values]
+        return numpy.concatenate(block_values)
+    
     def sliding_window_calculate(self, window_size, window_jump = 1, operation = "sum", output = "dict",
                                  threshold = 1, seqs_to_exclude = []):
-        """operation may be "sum", "average", or "set". Output may be "dict","coords", or "annotation_set"."""
+        """operation may be "sum", "average", "max", "min" or "set" (see get_window_values). Output may be "dict" (of seqid
+        to array of window values, or list of sets for "set"), "coords" (list of [seqid, start, end] of the windows with
+        values from threshold[0] to threshold[1], or at least threshold if it is one number), "annotation_set" (of regions
+        covered by windows with values of at least threshold) or an open file (to which seqid and value of each window are
+        written)."""
         if output == "dict":
             new_dic = {}
         elif output == "annotation_set":
@@ -1039,53 +2986,44 @@ class position_dic(dict):
             annotation_set.region = {}
         elif output == "coords":
             coords_list = []
+            if type(threshold) in [list, tuple]:
+                threshold_range = threshold
+            else:
+                threshold_range = (threshold, numpy.inf)
         for seqid in self:
             if len(self[seqid]) > window_size and not seqid in seqs_to_exclude:
+                values = self.get_window_values(seqid, window_size, window_jump, operation)
+                window_starts = numpy.arange(len(values)) * window_jump
                 if output == "dict":
-                    new_dic[seqid] = []
-                window_in = False
-                coords_list = []
-                for position in range(len(self[seqid][:-1 * window_size]) / window_jump):
-                    window_start = position * window_jump
-                    if operation == "set":
-                        new_dic[seqid].append(set(self[seqid][window_start:window_start + window_size]))
-                        continue
-                    window_sum = numpy.sum(self[seqid][window_start:window_start + window_size])
-                    if operation == "sum":
-                        value = window_sum
-                    elif operation == "average":
-                        value = window_sum * 1.0 / window_size
-                    if output == "dict":
-                        new_dic[seqid].append(value)
-                    elif output == 'annotation_set':
-                        if value >= threshold:
-                            if window_in == False:
-                                window_in = True
-                                if len(coords_list) == 0:
-                                    coords_list.append([1 + window_start])
-                                elif position > coords_list[-1][1]:
-                                    coords_list.append([1 + window_start])
-                        else:
-                            if window_in == True:
-                                window_in = False
-                                if len(coords_list[-1]) == 1:
-                                    coords_list[-1].append(window_start + window_size)
-                                else:
-                                    coords_list[-1][1] = window_start + window_size
-                    elif output == "coords":
-                        if threshold[0] <= value <= thredshold[1]:
-                            coords_list.append([seqid, 1 + window_start, window_start + window_size])
-                    elif type(output) == file:
-                        output.write(seqid + '\t' + str(value) + '\n')
-                    if window_start % 10000000 == 0 and verbose:
-                        print "processed " + seqid + " to position " + str(position)
-                if output == "annotation_set":
-                    if len(coords_list) > 0:
-                        if len(coords_list[-1]) == 1:
-                            coords_list[-1].append(len(self[seqid]))
-                        for coords in coords_list:
+                    new_dic[seqid] = values
+                elif output == 'annotation_set':
+                    #finds runs of windows with values of at least threshold. A run that starts at a window whose index is
+                    #no more than the end of the previous region extends that region
+                    above_threshold = numpy.concatenate([[False], numpy.asarray(values) >= threshold, [False]]).astype(numpy.int8)
+                    changes = numpy.diff(above_threshold)
+                    run_starts = numpy.nonzero(changes == 1)[0].tolist()
+                    run_ends = numpy.nonzero(changes == -1)[0].tolist()
+                    region_coords = []
+                    for run_start, run_end in zip(run_starts, run_ends):
+                        if len(region_coords) == 0 or run_start > region_coords[-1][1]:
+                            region_coords.append([1 + run_start * window_jump])
+                        if run_end < len(values):
+                            if len(region_coords[-1]) == 1:
+                                region_coords[-1].append(run_end * window_jump + window_size)
+                            else:
+                                region_coords[-1][1] = run_end * window_jump + window_size
+                    if len(region_coords) > 0:
+                        if len(region_coords[-1]) == 1:
+                            region_coords[-1].append(len(self[seqid]))
+                        for coords in region_coords:
                             ID = seqid + "-window" + str(coords[0])
                             annotation_set.region[ID] = BaseAnnotation(ID, seqid, tuple(coords), "region", annotation_set = annotation_set)
+                elif output == "coords":
+                    in_range = numpy.nonzero((threshold_range[0] <= values) & (values <= threshold_range[1]))[0]
+                    coords_list.extend([[seqid, 1 + window_start, window_start + window_size]
+                                        for window_start in window_starts[in_range].tolist()])
+                elif type(output) == file:
+                    output.writelines([seqid + '\t' + str(value) + '\n' for value in values])
                 if verbose:
                     print "processed " + seqid
                     if output == 'annotation_set':
@@ -1095,7 +3033,8 @@ class position_dic(dict):
         if output == "dict":
             return new_dic
         elif output == "annotation_set":
-            return copy.deepcopy(annotation_set)
+            annotation_set.compact()
+            return annotation_set
         elif output == "coords":
             return coords_list
 
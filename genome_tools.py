@@ -18,6 +18,8 @@ try:
 except:
     print "it appears that genome_tools.py is not in the same directory as genome.py and genome_tools_config.py"
 import sys
+import os
+import glob
 import subprocess
 import numpy
 
@@ -142,49 +144,51 @@ def genewise_wrapper(query_file,genome_file,hmm = False):
     subprocess.call('rm -r temp', shell = True)
 
 
-def dna2orfs(fasta_location,output_file,from_atg = False,longest = False):
-    """takes a dna sequence in fasta format and returns ORFs found therein"""
+def dna2orfs(fasta_location,output_file,from_atg = "False",longest = "False", min_length = "1", output_format = "fasta"):
+    """takes a dna sequence in fasta format and writes the ORFs found therein (see genome.find_orfs) to output_file, as
+    gff (output_format = "gff") or as fasta named seqid-pos:start-end followed by the strand (e.g. >scaffold1-pos:301-1203+,
+    1-based coords including the stop codon), or seqid_longestORF for the longest ORFs"""
+    options = {}
+    for option_name, option in [('from_atg', from_atg), ('longest', longest)]:
+        if option in ["True","T","true","t","TRUE"]:
+            options[option_name] = True
+        elif option in ["False","F","false","f","FALSE"]:
+            options[option_name] = False
+        else:
+            print "Invalid option for '" + option_name + "', argument accepts 'True' or 'False'"
+            return None
+    try:
+        min_length = int(min_length)
+    except ValueError:
+        print "Invalid option for 'min_length', argument accepts a whole number"
+        return None
     dna = genome.Genome(fasta_location)
     out = open(output_file, 'w')
-    if longest:
-        orf_list = []
-    for seq in dna.genome_sequence:
-        if longest:
-            candidate_list = []
-            longest_orf_len = 0
-        for frame in [0,1,2]:
-            for strand in ['-','+']:
-                translated_seq_list = dna.genome_sequence[seq].translate(frame=frame,strand=strand).split('*')
-                if strand == '+':
-                    length_list = [frame] #populates with lengths of orfs so that I can trace back orf positions
-                else:
-                    length_list = [len(dna.genome_sequence[seq]) - frame]
-                for orf in translated_seq_list:
-                    orf_start = sum(length_list)
-                    length_list.append((1 + len(orf)) * 3)
-                    if from_atg:
-                        try:
-                            output_orf = 'M' + ''.join(orf.split('M')[1:])
-                        except IndexError:
-                            continue
-                    else:
-                        output_orf = orf
-                    if longest:
-                        if len(output_orf) > longest_orf_len:
-                            candidate_list.append('>'+seq+'_longestORF\n'+output_orf+'\n')
-                            longest_orf_len = len(output_orf)
-                    else:
-                        out.write('>'+seq+'-pos:'+str(orf_start)+'\n'+output_orf+'\n')
-        if longest:
-            out.write(candidate_list[-1])
+    if output_format == "gff":
+        orf_annotations = genome.find_orfs(dna.genome_sequence, min_length, options['longest'], options['from_atg'],
+                                           output = "annotation_set")
+        genome.write_gff(orf_annotations, out_file = out)
+    else:
+        for seqid, start, end, strand, frame, peptide in genome.find_orfs(dna.genome_sequence, min_length, options['longest'],
+                                                                          options['from_atg']):
+            if options['longest']:
+                out.write('>' + seqid + '_longestORF\n' + peptide + '\n')
+            else:
+                out.write('>' + seqid + '-pos:' + str(start) + '-' + str(end) + strand + '\n' + peptide + '\n')
     out.close()
 
 
 def prep4apollo(genome_sequence, suppress_fasta = "False", output_directory = 'apollo_gffs', exon_fasta = None, full_length_seqs = None,
                                exon_blast_csv = None, exonerate_output = None, starjuncs = None, other_gff = None, other_gff_format = 'gff3',
                                blast_evalue = '0.01', exonerate_percent = '50',output_empty_scaffolds = "False",
-                               exonerate_intron_steps = "2000,5000,200000", mapping_threads = "1"):
-    """takes evidence inputs and returns gff files to open in apollo"""
+                               exonerate_intron_steps = "2000,5000,200000", mapping_threads = "1", cache = "False",
+                               chain_blast_hits = "False", blast_max_intron = "20000"):
+    """takes evidence inputs and returns gff files to open in apollo. cache="True" caches the parsed genome and other_gff.
+    exonerate_output may be several space-separated paths or glob patterns, each of which must match a file.
+    mapping_threads is the number of mapping commands run at once, of processes reading the exonerate outputs and of
+    processes writing the per-scaffold apollo gffs. chain_blast_hits="True" strings collinear tblastn hits at most
+    blast_max_intron apart into one match each, without joining copies of a gene in a tandem array (see
+    genome.read_blast_csv)"""
     subprocess.call("mkdir -p " + output_directory, shell = True)
     subprocess.call("mkdir -p " + output_directory + "/temp", shell = True)
     mapping_cmds = []
@@ -226,19 +230,30 @@ def prep4apollo(genome_sequence, suppress_fasta = "False", output_directory = 'a
             exon_blast_csv = output_directory + '/cat_exon_tblastn.csv'
         else:
            exon_blast_csv = output_directory + '/exon_tblastn.csv'
+    if exonerate_output != None and not os.path.exists(exonerate_output):
+        #exonerate_output used to be joined with "cat", so it may be several space-separated paths or glob patterns
+        exonerate_patterns = exonerate_output.split()
+        exonerate_output = []
+        for pattern in exonerate_patterns:
+            pattern_matches = sorted(glob.glob(pattern))
+            if pattern_matches == []:
+                raise IOError("no exonerate output matches " + pattern)
+            exonerate_output.extend(pattern_matches)
     if exonerate_run:
+        #the outputs for each intron length are read together (in the order "cat exonerate_output*" would join them)
+        exonerate_outputs = sorted([output_directory + '/exonerate_output_' + intron_length + 'bp_introns.txt'
+                                    for intron_length in exonerate_intron_lengths])
         if exonerate_output != None:
-            subprocess.call('cat ' + exonerate_output + ' ' + output_directory + '/exonerate_output* > ' + output_directory
-                            + '/cat_exonerate_output.txt', shell = True)
+            exonerate_output = [exonerate_output] + exonerate_outputs
         else:
-            subprocess.call('cat ' + output_directory + '/exonerate_output* > ' + output_directory + '/cat_exonerate_output.txt', shell = True)
-        exonerate_output = output_directory + '/cat_exonerate_output.txt'  
+            exonerate_output = exonerate_outputs
     print "building apollo gffs"
-    my_genome = genome.Genome(genome_sequence,other_gff,annotation_format = other_gff_format)
+    my_genome = genome.Genome(genome_sequence,other_gff,annotation_format = other_gff_format, cache = eval(cache))
     if exon_blast_csv != None:
-        my_genome.read_blast_csv(exon_blast_csv, find_truncated_locname = True)
+        my_genome.read_blast_csv(exon_blast_csv, find_truncated_locname = True, chain_hits = eval(chain_blast_hits),
+                                 max_intron = int(blast_max_intron), tandem_array_safe = True)
     if exonerate_output != None:
-        my_genome.read_exonerate(exonerate_output)
+        my_genome.read_exonerate(exonerate_output, workers = int(mapping_threads))
     if output_empty_scaffolds:
         seqids = my_genome.get_seqids()
     else:
@@ -252,13 +267,11 @@ def prep4apollo(genome_sequence, suppress_fasta = "False", output_directory = 'a
                 starjunc_dic[seqid].append(junc)
             else:
                 starjunc_dic[seqid] = [junc]
-    for seqid in seqids:
-        out = open(output_directory + '/' + sanitize_pathname(seqid) + '.gff','w')
-        if starjuncs != None:
-            if seqid in starjunc_dic:
-                out.write('\n'.join(starjunc_dic[seqid]) + '\n')
-        out.write(my_genome.write_apollo_gff(seqid, suppress_fasta = suppress_fasta))
-        out.close()
+    else:
+        starjunc_dic = {}
+    seqid_files = [(seqid, output_directory + '/' + sanitize_pathname(seqid) + '.gff') for seqid in seqids]
+    my_genome.write_apollo_gffs(seqid_files, suppress_fasta = suppress_fasta, header_lines = starjunc_dic,
+                                workers = int(mapping_threads))
     subprocess.call('rm -rf ' + output_directory + '/temp', shell = True)
 
 
@@ -321,12 +334,15 @@ def get_CDS_peptides(genome_sequence,gff,output_location,gene_name_filters = [],
                     out.write('>' + pep_name + '\n' + CDSdict[CDS][1] + '\n')
 
 
-def gff2fasta(genome_sequence,gff,from_exons = "False",seq_type = "nucleotide", longest = "False", genomic = "False"):
-    my_genome = genome.Genome(genome_sequence)
+def gff2fasta(genome_sequence,gff,from_exons = "False",seq_type = "nucleotide", longest = "False", genomic = "False", cache = "False"):
+    """prints sequences of genes in gff, built from exons rather than CDS if from_exons="True". cache="True" caches the
+    parsed genome and gff"""
     if from_exons == "True":
-        my_genome.read_gff(gff, features_to_ignore = "CDS", features_to_replace = [('exon','CDS')])
+        #types are replaced before features are ignored, so the original CDS are renamed out of the way of the exons
+        annotation_options = {'features_to_ignore': ['replaced_CDS'], 'features_to_replace': [('CDS','replaced_CDS'),('exon','CDS')]}
     else:
-        my_genome.read_gff(gff)
+        annotation_options = {}
+    my_genome = genome.Genome(genome_sequence, gff, annotation_format = 'gff3', annotation_options = annotation_options, cache = eval(cache))
     print my_genome.annotations.get_fasta('gene',seq_type = seq_type, longest=eval(longest), genomic = eval(genomic))
 
 
@@ -391,22 +407,23 @@ def exclude_from_fasta(fasta, exclude_list, just_firstword = "False"):
             print '>' + seqid + '\n' + my_fasta.genome_sequence[seqid]
     
 
-def mask_from_gff(genome_sequence,gff,mask_type="soft", overwrite_softmask="True", feature_type="CDS"):
+def mask_from_gff(genome_sequence,gff,mask_type="soft", overwrite_softmask="True", feature_type="CDS", cache = "False"):
+    """prints genome_sequence with the positions of features of feature_type in gff soft-masked (lowercase) or hard-masked
+    (N). cache="True" caches the parsed genome"""
+    if overwrite_softmask in ["True","T","true","t","TRUE"]:
+        overwrite_softmask = True
+    elif overwrite_softmask in ["False","F","false","f","FALSE"]:
+        overwrite_softmask = False
+    else:
+        print "Invalid option for 'overwrite_softmask', argument accepts 'True' or 'False'"
+        return None
+    my_genome = genome.Genome(genome_sequence, truncate_names = True, cache = eval(cache))
     genome_dict = {}
-    genome_file = open(genome_sequence)
-    working_seqid = ""
-    for line in genome_file:
-        if line[0] == ">":
-            working_seqid = line.split()[0][1:].replace('\r','').replace('\n','')
-            genome_dict[working_seqid] = []
+    for seqid in my_genome.genome_sequence:
+        if overwrite_softmask:
+            genome_dict[seqid] = bytearray(str(my_genome.genome_sequence[seqid]).upper())
         else:
-            if overwrite_softmask in ["True","T","true","t","TRUE"]: 
-                genome_dict[working_seqid].extend(list(line.replace('\r','').replace('\n','').upper()))
-            elif overwrite_softmask in ["False","F","false","f","FALSE"]:
-                genome_dict[working_seqid].extend(list(line.replace('\r','').replace('\n','')))
-            else:
-                print "Invalid option for 'overwrite_softmask', argument accepts 'True' or 'False'"
-                return None
+            genome_dict[seqid] = bytearray(str(my_genome.genome_sequence[seqid]))
     gff_file = open(gff)
     for line in gff_file:
         if line.count('\t') > 5:
@@ -415,17 +432,14 @@ def mask_from_gff(genome_sequence,gff,mask_type="soft", overwrite_softmask="True
                 start = int(fields[3])
                 stop = int(fields[4])
                 if mask_type == "soft":
-                    genome_dict[fields[0]][start - 1:stop] = list("".join(genome_dict[fields[0]][start - 1:stop]).lower())
+                    genome_dict[fields[0]][start - 1:stop] = genome_dict[fields[0]][start - 1:stop].lower()
                 elif mask_type == "hard":
-                    nlist = []
-                    for i in range(1 + stop - start):
-                        nlist.append('N')
-                    genome_dict[fields[0]][start - 1:stop] = nlist
+                    genome_dict[fields[0]][start - 1:stop] = 'N' * (1 + stop - start)
                 else:
                     print "Invalid option for mask_type, argument accepts 'soft' and 'hard'"
                     return None
-    for seqid in genome_dict:
-        print ">" + seqid + '\n' + "".join(genome_dict[seqid])
+    for seqid in my_genome.genome_sequence:
+        print ">" + seqid + '\n' + str(genome_dict[seqid])
     
 
 def replace_names(text_file,replace_table, name_end = " "):
@@ -455,7 +469,7 @@ def repeatmasker2augustushints(repeatmasker_gff):
 
 
 def extract_upstream_downstream(genome_sequence,gff,sequence_length,stream,feature_type = "gene",namefrom = "ID", truncate_names = "True"):
-    sequence_dict = genome.GenomeSequence(genome_sequence, truncate_names = eval(truncate_names))
+    sequence_dict = genome.GenomeSequence(genome_sequence, truncate_names = eval(truncate_names), indexed = True)
     output_seqs = []
     for line in open(gff):
         if line.count('\t') > 5 and line[0] != "#":
@@ -481,7 +495,7 @@ def extract_upstream_downstream(genome_sequence,gff,sequence_length,stream,featu
     
 
 def get_seq_from_fasta(genome_sequence, seq_name, truncate_names = "False"):
-    my_genome = genome.Genome(genome_sequence, truncate_names = eval(truncate_names))
+    my_genome = genome.Genome(genome_sequence, truncate_names = eval(truncate_names), indexed = True)
     print my_genome.get_scaffold_fasta(seq_name)
 
 
@@ -524,10 +538,12 @@ def at_content_from_fasta(fasta):
     print name + str(ats) + '\t' + str(gcs)
     
 
-def convert_gff(gff, input_format, output_format):
+def convert_gff(gff, input_format, output_format, sort_output = "False", memory_budget = "2**30"):
     """converts gff from any of the many formats handled by this program to any format this program can output to.
     Currently accepts as input: gff3 (with parent and ID attributes), augustus, RepeatMasker, CEGMA
-    Currently accepts as output: gff3, gtf, exon_added_gff3"""
+    Currently accepts as output: gff3, gtf, exon_added_gff3
+    sort_output="True" sorts the output by seqid and start (e.g. for tabix), using temporary files once it takes more
+    than memory_budget bytes"""
     if input_format == 'gff3':
         presets = None
     else:
@@ -542,28 +558,30 @@ def convert_gff(gff, input_format, output_format):
         print "currently only writes 'gff3' and 'gtf' format"
         return None
     annotations = genome.read_gff(gff, presets = presets)
-    print genome.write_gff(annotations, gff_format)
+    genome.write_gff(annotations, gff_format, out_file = sys.stdout, sort_output = eval(sort_output), memory_budget = eval(memory_budget))
 
 
 def purge_overlaps(gff1, gff_to_purge):
-    purge_dict = {}
+    """prints lines of gff_to_purge whose features do not overlap any feature in gff1. Features only overlap if an end of
+    one lies strictly inside the other, so features that just touch, or that have the same coords, are kept"""
+    purge_list = []
     for line in open(gff1):
         if line.count('\t') > 6:
             x=line.split('\t')
-            if x[0] in purge_dict:
-                purge_dict[x[0]].append([int(x[3]),int(x[4])])
-            else:
-                purge_dict[x[0]] = [[int(x[3]),int(x[4])]]
+            purge_list.append((x[0], int(x[3]), int(x[4]), None))
+    purge_index = genome.IntervalIndex(purge_list)
     for line in open(gff_to_purge):
         printline = True
         if line.count('\t') > 6:
             x=line.split('\t')
-            if x[0] in purge_dict:
-                coords = [int(x[3]),int(x[4])]
-                for purge_coords in purge_dict[x[0]]:
-                    if purge_coords[0] < coords[0] < purge_coords[1] or purge_coords[0] < coords[1] < purge_coords[1] or coords[0] < purge_coords[0] < coords[1]:
-                        printline = False
-                        continue
+            start, end = int(x[3]), int(x[4])
+            positions = purge_index.find(x[0], start, end)
+            if len(positions) > 0:
+                purge_starts = purge_index.seqids[x[0]]['starts'][positions]
+                purge_ends = purge_index.seqids[x[0]]['ends'][positions]
+                if (((purge_starts < start) & (start < purge_ends)) | ((purge_starts < end) & (end < purge_ends)) |
+                    ((start < purge_starts) & (purge_starts < end))).any():
+                    printline = False
             if printline:
                 print line[:-1]
 
@@ -595,8 +613,9 @@ def besthits_from_psl(psl):
 
 
 
-def depth_from_gff(depth_file, gff, features = "['CDS','intron','upstream','downstream']", stream_length = '1000'):
-    my_annotations = genome.read_gff(gff)
+def depth_from_gff(depth_file, gff, features = "['CDS','intron','upstream','downstream']", stream_length = '1000', cache = "False"):
+    """prints summed depth of coverage over features in gff. cache="True" caches the parsed gff"""
+    my_annotations = genome.Genome(None, gff, annotation_format = 'gff3', cache = eval(cache)).annotations
     missing_list = []
     features_list = eval(features)
     depth_array_lens = {}
@@ -658,7 +677,7 @@ def coords2fasta(fasta_file,seqid,start,stop,truncate_names = "False"):
     a specific entry in a fasta file. truncate_names="True" can be used if you only want to provide
     the first word after the ">" as the seqid (assuming it's unique of course)"""
     print ">" + seqid + ":" + start + "-" + stop
-    print genome.Genome(fasta_file, truncate_names=eval(truncate_names)).genome_sequence[seqid][int(start) - 1:int(stop)]
+    print genome.Genome(fasta_file, truncate_names=eval(truncate_names), indexed = True).genome_sequence[seqid][int(start) - 1:int(stop)]
 
     
 def cds2pep(fasta_file):
@@ -6,6 +6,7 @@
 
 
 import copy
+import os
 import StringIO
 
 
@@ -56,6 +57,119 @@ def read_to_string(potential_file):
     return output_string
 
 
-
-
-
+def fasta_generator(fasta_file, truncate_names = False, block_size = 4194304):
+    """takes fasta file location, file, or string and yields (name, sequence) tuples for each entry. The file is read in
+    blocks of block_size bytes and the lines of each sequence are joined once, so reading time is linear with file size.
+    Entries with no sequence are skipped. If truncate_names is True, names are cut at the first whitespace."""
+    fasta = ensure_file(fasta_file)
+    if fasta == None:
+        return
+    seqname = ""
+    seq_chunks = []
+    #header holds the part of a header line read so far, or None when not within a header line
+    header = None
+    block_starts_line = True
+    while True:
+        block = fasta.read(block_size)
+        if block == "":
+            if header == None:
+                break
+            #finishes a header on the last line of a file with no final line return
+            block = "\n"
+        position = 0
+        while position < len(block):
+            if header != None:
+                header_end = block.find('\n', position)
+                if header_end == -1:
+                    header = header + block[position:]
+                    break
+                header = header + block[position:header_end]
+                seq = "".join(seq_chunks)
+                if seq != "":
+                    yield seqname, seq
+                seq_chunks = []
+                seqname = header.replace('\r','')
+                if truncate_names:
+                    seqname = seqname.split()[0]
+                header = None
+                position = header_end + 1
+            elif block[position] == '>' and (block[position - 1] == '\n' if position > 0 else block_starts_line):
+                header = ""
+                position = position + 1
+            else:
+                #sequence runs until the next ">" at the start of a line
+                next_header = block.find('>', position + 1)
+                while next_header != -1 and block[next_header - 1] != '\n':
+                    next_header = block.find('>', next_header + 1)
+                if next_header == -1:
+                    next_header = len(block)
+                seq_chunks.append(block[position:next_header].replace('\r','').replace('\n',''))
+                position = next_header
+        block_starts_line = block[-1] == '\n'
+    seq = "".join(seq_chunks)
+    if seq != "":
+        yield seqname, seq
+
+
+def read_fasta(fasta_file, truncate_names = False, as_generator = False, block_size = 4194304):
+    """reads fasta file location, file, or string into a dictionary of {name:sequence}. If as_generator is True, instead
+    returns a generator of (name, sequence) tuples so that entries can be processed one at a time."""
+    records = fasta_generator(fasta_file, truncate_names = truncate_names, block_size = block_size)
+    if as_generator:
+        return records
+    else:
+        return dict(records)
+
+
+def index_fasta(fasta_location):
+    """builds a samtools-style fasta index (the contents of a .fai file) for the fasta at fasta_location. Returns a list of
+    [name, length, offset, line_bases, line_width] entries, where name is the first word of the fasta header, or None if
+    an entry has lines of differing lengths (other than its last line) and so can't be indexed."""
+    index = []
+    entry = None
+    offset = 0
+    short_line_found = False
+    for line in open(fasta_location, 'rb'):
+        if line[0] == '>':
+            entry = [line[1:].split()[0], 0, offset + len(line), 0, 0]
+            index.append(entry)
+            short_line_found = False
+        elif entry != None:
+            line_bases = len(line.rstrip('\r\n'))
+            if line_bases == 0 and entry[3] == 0:
+                #blank lines before an entry's sequence
+                entry[2] = offset + len(line)
+            elif line_bases > 0:
+                if entry[3] == 0:
+                    entry[3] = line_bases
+                    entry[4] = len(line)
+                elif short_line_found or line_bases > entry[3] or (line_bases == entry[3] and len(line) != entry[4]):
+                    return None
+                entry[1] = entry[1] + line_bases
+            if line_bases < entry[3]:
+                short_line_found = True
+        offset = offset + len(line)
+    return index
+
+
+def load_fasta_index(fasta_location):
+    """returns the samtools-style index of the fasta at fasta_location (see index_fasta). An existing .fai file next to the
+    fasta is reused if it is newer than the fasta; otherwise the index is built and written to a .fai file if possible."""
+    fai_location = fasta_location + '.fai'
+    if os.path.exists(fai_location) and os.path.getmtime(fai_location) >= os.path.getmtime(fasta_location):
+        index = []
+        for line in open(fai_location):
+            fields = line.split('\t')
+            if len(fields) >= 5:
+                index.append([fields[0]] + [int(field) for field in fields[1:5]])
+        return index
+    index = index_fasta(fasta_location)
+    if index != None:
+        try:
+            fai = open(fai_location, 'w')
+            for entry in index:
+                fai.write('\t'.join([str(field) for field in entry]) + '\n')
+            fai.close()
+        except IOError:
+            pass
+    return index
@@ -0,0 +1,779 @@
+#!/usr/bin/env python
+#Runs benchmarks of MAGOT on inputs built from the files in test_data. Run from within test_data, either with no
+#arguments to run all benchmarks or with the names of the benchmarks to run (e.g. "python benchmarks.py gff_load")
+
+import sys
+import collections
+import os
+import time
+import tempfile
+import random
+import resource
+import subprocess
+import copy
+import gc
+import numpy
+sys.path.insert(0, '..')
+import genome
+import annotation_funcs
+
+genome.verbose = False
+
+
+def replicate_gff(gff, copies, out_location):
+    """writes "copies" copies of a gff to out_location, prefixing seqids, IDs, Parents and gtf transcript_ids and gene_ids
+    with the copy number so that each copy is a distinct set of features. Returns the number of feature lines written"""
+    lines = [line for line in open(gff) if line[0] != "#" and line.count('\t') == 8]
+    out = open(out_location, 'w')
+    for copy_number in range(copies):
+        prefix = 'copy' + str(copy_number) + '_'
+        for line in lines:
+            out.write(prefix + line.replace('ID=', 'ID=' + prefix).replace('Parent=', 'Parent=' + prefix).replace('_id "', '_id "' + prefix))
+    out.close()
+    return len(lines) * copies
+
+
+def write_wrapped_fasta(seqs, out_location, line_length = 60):
+    """writes list of (name, sequence) tuples to out_location as fasta with sequence lines of line_length"""
+    out = open(out_location, 'w')
+    for name, seq in seqs:
+        out.write('>' + name + '\n')
+        for line_start in range(0, len(seq), line_length):
+            out.write(seq[line_start:line_start + line_length] + '\n')
+    out.close()
+
+
+def time_call(function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def memory_used():
+    """returns resident memory of this process in MB (from /proc, so Linux only)"""
+    return int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1000000.0
+
+
+def measure_call(function, *args):
+    """calls function with args and returns the increase in resident memory (MB), the increase in peak resident memory
+    (MB) and the seconds the call took. The return value of function is discarded"""
+    start_memory = memory_used()
+    start_time = time.time()
+    result = function(*args)
+    seconds = time.time() - start_time
+    gc.collect()
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000.0
+    return memory_used() - start_memory, peak_memory - start_memory, seconds
+
+
+def memory_of_call(function_name, *args):
+    """runs measure_call on the function of this module called function_name with string args in a new python process,
+    so that memory freed by earlier calls isn't reused"""
+    measure_process = subprocess.Popen([sys.executable, sys.argv[0], 'measure', function_name] + list(args),
+                                       stdout = subprocess.PIPE)
+    return [float(value) for value in measure_process.communicate()[0].split()]
+
+
+def gff_load(copy_steps = [1, 2, 4, 8, 16]):
+    """times read_gff on increasingly large copies of the RefSeq gff. Time per line should stay flat if loading
+    scales linearly with line count"""
+    print "#gff_load: read_gff on replicated O.biroi_NCBIrefseq_gff3Subset.gff"
+    print "\t".join(["lines", "seconds", "lines/s", "us/line"])
+    temp_gff = tempfile.mktemp(suffix = '.gff')
+    for copies in copy_steps:
+        line_count = replicate_gff('O.biroi_NCBIrefseq_gff3Subset.gff', copies, temp_gff)
+        seconds = time_call(genome.read_gff, temp_gff)
+        print "\t".join([str(line_count), "%.3f" % seconds, "%.0f" % (line_count / seconds), "%.1f" % (seconds * 1000000 / line_count)])
+    os.remove(temp_gff)
+
+
+def gff_tokenize(copies = 20):
+    """measures lines per second of GffTokenizer alone and of read_gff on copies of StandardGTF.gtf and of the RefSeq
+    gff"""
+    print "#gff_tokenize: GffTokenizer and read_gff throughput"
+    print "\t".join(["file", "lines", "tokenizer_lines/s", "read_gff_lines/s"])
+    temp_gff = tempfile.mktemp(suffix = '.gff')
+    for gff in ['StandardGTF.gtf', 'O.biroi_NCBIrefseq_gff3Subset.gff']:
+        line_count = replicate_gff(gff, copies, temp_gff)
+        tokenizer_seconds = time_call(collections.deque, genome.GffTokenizer().tokenize(open(temp_gff)), 0)
+        read_seconds = time_call(genome.read_gff, temp_gff)
+        print "\t".join([gff, str(line_count), "%.0f" % (line_count / tokenizer_seconds), "%.0f" % (line_count / read_seconds)])
+    os.remove(temp_gff)
+
+
+def legacy_fasta_parse(fasta):
+    """fasta parser used by GenomeSequence before genome.read_fasta, kept here as a reference for fasta_parse"""
+    seqs = {}
+    seq = ""
+    seqname = ""
+    for line in open(fasta):
+        if line[0] == ">":
+            seqid = line[1:].replace('\r','').replace('\n','')
+            if seq != "":
+                seqs[seqname] = seq
+                seq = ""
+            seqname = seqid
+        else:
+            seq = seq + line.replace('\r','').replace('\n','')
+    if seq != "":
+        seqs[seqname] = seq
+    return seqs
+
+
+def fasta_parse(record_sizes = [1000000, 10000000, 50000000]):
+    """compares throughput of the legacy line-by-line fasta parser and genome.read_fasta on single-record fastas
+    (60 bases per line) built from O.biroi_refseqGenomeSubset.fasta"""
+    print "#fasta_parse: legacy GenomeSequence parser vs read_fasta"
+    print "\t".join(["record_bp", "MB", "legacy_MB/s", "read_fasta_MB/s"])
+    test_seq = "".join(genome.read_fasta('O.biroi_refseqGenomeSubset.fasta').values())
+    temp_fasta = tempfile.mktemp(suffix = '.fasta')
+    for record_size in record_sizes:
+        write_wrapped_fasta([('scaffold1', (test_seq * (record_size / len(test_seq) + 1))[:record_size])], temp_fasta)
+        megabytes = os.path.getsize(temp_fasta) / 1000000.0
+        legacy_seconds = time_call(legacy_fasta_parse, temp_fasta)
+        new_seconds = time_call(genome.read_fasta, temp_fasta)
+        print "\t".join([str(record_size), "%.1f" % megabytes, "%.1f" % (megabytes / legacy_seconds), "%.1f" % (megabytes / new_seconds)])
+    os.remove(temp_fasta)
+
+
+def indexed_slice(genome_size = 100000000, scaffold_count = 20):
+    """times extracting a 3 kb slice from a synthetic genome read into memory vs. read through a .fai index (both
+    building the index and reusing an existing one)"""
+    print "#indexed_slice: slice 3 kb from a " + str(genome_size / 1000000) + " Mb genome"
+    print "\t".join(["mode", "milliseconds"])
+    test_seq = "".join(genome.read_fasta('O.biroi_refseqGenomeSubset.fasta').values())
+    scaffold_size = genome_size / scaffold_count
+    scaffold_seq = (test_seq * (scaffold_size / len(test_seq) + 1))[:scaffold_size]
+    temp_fasta = tempfile.mktemp(suffix = '.fasta')
+    write_wrapped_fasta([('scaffold' + str(i), scaffold_seq) for i in range(scaffold_count)], temp_fasta)
+    def get_slice(indexed):
+        return genome.GenomeSequence(temp_fasta, indexed = indexed)['scaffold' + str(scaffold_count / 2)][1000000:1003000]
+    for mode, indexed in [("in memory", False), ("indexed, building .fai", True), ("indexed, reusing .fai", True)]:
+        print mode + "\t" + "%.1f" % (time_call(get_slice, indexed) * 1000)
+    os.remove(temp_fasta)
+    os.remove(temp_fasta + '.fai')
+
+
+def packed_genome(genome_size = 50000000):
+    """compares memory used by sequences and time to load and write out a synthetic soft-masked genome stored as
+    strings vs. as 2-bit PackedSequences"""
+    print "#packed_genome: " + str(genome_size / 1000000) + " Mb soft-masked genome as str vs. PackedSequence"
+    print "\t".join(["mode", "sequence_MB", "load_seconds", "get_genome_fasta_seconds"])
+    test_seq = "".join(genome.read_fasta('O.biroi_refseqGenomeSubset.fasta').values())
+    test_seq = test_seq[:len(test_seq) / 2] + test_seq[len(test_seq) / 2:].lower()
+    temp_fasta = tempfile.mktemp(suffix = '.fasta')
+    write_wrapped_fasta([('scaffold1', (test_seq * (genome_size / len(test_seq) + 1))[:genome_size])], temp_fasta)
+    for mode, packed in [("str", False), ("packed", True)]:
+        start = time.time()
+        my_genome = genome.Genome(temp_fasta, packed = packed)
+        load_seconds = time.time() - start
+        if packed:
+            sequence_bytes = sum([sum([value.nbytes for value in seq.__dict__.values() if hasattr(value, 'nbytes')])
+                                  for seq in my_genome.genome_sequence.values()])
+        else:
+            sequence_bytes = sum([len(seq) for seq in my_genome.genome_sequence.values()])
+        write_seconds = time_call(my_genome.get_genome_fasta)
+        print "\t".join([mode, "%.1f" % (sequence_bytes / 1000000.0), "%.2f" % load_seconds, "%.2f" % write_seconds])
+    os.remove(temp_fasta)
+
+
+def genome_cache(copies = 8):
+    """times loading the test genome with a replicated RefSeq gff from the original files (writing the cache) and
+    from the binary cache"""
+    print "#genome_cache: Genome load from source files vs. from cache"
+    print "\t".join(["mode", "seconds"])
+    temp_gff = tempfile.mktemp(suffix = '.gff')
+    replicate_gff('O.biroi_NCBIrefseq_gff3Subset.gff', copies, temp_gff)
+    temp_cache = tempfile.mktemp(suffix = '.npz')
+    def load_genome(cache):
+        return genome.Genome('O.biroi_refseqGenomeSubset.fasta', temp_gff, annotation_format = 'gff3', cache = cache)
+    for mode, cache in [("no cache", False), ("writing cache", temp_cache), ("reading cache", temp_cache)]:
+        print mode + "\t" + "%.3f" % time_call(load_genome, cache)
+    os.remove(temp_gff)
+    os.remove(temp_cache)
+
+
+def legacy_reverse_compliment(seq):
+    """Sequence.reverse_compliment before compliment_table, kept here as a reference for reverse_compliment"""
+    new_sequence_list = []
+    compliment_dict = {'a':'t','t':'a','g':'c','c':'g','A':'T','T':'A','G':'C','C':'G','n':'n','N':'N','-':'-'}
+    for residue in seq[::-1]:
+        try:
+            new_sequence_list.append(compliment_dict[residue])
+        except KeyError:
+            new_sequence_list.append('n')
+    return genome.Sequence(''.join(new_sequence_list))
+
+
+def reverse_compliment(sequence_size = 10000000):
+    """compares the legacy per-base reverse_compliment with Sequence.reverse_compliment on a soft-masked sequence
+    built from O.biroi_refseqGenomeSubset.fasta"""
+    print "#reverse_compliment: " + str(sequence_size / 1000000) + " Mb sequence"
+    print "\t".join(["mode", "seconds", "speedup"])
+    test_seq = "".join(genome.read_fasta('O.biroi_refseqGenomeSubset.fasta').values())
+    test_seq = test_seq[:len(test_seq) / 2] + test_seq[len(test_seq) / 2:].lower()
+    test_seq = genome.Sequence((test_seq * (sequence_size / len(test_seq) + 1))[:sequence_size])
+    legacy_seconds = time_call(legacy_reverse_compliment, test_seq)
+    new_seconds = time_call(test_seq.reverse_compliment)
+    if legacy_reverse_compliment(test_seq) != test_seq.reverse_compliment():
+        print "ERROR: reverse_compliment output differs from legacy output"
+    print "\t".join(["legacy", "%.3f" % legacy_seconds, "1.0"])
+    print "\t".join(["compliment_table", "%.3f" % new_seconds, "%.0f" % (legacy_seconds / new_seconds)])
+
+
+def legacy_translate(seq, frame = 0, strand = '+', trimX = True):
+    """Sequence.translate before translate_codons, kept here as a reference for translate"""
+    library = genome.get_genetic_code(1)
+    triplet = ""
+    newseq = ""
+    if strand == '+':
+        seq = seq
+    elif strand == '-':
+        seq = seq.reverse_compliment()
+    if len(seq) > (2 + frame):
+        for residue_position in range(frame, len(seq)):
+            triplet = triplet + seq[residue_position].upper()
+            if (residue_position + frame) % 3 == 2:
+                try:
+                    newseq = newseq + library[triplet]
+                except KeyError:
+                    newseq = newseq + 'X'
+                triplet = ""
+        if trimX:
+            if newseq[0] == 'X':
+                newseq = newseq[1:]
+        return newseq
+
+
+def translate(sequence_size = 1000000):
+    """compares the legacy per-base translate with Sequence.translate and Sequence.translate_frames on all six frames of
+    a sequence built from O.biroi_refseqGenomeSubset.fasta"""
+    print "#translate: six frames of a " + str(sequence_size / 1000000) + " Mb sequence"
+    print "\t".join(["mode", "seconds", "speedup"])
+    test_seq = "".join(genome.read_fasta('O.biroi_refseqGenomeSubset.fasta').values())
+    test_seq = genome.Sequence((test_seq * (sequence_size / len(test_seq) + 1))[:sequence_size])
+    frames = [(frame, strand) for frame in [0, 1, 2] for strand in ['+', '-']]
+    def translate_each(translate_function):
+        return dict([((frame, strand), translate_function(test_seq, frame = frame, strand = strand)) for frame, strand in frames])
+    legacy_seconds = time_call(translate_each, legacy_translate)
+    new_seconds = time_call(translate_each, genome.Sequence.translate)
+    frames_seconds = time_call(test_seq.translate_frames)
+    if translate_each(legacy_translate) != test_seq.translate_frames():
+        print "ERROR: translate output differs from legacy output"
+    print "\t".join(["legacy", "%.3f" % legacy_seconds, "1.0"])
+    print "\t".join(["translate", "%.3f" % new_seconds, "%.0f" % (legacy_seconds / new_seconds)])
+    print "\t".join(["translate_frames", "%.3f" % frames_seconds, "%.0f" % (legacy_seconds / frames_seconds)])
+
+
+def orf_scan(contig_count = 200000, contig_sizes = (300, 1700)):
+    """times find_orfs on a synthetic transcriptome of contig_count contigs cut from O.biroi_refseqGenomeSubset.fasta,
+    and the previous get_orfs approach (six translations per contig, split on stops) on a sample of the contigs"""
+    print "#orf_scan: " + str(contig_count) + " contigs of " + str(contig_sizes[0]) + "-" + str(contig_sizes[1]) + " bp"
+    print "\t".join(["mode", "contigs", "ORFs", "seconds"])
+    test_seq = "".join(genome.read_fasta('O.biroi_refseqGenomeSubset.fasta').values())
+    random.seed(0)
+    contigs = {}
+    for contig_number in range(contig_count):
+        contig_start = random.randint(0, len(test_seq) - contig_sizes[1])
+        contigs['contig' + str(contig_number)] = test_seq[contig_start:contig_start + random.randint(*contig_sizes)]
+    def split_translations(sequences):
+        return [[orf for frame in [0, 1, 2] for strand in ['-', '+']
+                 for orf in legacy_translate(genome.Sequence(sequences[seqid]), frame, strand).split('*')] for seqid in sequences]
+    sample = dict(contigs.items()[:contig_count / 100])
+    print "\t".join(["legacy split (1% sample)", str(len(sample)), str(sum([len(orfs) for orfs in split_translations(sample)])),
+                     "%.2f" % time_call(split_translations, sample)])
+    for mode, options in [("find_orfs min_length=30", {'min_length': 30}), ("find_orfs min_length=100", {'min_length': 100}),
+                          ("find_orfs longest", {'longest': True})]:
+        start = time.time()
+        orfs = genome.find_orfs(contigs, **options)
+        print "\t".join([mode, str(contig_count), str(len(orfs)), "%.2f" % (time.time() - start)])
+        del orfs
+
+
+def legacy_annotation_overlap(annotation_set_features1, annotation_set_features2):
+    """annotation_overlap before IntervalIndex (with its containment check fixed), kept here as a reference"""
+    annotation_coords_dict = {}
+    contained_list = []
+    for annotation in annotation_set_features1:
+        annotation_obj = annotation_set_features1[annotation]
+        annotation_coords_dict.setdefault(annotation_obj.seqid, []).append(annotation_obj.get_coords())
+    for annotation in annotation_set_features2:
+        annotation_obj = annotation_set_features2[annotation]
+        coords2 = annotation_obj.get_coords()
+        for coords1 in annotation_coords_dict.get(annotation_obj.seqid, []):
+            if coords1[0] <= coords2[1] and coords2[0] <= coords1[1]:
+                contained_list.append(annotation_obj.ID)
+    return contained_list
+
+
+def overlap(copy_steps = [1, 4, 16]):
+    """times annotation_funcs.annotation_overlap of exons against mRNAs from increasingly large copies of the RefSeq gff,
+    with all copies placed on the same scaffolds"""
+    print "#overlap: annotation_overlap of exons and mRNAs on replicated O.biroi_NCBIrefseq_gff3Subset.gff"
+    print "\t".join(["exons", "mRNAs", "legacy_seconds", "interval_index_seconds"])
+    temp_gff = tempfile.mktemp(suffix = '.gff')
+    for copies in copy_steps:
+        replicate_gff('O.biroi_NCBIrefseq_gff3Subset.gff', copies, temp_gff)
+        gff_text = "".join([line.split('_', 1)[1] for line in open(temp_gff)])
+        open(temp_gff, 'w').write(gff_text)
+        annotations = genome.read_gff(temp_gff, base_features = ['exon', 'region'], features_to_ignore = ['CDS'])
+        legacy_seconds = time_call(legacy_annotation_overlap, annotations.exon, annotations.mRNA)
+        new_seconds = time_call(annotation_funcs.annotation_overlap, annotations.exon, annotations.mRNA)
+        print "\t".join([str(len(annotations.exon)), str(len(annotations.mRNA)), "%.2f" % legacy_seconds, "%.2f" % new_seconds])
+    os.remove(temp_gff)
+
+
+def object_load(gff):
+    return genome.read_gff(gff)
+
+
+def legacy_read_gff(gff):
+    """read_gff as it was when it returned a deep copy of the AnnotationSet it built, kept here as a reference"""
+    return copy.deepcopy(genome.read_gff(gff))
+
+
+def gff_memory(copy_steps = [1, 4, 16]):
+    """compares peak memory and time of read_gff with the legacy deep copy of its result on replicated RefSeq gffs"""
+    print "#gff_memory: peak memory of read_gff on replicated O.biroi_NCBIrefseq_gff3Subset.gff"
+    print "\t".join(["lines", "legacy_peak_MB", "peak_MB", "legacy_seconds", "seconds"])
+    temp_gff = tempfile.mktemp(suffix = '.gff')
+    for copies in copy_steps:
+        line_count = replicate_gff('O.biroi_NCBIrefseq_gff3Subset.gff', copies, temp_gff)
+        legacy_memory, legacy_peak, legacy_seconds = memory_of_call('legacy_read_gff', temp_gff)
+        memory, peak, seconds = memory_of_call('object_load', temp_gff)
+        print "\t".join([str(line_count), "%.1f" % legacy_peak, "%.1f" % peak, "%.2f" % legacy_seconds, "%.2f" % seconds])
+    os.remove(temp_gff)
+
+
+def write_gff_string(gff, gff_format):
+    out = open(os.devnull, 'w')
+    out.write(genome.write_gff(genome.read_gff(gff), gff_format) + '\n')
+    out.close()
+
+
+def write_gff_stream(gff, gff_format):
+    out = open(os.devnull, 'w')
+    genome.write_gff(genome.read_gff(gff), gff_format, out_file = out)
+    out.close()
+
+
+def gff_write(copies = 16):
+    """compares peak memory and time of reading replicated StandardGTF.gtf and writing it with write_gff as one string
+    and streamed to a file"""
+    print "#gff_write: read_gff then write_gff of replicated StandardGTF.gtf, as a string and streamed"
+    print "\t".join(["format", "lines_in", "string_peak_MB", "stream_peak_MB", "string_seconds", "stream_seconds"])
+    temp_gff = tempfile.mktemp(suffix = '.gtf')
+    line_count = replicate_gff('StandardGTF.gtf', copies, temp_gff)
+    for gff_format in ["simple gff3", "extended gff3", "exon added gff3", "gtf"]:
+        string_memory, string_peak, string_seconds = memory_of_call('write_gff_string', temp_gff, gff_format)
+        stream_memory, stream_peak, stream_seconds = memory_of_call('write_gff_stream', temp_gff, gff_format)
+        print "\t".join([gff_format, str(line_count), "%.1f" % string_peak, "%.1f" % stream_peak, "%.2f" % string_seconds,
+                         "%.2f" % stream_seconds])
+    os.remove(temp_gff)
+
+
+def gff_sort(copies = 16, memory_budgets = [2**30, 2**24, 2**20]):
+    """times sorted write_gff of replicated StandardGTF.gtf with memory budgets that sort in memory and that spill
+    sorted runs to temporary files"""
+    print "#gff_sort: write_gff(sort_output = True) of replicated StandardGTF.gtf to a file"
+    print "\t".join(["memory_budget", "lines_in", "unsorted_seconds", "sorted_seconds"])
+    temp_gff = tempfile.mktemp(suffix = '.gtf')
+    line_count = replicate_gff('StandardGTF.gtf', copies, temp_gff)
+    annotations = genome.read_gff(temp_gff)
+    out = open(os.devnull, 'w')
+    unsorted_seconds = time_call(genome.write_gff, annotations, out_file = out)
+    for memory_budget in memory_budgets:
+        sorted_seconds = time_call(genome.write_gff, annotations, out_file = out, sort_output = True, memory_budget = memory_budget)
+        print "\t".join([str(memory_budget), str(line_count), "%.2f" % unsorted_seconds, "%.2f" % sorted_seconds])
+    out.close()
+    os.remove(temp_gff)
+
+
+def legacy_get_seqid(annotation_set, seqid):
+    """AnnotationSet.get_seqid before the seqid_index, which scanned every feature, kept here as a reference"""
+    seqid_annotation_set = genome.AnnotationSet()
+    for attribute in annotation_set.get_feature_types():
+        setattr(seqid_annotation_set, attribute, {})
+        for feature in getattr(annotation_set, attribute):
+            feature_obj = getattr(annotation_set, attribute)[feature]
+            if feature_obj.seqid == seqid:
+                getattr(seqid_annotation_set, feature_obj.feature_type)[feature] = feature_obj
+    return seqid_annotation_set
+
+
+def seqid_split(copy_steps = [4, 16, 64]):
+    """times splitting replicated RefSeq gffs (6 scaffolds per copy) into one AnnotationSet per scaffold, as
+    prep4apollo does, with the legacy scan and with the seqid_index"""
+    print "#seqid_split: get_seqid of every scaffold of replicated O.biroi_NCBIrefseq_gff3Subset.gff"
+    print "\t".join(["features", "scaffolds", "legacy_seconds", "indexed_seconds"])
+    temp_gff = tempfile.mktemp(suffix = '.gff')
+    for copies in copy_steps:
+        replicate_gff('O.biroi_NCBIrefseq_gff3Subset.gff', copies, temp_gff)
+        annotations = genome.read_gff(temp_gff)
+        seqids = annotations.get_all_seqids()
+        legacy_seconds = time_call(lambda: [legacy_get_seqid(annotations, seqid) for seqid in seqids])
+        indexed_seconds = time_call(lambda: [annotations.get_seqid(seqid) for seqid in seqids])
+        print "\t".join([str(len(annotations.ID_index)), str(len(seqids)), "%.2f" % legacy_seconds, "%.2f" % indexed_seconds])
+    os.remove(temp_gff)
+
+
+def apollo_export(copies = 16, worker_counts = [1, 2, 4]):
+    """times Genome.write_apollo_gffs of replicated RefSeq gffs and genome (6 scaffolds per copy) with increasing
+    numbers of worker processes"""
+    print "#apollo_export: write_apollo_gffs of replicated O.biroi_NCBIrefseq_gff3Subset.gff and its genome"
+    print "\t".join(["workers", "scaffolds", "seconds"])
+    temp_gff = tempfile.mktemp(suffix = '.gff')
+    temp_fasta = tempfile.mktemp(suffix = '.fasta')
+    out_directory = tempfile.mkdtemp()
+    replicate_gff('O.biroi_NCBIrefseq_gff3Subset.gff', copies, temp_gff)
+    genome_sequence = genome.GenomeSequence('O.biroi_refseqGenomeSubset.fasta')
+    write_wrapped_fasta([('copy' + str(copy_number) + '_' + seqid, str(genome_sequence[seqid])) for copy_number in range(copies)
+                         for seqid in genome_sequence], temp_fasta)
+    replicated_genome = genome.Genome(temp_fasta)
+    replicated_genome.read_gff(temp_gff, base_features = ['exon', 'region'], features_to_ignore = ['CDS'])
+    seqid_files = [(seqid, os.path.join(out_directory, seqid + '.gff')) for seqid in replicated_genome.get_seqids()]
+    for workers in worker_counts:
+        seconds = time_call(replicated_genome.write_apollo_gffs, seqid_files, workers = workers)
+        print "\t".join([str(workers), str(len(seqid_files)), "%.2f" % seconds])
+    subprocess.call(['rm', '-rf', out_directory, temp_gff, temp_fasta])
+
+
+def write_exonerate_output(record_count, out_location, seqids, seed = 0):
+    """writes exonerate output of record_count random protein2genome alignments (Query, Target and vulgar lines) to
+    seqids to out_location"""
+    random.seed(seed)
+    out = open(out_location, 'w')
+    for record in range(record_count):
+        query = 'prot' + str(random.randint(0, record_count / 3))
+        target = random.choice(seqids)
+        strand = random.choice('+-')
+        operations = []
+        target_length = 0
+        for block in range(random.randint(1, 8)):
+            match_length = random.randint(5, 200)
+            operations.extend(['M', str(match_length), str(match_length * 3), 'G', '0', '3'])
+            target_length = target_length + match_length * 3 + 3
+            intron_length = random.randint(30, 3000)
+            operations.extend(['5', '0', '2', 'I', '0', str(intron_length), '3', '0', '2'])
+            target_length = target_length + intron_length + 4
+        target_start = random.randint(0, 500000)
+        if strand == '+':
+            coords = [target_start, target_start + target_length]
+        else:
+            coords = [target_start + target_length, target_start]
+        out.write('C4 Alignment:\n------------\n         Query: ' + query + ' description\n        Target: ' + target +
+                  {'+': '', '-': ':[revcomp]'}[strand] + '\n')
+        out.write(' '.join(['vulgar:', query, '0', '100', '.', target, str(coords[0]), str(coords[1]), strand,
+                            str(random.randint(50, 900))] + operations) + '\n')
+    out.close()
+
+
+def legacy_read_exonerate(exonerate_output):
+    """read_exonerate as it was when it made gff lines with vulgar2gff and read them with read_gff, kept here as a reference"""
+    gfflines = []
+    IDdic = {}
+    qname = ""
+    tname = ""
+    for original_line in open(exonerate_output):
+        line = original_line.replace('\r','').replace('\n','')
+        if line[:16] == "         Query: ":
+            qname = line[16:]
+        elif line[:16] == "        Target: ":
+            tname = line[16:].replace(':[revcomp]','').replace('[revcomp]','')
+            if tname[-1] == " ":
+                tname = tname[:-1]
+        elif line[:8] == "vulgar: ":
+            vulgar_line_list = line[8:].split()
+            vulgar_line_list[0] = qname
+            vulgar_line_list[4] = tname
+            ID = vulgar_line_list[0] + '-against-' + vulgar_line_list[4]
+            if ID in IDdic:
+                vulgar_line_list[0] = vulgar_line_list[0] + str(IDdic[ID])
+                IDdic[ID] = IDdic[ID] + 1
+            else:
+                IDdic[ID] = 1
+            gfflines.append(genome.vulgar2gff(vulgar_line_list))
+    return genome.read_gff("\n".join(gfflines))
+
+
+def exonerate_parse(record_counts = [10000, 40000], file_count = 4, worker_counts = [1, 4]):
+    """times reading random exonerate outputs through gff text (legacy) and directly, from one file and from a
+    directory of file_count files with increasing numbers of worker processes"""
+    print "#exonerate_parse: read_exonerate of random protein2genome alignments to the O.biroi_refseqGenomeSubset.fasta scaffolds"
+    print "\t".join(["records", "features", "legacy_seconds", "direct_seconds"] + ["directory_" + str(workers) + "_workers_seconds"
+                                                                              for workers in worker_counts])
+    seqids = genome.GenomeSequence('O.biroi_refseqGenomeSubset.fasta').keys()
+    temp_directory = tempfile.mkdtemp()
+    for record_count in record_counts:
+        for file_number in range(file_count):
+            write_exonerate_output(record_count / file_count, os.path.join(temp_directory, 'exonerate' + str(file_number)),
+                                   seqids, seed = file_number)
+        temp_exonerate = tempfile.mktemp()
+        subprocess.call('cat ' + temp_directory + '/* > ' + temp_exonerate, shell = True)
+        legacy_seconds = time_call(legacy_read_exonerate, temp_exonerate)
+        start = time.time()
+        annotations = genome.read_exonerate(temp_exonerate)
+        direct_seconds = time.time() - start
+        directory_seconds = ["%.2f" % time_call(genome.read_exonerate, temp_directory, workers = workers) for workers in worker_counts]
+        print "\t".join([str(record_count), str(len(annotations.ID_index)), "%.2f" % legacy_seconds, "%.2f" % direct_seconds] +
+                        directory_seconds)
+        os.remove(temp_exonerate)
+    subprocess.call(['rm', '-rf', temp_directory])
+
+
+def write_blast_csv(hit_count, out_location, seqids, seed = 0):
+    """writes hit_count random tblastn hits (-outfmt 10) to seqids to out_location"""
+    random.seed(seed)
+    out = open(out_location, 'w')
+    for hit in range(hit_count):
+        subject_start = random.randint(1, 500000)
+        subject_end = subject_start + random.choice([1, -1]) * random.randint(30, 600)
+        query_start = random.randint(1, 300)
+        out.write(','.join(['prot' + str(random.randint(0, hit_count / 5)), random.choice(seqids), '90.0', '100', '5', '0',
+                            str(query_start), str(query_start + 99), str(subject_start), str(subject_end), '1e-20', '150']) + '\n')
+    out.close()
+
+
+def legacy_read_blast_csv(blast_csv, hierarchy = ['match','match_part'], find_truncated_locname = False, genome_seqids = []):
+    """read_blast_csv as it was when it parsed one line at a time, kept here as a reference"""
+    annotation_set = genome.AnnotationSet()
+    id_generator_dict = {}
+    feature_type = hierarchy[-1]
+    create_parents_chain = hierarchy[:-1]
+    create_parents_chain.reverse()
+    if not feature_type in annotation_set.__dict__:
+        setattr(annotation_set, feature_type, {})
+    for whole_line in open(blast_csv):
+        fields = whole_line.replace('\r','').replace('\n','').split(',')
+        if len(fields) > 8:
+            seqid = fields[1]
+            if find_truncated_locname:
+                if not seqid in genome_seqids:
+                    for genome_seqid in genome_seqids:
+                        if seqid == genome_seqid.split()[0]:
+                            seqid = genome_seqid
+                            break
+            tstart = int(fields[8])
+            tend = int(fields[9])
+            if tstart < tend:
+                coords = (tstart,tend)
+                strand = '+'
+            else:
+                coords = (tend,tstart)
+                strand = '-'
+            IDbase = fields[0]
+            if IDbase in eval('annotation_set.' + feature_type):
+                ID = IDbase + '-' + str(id_generator_dict[IDbase])
+                id_generator_dict[IDbase] = id_generator_dict[IDbase] + 1
+                while ID in eval('annotation_set.' + feature_type):
+                    ID = IDbase + '-' + str(id_generator_dict[IDbase])
+                    id_generator_dict[IDbase] = id_generator_dict[IDbase] + 1
+            else:
+                ID = IDbase
+                id_generator_dict[IDbase] = 1
+            other_attributes = {'evalue': fields[10], 'score': fields[11]}
+            child_to_set = ID
+            for parent_index in range(len(create_parents_chain)):
+                parent_feature = create_parents_chain[parent_index]
+                if not parent_feature in annotation_set.__dict__:
+                    setattr(annotation_set, parent_feature, {})
+                if parent_index != len(create_parents_chain) - 1:
+                    parent_to_set = ID + '-' + create_parents_chain[parent_index + 1]
+                else:
+                    parent_to_set = None
+                annotation_set.__dict__[parent_feature][ID + '-' + parent_feature] = genome.ParentAnnotation(ID + '-' + parent_feature, seqid,
+                                                        parent_feature, [child_to_set], parent_to_set, strand, annotation_set, other_attributes = {})
+                child_to_set = ID + '-' + parent_feature
+            eval('annotation_set.' + feature_type)[ID] = genome.BaseAnnotation(ID, seqid, coords, feature_type, ID + '-' + create_parents_chain[0],
+                                                                               strand, other_attributes, annotation_set)
+    return annotation_set
+
+
+def blast_parse(hit_counts = [20000, 100000], scaffold_count = 2000):
+    """times read_blast_csv of random tblastn hits to scaffolds whose names blast truncated at the first space, reading line by
+    line (legacy) and in chunks"""
+    print "#blast_parse: read_blast_csv(find_truncated_locname = True) of random hits to " + str(scaffold_count) + " scaffolds"
+    print "\t".join(["hits", "legacy_seconds", "chunked_seconds"])
+    genome_seqids = ['scaffold' + str(scaffold_number) + ' length=1000000' for scaffold_number in range(scaffold_count)]
+    subject_genome = genome.Genome('\n'.join(['>' + seqid + '\nACGT' for seqid in genome_seqids]))
+    temp_csv = tempfile.mktemp(suffix = '.csv')
+    for hit_count in hit_counts:
+        write_blast_csv(hit_count, temp_csv, [seqid.split()[0] for seqid in genome_seqids])
+        legacy_seconds = time_call(legacy_read_blast_csv, temp_csv, find_truncated_locname = True, genome_seqids = genome_seqids)
+        subject_genome.annotations = genome.AnnotationSet(subject_genome)
+        chunked_seconds = time_call(subject_genome.read_blast_csv, temp_csv, find_truncated_locname = True)
+        print "\t".join([str(hit_count), "%.2f" % legacy_seconds, "%.2f" % chunked_seconds])
+    os.remove(temp_csv)
+
+
+def blast_chain(hit_counts = [100000, 400000]):
+    """times read_blast_csv of random tblastn hits with and without chaining hits"""
+    print "#blast_chain: read_blast_csv of random hits to the O.biroi_refseqGenomeSubset.fasta scaffolds, with chain_hits"
+    print "\t".join(["hits", "chains", "unchained_seconds", "chained_seconds", "tandem_array_safe_seconds"])
+    seqids = genome.GenomeSequence('O.biroi_refseqGenomeSubset.fasta').keys()
+    temp_csv = tempfile.mktemp(suffix = '.csv')
+    for hit_count in hit_counts:
+        write_blast_csv(hit_count, temp_csv, seqids)
+        unchained_seconds = time_call(genome.read_blast_csv, temp_csv)
+        start = time.time()
+        chain_count = len(genome.read_blast_csv(temp_csv, chain_hits = True).match)
+        chained_seconds = time.time() - start
+        safe_seconds = time_call(genome.read_blast_csv, temp_csv, chain_hits = True, tandem_array_safe = True)
+        print "\t".join([str(hit_count), str(chain_count), "%.2f" % unchained_seconds, "%.2f" % chained_seconds,
+                         "%.2f" % safe_seconds])
+    os.remove(temp_csv)
+
+
+def random_feature_set(feature_count, seqid_lengths, feature_lengths = (100, 3000), seed = 0):
+    """returns AnnotationSet of feature_count random CDS features on seqids of seqid_lengths (a dictionary)"""
+    random.seed(seed)
+    annotation_set = genome.AnnotationSet()
+    annotation_set.CDS = {}
+    seqids = sorted(seqid_lengths)
+    for feature_number in range(feature_count):
+        seqid = random.choice(seqids)
+        start = random.randint(1, seqid_lengths[seqid] - feature_lengths[1])
+        ID = 'cds' + str(feature_number)
+        annotation_set.CDS[ID] = genome.BaseAnnotation(ID, seqid, (start, start + random.randint(*feature_lengths)), 'CDS',
+                                                       annotation_set = annotation_set)
+    return annotation_set
+
+
+def legacy_fill_from_annotations(positions, annotation_set, feature, fill_with = "1"):
+    """position_dic.fill_from_annotations (fill_type "coords") as it was when it set each position in turn, kept here as a
+    reference"""
+    features = getattr(annotation_set, feature)
+    for annotation in features:
+        annotation_obj = features[annotation]
+        coords = annotation_obj.get_coords()
+        for position in range(coords[0] - 1,coords[1]):
+            positions[annotation_obj.seqid][position] = eval(fill_with)
+
+
+def position_fill(genome_size = 100000000, feature_counts = [2000, 200000]):
+    """times position_dic.fill_from_annotations of random features on a genome of 10 scaffolds, filling coords (legacy and
+    by slices) and counting depth"""
+    print "#position_fill: fill_from_annotations of random 100-3000 bp features on a " + str(genome_size) + " bp genome"
+    print "\t".join(["features", "legacy_seconds", "coords_seconds", "count_seconds"])
+    seqid_lengths = dict([('scaffold' + str(scaffold_number), genome_size / 10) for scaffold_number in range(10)])
+    genome_sequence = dict([(seqid, 'N' * seqid_lengths[seqid]) for seqid in seqid_lengths])
+    for feature_count in feature_counts:
+        annotation_set = random_feature_set(feature_count, seqid_lengths)
+        if feature_count <= 2000:
+            legacy_seconds = "%.2f" % time_call(legacy_fill_from_annotations, genome.position_dic(genome_sequence), annotation_set, 'CDS')
+        else:
+            legacy_seconds = "NA"
+        coords_seconds = time_call(genome.position_dic(genome_sequence).fill_from_annotations, annotation_set, 'CDS')
+        count_seconds = time_call(genome.position_dic(genome_sequence, dtype = int).fill_from_annotations, annotation_set, 'CDS', "count")
+        print "\t".join([str(feature_count), legacy_seconds, "%.2f" % coords_seconds, "%.2f" % count_seconds])
+
+
+def legacy_count_from_annotations(positions, annotation_set, feature):
+    """position_dic.count_from_annotations as it was when it counted each position in turn, kept here as a reference"""
+    count_list = []
+    features = getattr(annotation_set, feature)
+    for annotation in features:
+        annotation_obj = features[annotation]
+        coords = annotation_obj.get_coords()
+        count0 = 0
+        count1 = 0
+        for position in range(coords[0] - 1,coords[1]):
+            if positions[annotation_obj.seqid][position] == 0:
+                count0 = count0 + 1
+            elif positions[annotation_obj.seqid][position] == 1:
+                count1 = count1 + 1
+        count_list.append([annotation_obj.ID,count0,count1])
+    return count_list
+
+
+def position_count(genome_size = 100000000, feature_counts = [2000, 50000]):
+    """times position_dic.count_from_annotations of random features over a mask of other random features on a genome of 10
+    scaffolds, counting each position (legacy) and from prefix sums, with and without the prefix sums already cached"""
+    print "#position_count: count_from_annotations of random 100-3000 bp features on a " + str(genome_size) + " bp genome"
+    print "\t".join(["features", "legacy_seconds", "prefix_sum_seconds", "cached_prefix_sum_seconds", "array_seconds"])
+    seqid_lengths = dict([('scaffold' + str(scaffold_number), genome_size / 10) for scaffold_number in range(10)])
+    positions = genome.position_dic(dict([(seqid, 'N' * seqid_lengths[seqid]) for seqid in seqid_lengths]))
+    positions.fill_from_annotations(random_feature_set(100000, seqid_lengths, seed = 1), 'CDS')
+    for feature_count in feature_counts:
+        annotation_set = random_feature_set(feature_count, seqid_lengths)
+        if feature_count <= 2000:
+            legacy_seconds = "%.2f" % time_call(legacy_count_from_annotations, positions, annotation_set, 'CDS')
+        else:
+            legacy_seconds = "NA"
+        prefix_sum_seconds = time_call(positions.count_from_annotations, annotation_set, 'CDS')
+        for seqid in positions:
+            positions.get_prefix_sums(seqid, cache = True)
+        cached_seconds = time_call(positions.count_from_annotations, annotation_set, 'CDS')
+        positions.clear_prefix_sums()
+        array_seconds = time_call(positions.count_from_annotations, annotation_set, 'CDS', "array")
+        print "\t".join([str(feature_count), legacy_seconds, "%.2f" % prefix_sum_seconds, "%.2f" % cached_seconds, "%.2f" % array_seconds])
+
+
+def legacy_window_sums(positions, window_size, window_jump):
+    """position_dic.sliding_window_calculate sums (dict output) as they were when each window was summed in turn, kept
+    here as a reference"""
+    new_dic = {}
+    for seqid in positions:
+        new_dic[seqid] = []
+        for position in range(0, len(positions[seqid]) - window_size, window_jump):
+            new_dic[seqid].append(numpy.sum(positions[seqid][position:position + window_size]))
+    return new_dic
+
+def sliding_windows(genome_size = 100000000, window_size = 1000, window_jumps = [1000, 100, 1]):
+    """times position_dic.sliding_window_calculate sums of windows of random features on a genome of 10 scaffolds, summing
+    each window (legacy, only where there are at most a million windows) and from cumulative sums"""
+    print "#sliding_windows: sums of " + str(window_size) + " bp windows on a " + str(genome_size) + " bp genome"
+    print "\t".join(["window_jump", "windows", "legacy_seconds", "cumsum_seconds", "average_seconds", "max_seconds"])
+    seqid_lengths = dict([('scaffold' + str(scaffold_number), genome_size / 10) for scaffold_number in range(10)])
+    positions = genome.position_dic(dict([(seqid, 'N' * seqid_lengths[seqid]) for seqid in seqid_lengths]))
+    positions.fill_from_annotations(random_feature_set(100000, seqid_lengths, seed = 1), 'CDS')
+    for window_jump in window_jumps:
+        window_count = genome_size / window_jump
+        if window_count <= 1000000:
+            legacy_seconds = "%.2f" % time_call(legacy_window_sums, positions, window_size, window_jump)
+        else:
+            legacy_seconds = "NA"
+        cumsum_seconds = time_call(positions.sliding_window_calculate, window_size, window_jump)
+        average_seconds = time_call(positions.sliding_window_calculate, window_size, window_jump, "average")
+        max_seconds = time_call(positions.sliding_window_calculate, window_size, window_jump, "max")
+        print "\t".join([str(window_jump), str(window_count), legacy_seconds, "%.2f" % cumsum_seconds, "%.2f" % average_seconds,
+                         "%.2f" % max_seconds])
+
+
+def position_track(store, genome_size):
+    """builds a bool position_dic of a genome of 10 scaffolds of genome_size in total, with store "memory", "memmap",
+    "packed" or "packed_memmap", fills it with the depth of random features, and counts and sums windows of it"""
+    genome_size = int(genome_size)
+    seqid_lengths = dict([('scaffold' + str(scaffold_number), genome_size / 10) for scaffold_number in range(10)])
+    scratch_dir = None
+    if store.endswith('memmap'):
+        scratch_dir = tempfile.gettempdir()
+    positions = genome.position_dic(dict([(seqid, xrange(seqid_lengths[seqid])) for seqid in seqid_lengths]),
+                                    scratch_dir = scratch_dir, pack_bits = store.startswith('packed'))
+    positions.fill_from_annotations(random_feature_set(100000, seqid_lengths, seed = 1), 'CDS', "count")
+    positions.count_from_annotations(random_feature_set(20000, seqid_lengths), 'CDS')
+    positions.sliding_window_calculate(1000, 1000)
+
+def position_store(genome_size = 300000000, stores = ["memory", "memmap", "packed", "packed_memmap"]):
+    """compares peak memory and time of building, counting and sliding windows over a bool track of a genome (see
+    position_track) held in memory, memory-mapped, bit-packed, and both. Pages of memory-mapped files count towards peak
+    memory while they are in use, but unlike the arrays held in memory they can be dropped when memory runs short"""
+    print "#position_store: bool position_dic of a " + str(genome_size) + " bp genome by backing store"
+    print "\t".join(["store", "peak_MB", "seconds"])
+    for store in stores:
+        memory, peak_memory, seconds = memory_of_call('position_track', store, str(genome_size))
+        print "\t".join([store, "%.0f" % peak_memory, "%.1f" % seconds])
+
+
+benchmark_list = [gff_load, gff_tokenize, fasta_parse, indexed_slice, packed_genome, genome_cache, reverse_compliment, translate,
+                  orf_scan, overlap, gff_memory, gff_write, gff_sort,
+                  seqid_split, apollo_export, exonerate_parse, blast_parse, blast_chain,
+                  position_fill, position_count, sliding_windows, position_store]
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['measure']:
+        print " ".join([str(value) for value in measure_call(globals()[sys.argv[2]], *sys.argv[3:])])
+        sys.exit()
+    for benchmark in benchmark_list:
+        if len(sys.argv) == 1 or benchmark.__name__ in sys.argv[1:]:
+            benchmark()
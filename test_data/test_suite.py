@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 #Runs a suite of tests to make sure MAGOT is functioning properly
 
+import glob
+import os
 import sys
 import subprocess
+import numpy
+sys.path.insert(0, '..')
+import genome
 
 command_list = [
     ('exclude_from_fasta O.biroi_refseqGenomeSubset.fasta NW_011924881.1 > temp.test', "1797510917 256187 temp.test"),
@@ -15,13 +20,299 @@ command_list = [
     ('convert_gff minimalGFF3.gff gff3 gtf > temp.test','1904390924 226225 temp.test'),
     ('convert_gff StandardGTF.gtf gtf gff3 > temp.test','2934568300 276674 temp.test')
     ,('convert_gff StandardGTF.gtf gtf exon_added_gff3 > temp.test','2624776569 512324 temp.test')
+    ,('gff2fasta O.biroi_refseqGenomeSubset.fasta O.biroi_NCBIrefseq_gff3Subset.gff > temp.test','724746149 152424 temp.test')
+    ,('gff2fasta O.biroi_refseqGenomeSubset.fasta O.biroi_NCBIrefseq_gff3Subset.gff from_exons=True > temp.test','1075427116 221010 temp.test')
+    ,('dna2orfs O.biroi_refseqGenomeSubset.fasta temp.test min_length=100','3177847497 455153 temp.test')
+    ,('dna2orfs O.biroi_refseqGenomeSubset.fasta temp.test from_atg=True min_length=50','3477654658 434721 temp.test')
     ]
 
-for command in command_list:
-    subprocess.call('python ../genome_tools.py ' + command[0], shell = True)
+#Functions that write the output of a path through genome.py to an open file. Their cksums are those of the output of
+#the implementation the path replaced (e.g. the per-position loop at_content used to be) on the same data. Where there
+#was no such implementation, they are those of the same output found directly: interval queries by checking the coords
+#of every feature, and chained hits from the CDS of each mRNA. ORFs were found with the old per-frame translation, with
+#the changes get_orfs made to it (each frame starting at its first codon, no empty ORFs, and from_atg keeping later Ms)
+
+genome_fasta = 'O.biroi_refseqGenomeSubset.fasta'
+genome_gff = 'O.biroi_NCBIrefseq_gff3Subset.gff'
+
+def write_sorted_lines(text, out):
+    out.write('\n'.join(sorted(text.split('\n'))) + '\n')
+
+def write_sequences(genome_sequence, out):
+    for seqid in sorted(genome_sequence):
+        sequence = genome_sequence[seqid]
+        length = len(sequence)
+        out.write('>' + seqid + '\n' + sequence[:] + '\n' + sequence[length / 3:length / 2] + '\n' + sequence[-100:] + '\n')
+
+def write_positions(positions, out):
+    for seqid in sorted(positions):
+        out.write('>' + seqid + '\n' + (numpy.asarray(positions[seqid]).astype(numpy.uint8) + ord('0')).tostring() + '\n')
+
+def at_content_test(out):
+    genome_sequence = genome.Genome(genome_fasta).genome_sequence
+    positions = genome.position_dic(genome_sequence)
+    positions.at_content(genome_sequence)
+    write_positions(positions, out)
+
+def position_dic_test(scratch_dir, pack_bits):
+    def test(out):
+        genome_sequence = genome.Genome(genome_fasta).genome_sequence
+        annotation_set = genome.read_gff(genome_gff)
+        positions = genome.position_dic(genome_sequence, scratch_dir = scratch_dir, pack_bits = pack_bits, chunk_size = 2**16)
+        positions.fill_from_annotations(annotation_set, 'CDS', fill_with = "1")
+        at_positions = genome.position_dic(genome_sequence, scratch_dir = scratch_dir, pack_bits = pack_bits, chunk_size = 2**16)
+        at_positions.at_content(genome_sequence)
+        for track in [positions, at_positions]:
+            write_positions(track, out)
+            window_sums = track.sliding_window_calculate(1000, 500)
+            for seqid in sorted(window_sums):
+                out.write(seqid + '\t' + ' '.join([str(int(window_sum)) for window_sum in window_sums[seqid]]) + '\n')
+        for ID, count0, count1 in sorted(positions.count_from_annotations(annotation_set, 'mRNA')):
+            out.write('\t'.join([ID, str(count0), str(count1)]) + '\n')
+    return test
+
+def position_write_test(out):
+    #counts and window sums follow positions written directly, and float32 values are summed without losing precision
+    annotation_set = genome.AnnotationSet()
+    annotation_set.CDS['x'] = genome.BaseAnnotation('x', 's', (1, 50), 'CDS', annotation_set = annotation_set)
+    positions = genome.position_dic({'s': 'N' * 100}, dtype = int)
+    out.write(str(positions.count_from_annotations(annotation_set, 'CDS')) + '\n')
+    positions['s'][:] = 1
+    out.write(str(positions.count_from_annotations(annotation_set, 'CDS')) + '\n')
+    positions.get_prefix_sums('s', "ones", cache = True)
+    positions['s'][:25] = 0
+    positions.clear_prefix_sums()
+    out.write(str(positions.count_from_annotations(annotation_set, 'CDS')) + '\n')
+    out.write(' '.join(map(str, positions.sliding_window_calculate(20, 10)['s'])) + '\n')
+    float_positions = genome.position_dic({'s': 'N' * 10000}, dtype = numpy.float32)
+    float_positions['s'][:] = 0.1
+    annotation_set.CDS['x'].coords = (1, 10000)
+    out.write('%.2f\n' % positions.count_from_annotations(annotation_set, 'CDS', "array")['sum'][0])
+    out.write('%.2f\n' % float_positions.count_from_annotations(annotation_set, 'CDS', "array")['sum'][0])
+    for window_jump in [1000, 10]:
+        window_sums = float_positions.sliding_window_calculate(1000, window_jump)['s']
+        out.write('%.2f %.2f\n' % (window_sums.min(), window_sums.max()))
+
+def fill_with_names_test(out):
+    #fill_with strings may use the names they could when they were evaluated among fill_from_annotations' variables
+    annotation_set = genome.AnnotationSet()
+    for ID, coords in [('a', (1, 3)), ('bb', (5, 6))]:
+        annotation_set.CDS[ID] = genome.BaseAnnotation(ID, 's', coords, 'CDS', annotation_set = annotation_set)
+    for fill_type, fill_with in [("coords", "len(getattr(annotation_set, feature)) * 10 + len(annotation) + (fill_type == 'coords')"),
+                                 ("start", "position + len(ID) + (self['s'][position] == 0)")]:
+        positions = genome.position_dic({'s': 'N' * 8}, dtype = int)
+        positions.fill_from_annotations(annotation_set, 'CDS', fill_type, fill_with)
+        out.write(' '.join(map(str, positions['s'])) + '\n')
+
+def genome_cache_test(out):
+    #the first run saves the cache and the second reads it, which should give the output of gff2fasta without a cache
+    for cache_file in glob.glob(genome_fasta + '.*.magot_cache.npz'):
+        os.remove(cache_file)
+    for run in range(2):
+        output = subprocess.check_output(['python', '../genome_tools.py', 'gff2fasta', genome_fasta, genome_gff, 'cache=True'])
+    out.write(output)
+    for cache_file in glob.glob(genome_fasta + '.*.magot_cache.npz'):
+        os.remove(cache_file)
+
+def sorted_gff_test(memory_budget):
+    #a budget of 64 kb spills the lines to a dozen or so sorted runs, which should merge into the order of the in-memory sort
+    def test(out):
+        genome.write_gff(genome.read_gff('StandardGTF.gtf'), 'extended gff3', out_file = out, sort_output = True,
+                         memory_budget = memory_budget)
+    return test
+
+def indexed_genome_test(out):
+    had_index = os.path.exists(genome_fasta + '.fai')
+    write_sequences(genome.Genome(genome_fasta, indexed = True).genome_sequence, out)
+    if not had_index:
+        os.remove(genome_fasta + '.fai')
+
+def packed_genome_test(out):
+    write_sequences(genome.Genome(genome_fasta, packed = True).genome_sequence, out)
+
+def orf_test(out):
+    genome_sequence = genome.Genome(genome_fasta).genome_sequence
+    for seqid in sorted(genome_sequence):
+        sequence = genome.Sequence(genome_sequence[seqid])
+        for orfs in [sequence.get_orfs(), sequence.get_orfs(from_atg = True)]:
+            out.write('\n'.join(sorted(orfs)) + '\n')
+        out.write(sequence.get_orfs(longest = True) + '\n')
+
+def interval_index_test(out):
+    annotation_set = genome.read_gff(genome_gff)
+    genome_sequence = genome.Genome(genome_fasta).genome_sequence
+    for seqid in sorted(genome_sequence):
+        for start in range(1, len(genome_sequence[seqid]), 20000):
+            for feature_type in [None, 'CDS']:
+                for query in [annotation_set.overlapping, annotation_set.contained_in, annotation_set.contains]:
+                    out.write(' '.join(sorted(query(seqid, start, start + 30000, feature_type))) + '\n')
+
+def presets_test(out):
+    for gtf in ['StandardGTF.gtf', 'transcriptlessGTF.gtf']:
+        write_sorted_lines(genome.write_gff(genome.read_gff(gtf, presets = 'augustus'), 'extended gff3'), out)
+
+def get_CDS_hits(annotation_set):
+    """returns blast csv of a tblastn-like hit of each mRNA's protein to each of its CDS"""
+    hit_lines = []
+    for mRNA_ID in sorted(annotation_set.mRNA):
+        mRNA = annotation_set.mRNA[mRNA_ID]
+        CDS_coords = sorted([annotation_set[child].coords for child in mRNA.child_list if annotation_set[child].feature_type == 'CDS'],
+                            reverse = mRNA.strand == '-')
+        query_end = 0
+        for start, end in CDS_coords:
+            query_start = query_end + 1
+            query_end = query_end + max((end - start + 1) / 3, 1)
+            if mRNA.strand == '-':
+                start, end = end, start
+            hit_lines.append(','.join([mRNA_ID, mRNA.seqid, '100.0', str(query_end - query_start + 1), '0', '0', str(query_start),
+                                       str(query_end), str(start), str(end), '1e-50', '200']))
+    return '\n'.join(hit_lines) + '\n'
+
+def blast_test(out):
+    hits = get_CDS_hits(genome.read_gff(genome_gff))
+    write_sorted_lines(genome.write_gff(genome.read_blast_csv(hits), 'extended gff3'), out)
+
+def blast_chain_test(out):
+    #the hits of each mRNA should be chained into one match spanning its CDS
+    annotation_set = genome.read_blast_csv(get_CDS_hits(genome.read_gff(genome_gff)), chain_hits = True, max_intron = 10**7)
+    for match_ID in sorted(annotation_set.match):
+        match = annotation_set.match[match_ID]
+        part_coords = sorted([annotation_set[child].coords for child in match.child_list])
+        out.write('\t'.join([match.seqid, match.strand, str(match.get_coords())] + [str(coords) for coords in part_coords]) + '\n')
+
+def shared_ID_test(out):
+    #lookups of an ID that several feature types have give the feature whose type comes last in sorted order, and each
+    #feature type keeps its own feature with the ID
+    annotation_set = genome.AnnotationSet()
+    annotation_set.gene['X'] = genome.ParentAnnotation('X', 'seq', 'gene', ['X-CDS'], annotation_set = annotation_set)
+    annotation_set.CDS['X'] = genome.BaseAnnotation('X', 'seq', (1, 10), 'CDS', 'X', annotation_set = annotation_set)
+    out.write(annotation_set['X'].feature_type + '\n')
+    annotation_set.transcript['X'] = genome.ParentAnnotation('X', 'seq', 'transcript', [], 'X', annotation_set = annotation_set)
+    out.write(' '.join([str(len(annotation_set.gene)), str(len(annotation_set.CDS)), str(len(annotation_set.ID_index)),
+                        ' '.join(annotation_set.ID_index.keys())]) + '\n')
+    for feature_type in ['transcript', 'gene', 'CDS']:
+        out.write(annotation_set['X'].feature_type + ' ' + getattr(annotation_set, feature_type)['X'].feature_type + '\n')
+        del getattr(annotation_set, feature_type)['X']
+    try:
+        annotation_set['X']
+    except KeyError:
+        out.write('KeyError\n')
+
+def incremental_read_test(out):
+    #the file is read in two parts split within a transcript, so the second read adds children to parents from the first
+    lines = open('minimalGFF3.gff').readlines()
+    annotation_set = genome.AnnotationSet()
+    for part in [lines[:1777], lines[1777:]]:
+        genome.read_gff(''.join(part), annotation_set_to_modify = annotation_set)
+    for feature_type in ['gene', 'transcript']:
+        for ID in sorted(getattr(annotation_set, feature_type)):
+            out.write(ID + '\t' + str(annotation_set[ID].get_coords()) + '\n')
+
+def vulgar2gff_test(out):
+    #the first aligned block runs from 6 to 15, so its coords must be compared as numbers rather than strings
+    for strand, start, end in [('+', '5', '129'), ('-', '129', '5')]:
+        vulgar_line = 'query 0 30 + target %s %s %s 100 M 10 10 5 0 2 I 0 80 3 0 2 M 20 20' % (start, end, strand)
+        out.write(genome.vulgar2gff(vulgar_line.split()) + '\n')
+
+def purge_overlaps_test(out):
+    #features that touch the purge feature or have its coords are kept, as only ends strictly inside it count
+    for gff, features in [('temp.purge.gff', [('seq', 10, 20)]),
+                          ('temp.features.gff', [('seq', 1, 10), ('seq', 20, 30), ('seq', 10, 20), ('seq', 5, 15), ('seq', 15, 25),
+                                                 ('seq', 12, 18), ('seq', 1, 30), ('seq', 21, 30), ('seq2', 12, 18)])]:
+        open(gff, 'w').write(''.join(['\t'.join([seqid, 'test', 'CDS', str(start), str(end), '.', '+', '0',
+                                                  'ID=' + seqid + '-' + str(start)]) + '\n' for seqid, start, end in features]))
+    out.write(subprocess.check_output(['python', '../genome_tools.py', 'purge_overlaps', 'temp.purge.gff', 'temp.features.gff']))
+    os.remove('temp.purge.gff')
+    os.remove('temp.features.gff')
+
+exonerate_records = [
+    ('q1 protein one', 'NW_011924880.1', 'q1 0 30 + NW_011924880.1 1000 1174 + 100 M 10 30 5 0 2 I 0 80 3 0 2 M 20 60'),
+    ('q2', 'NW_011924880.1:[revcomp]', 'q2 0 40 + NW_011924880.1 5120 4900 - 150 M 15 45 5 0 2 I 0 95 3 0 2 M 25 75'),
+    ('q2', 'NW_011924880.1:[revcomp]', 'q2 3 40 + NW_011924880.1 9120 9009 - 90 M 37 111'),
+    ('q3', 'NW_011924877.1', 'q3 0 12 + NW_011924877.1 20 56 + 60 M 12 36')]
+
+def write_exonerate_outputs():
+    """writes exonerate_records to two files of exonerate output and returns their locations"""
+    exonerate_files = []
+    for file_number, records in enumerate([exonerate_records[:2], exonerate_records[2:]]):
+        exonerate_files.append('temp.exonerate' + str(file_number + 1) + '.txt')
+        open(exonerate_files[-1], 'w').write(''.join(['C4 Alignment:\n------------\n         Query: ' + query + '\n        Target: ' +
+                                                     target + '\n\nvulgar: ' + vulgar + '\n' for query, target, vulgar in records]))
+    return exonerate_files
+
+def exonerate_test(out):
+    #read_exonerate of one file, and of both files read by worker processes, each written as gff
+    exonerate_files = write_exonerate_outputs()
+    for exonerate_output, workers in [(exonerate_files[0], 1), (exonerate_files, 2)]:
+        write_sorted_lines(genome.write_gff(genome.read_exonerate(exonerate_output, workers = workers), 'extended gff3'), out)
+    for exonerate_file in exonerate_files:
+        os.remove(exonerate_file)
+
+def prep4apollo_test(workers):
+    #the per-scaffold apollo gffs of the genome's gff and exonerate outputs given as a glob pattern
+    def test(out):
+        exonerate_files = write_exonerate_outputs()
+        subprocess.check_output(['python', '../genome_tools.py', 'prep4apollo', genome_fasta, 'output_directory=temp_apollo',
+                                 'other_gff=' + genome_gff, 'exonerate_output=temp.exonerate*.txt', 'mapping_threads=' + str(workers)])
+        for gff in sorted(os.listdir('temp_apollo')):
+            out.write(gff + '\n' + open(os.path.join('temp_apollo', gff)).read())
+        subprocess.call('rm -rf temp_apollo', shell = True)
+        for exonerate_file in exonerate_files:
+            os.remove(exonerate_file)
+    return test
+
+def apollo_gff_test(out):
+    #the gene has a Name its transcript lacks, and each transcript's attributes come from the transcript alone
+    gff = '\n'.join(['\t'.join(['seq', 'test', feature_type, start, end, '.', '+', phase, attributes]) for feature_type, start, end, phase, attributes in [
+        ('gene', '11', '40', '.', 'ID=gene1;Name=foo'),
+        ('transcript', '11', '40', '.', 'ID=mRNA1;Parent=gene1'),
+        ('CDS', '11', '40', '0', 'ID=CDS1;Parent=mRNA1')]])
+    test_genome = genome.Genome('>seq\n' + 'ACGT' * 15, genome.read_gff(gff))
+    out.write(test_genome.write_apollo_gff('seq') + '\n')
+    test_genome.write_apollo_gff('seq', out_file = out)
+    out.write('\n')
+
+function_list = [
+    ('position_dic.at_content', at_content_test, '3768944903 1272889 temp.test'),
+    ('gff2fasta(cache = "True") read from the cache', genome_cache_test, '724746149 152424 temp.test'),
+    ('write_gff(sort_output = True)', sorted_gff_test(2**30), '4233327855 420489 temp.test'),
+    ('write_gff(sort_output = True) spilled to sorted runs', sorted_gff_test(2**16), '4233327855 420489 temp.test'),
+    ('Genome(indexed = True)', indexed_genome_test, '203499476 1485632 temp.test'),
+    ('Genome(packed = True)', packed_genome_test, '203499476 1485632 temp.test'),
+    ('Sequence.get_orfs', orf_test, '2142796175 3254015 temp.test'),
+    ('AnnotationSet interval index queries', interval_index_test, '727106259 34186 temp.test'),
+    ('read_gff(presets = "augustus")', presets_test, '1239500630 716812 temp.test'),
+    ('read_blast_csv', blast_test, '2223957832 116702 temp.test'),
+    ('read_blast_csv(chain_hits = True)', blast_chain_test, '3982218221 14040 temp.test'),
+    ('AnnotationSet lookups of shared IDs', shared_ID_test, '2065299814 62 temp.test'),
+    ('read_gff into an existing AnnotationSet', incremental_read_test, '143683884 25187 temp.test'),
+    ('vulgar2gff with coords of different lengths', vulgar2gff_test, '143621864 541 temp.test'),
+    ('purge_overlaps of touching features', purge_overlaps_test, '1842886058 175 temp.test'),
+    ('read_exonerate', exonerate_test, '3743951741 2232 temp.test'),
+    ('prep4apollo', prep4apollo_test(1), '2912218842 1281812 temp.test'),
+    ('prep4apollo(mapping_threads = 3)', prep4apollo_test(3), '2912218842 1281812 temp.test'),
+    ('Genome.write_apollo_gff of a gene with attributes its transcript lacks', apollo_gff_test, '870930164 512 temp.test'),
+    ('position_dic counts after positions are written directly', position_write_test, '861156025 110 temp.test'),
+    ('position_dic.fill_from_annotations names', fill_with_names_test, '4118482782 37 temp.test'),
+    ('memory-mapped position_dic', position_dic_test('.', False), '1787857228 2563129 temp.test'),
+    ('bit-packed position_dic', position_dic_test(None, True), '1787857228 2563129 temp.test'),
+    ('memory-mapped bit-packed position_dic', position_dic_test('.', True), '1787857228 2563129 temp.test')
+    ]
+
+def check_cksum(test_type, description, expected_cksum):
     subprocess.call('cksum temp.test > temp.cksum',shell = True)
     cksum = open('temp.cksum').read()[:-1]
-    if cksum == command[1]:
-        print 'Command: "' + command[0] + '" successful! :)'
+    if cksum == expected_cksum:
+        print test_type + ': "' + description + '" successful! :)'
     else:
-        print 'Command: "' + command[0] + '" failed :(\n\tcksum was:\t\t' + cksum + "\n\tcksum should have been:\t" + command[1]
\ No newline at end of file
+        print test_type + ': "' + description + '" failed :(\n\tcksum was:\t\t' + cksum + "\n\tcksum should have been:\t" + expected_cksum
+
+for command in command_list:
+    subprocess.call('python ../genome_tools.py ' + command[0], shell = True)
+    check_cksum('Command', command[0], command[1])
+
+for function in function_list:
+    out = open('temp.test', 'w')
+    function[1](out)
+    out.close()
+    check_cksum('Function', function[0], function[2])
\ No newline at end of file